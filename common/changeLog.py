@@ -0,0 +1,151 @@
+"""
+Append-only log of changes stored next to a data snapshot.
+
+Locks have the form "<base>:<sequence number>". The base identifies the
+snapshot in the data file, and record n of the log holds changes which
+lead from lock "<base>:<n - 1>" to "<base>:<n>". Older locks without
+a sequence number refer to the snapshot itself.
+
+Writers append one small record per mutation and rewrite the whole
+snapshot (starting a new base) only every `compactEvery` records. Readers
+which already have data at some lock of the current base fetch and replay
+only the records after it.
+
+A record is written before the lock file, and it is the record that
+commits the changes: records after the lock (left by a writer which failed
+before updating the lock file) are replayed, and the lock moved past them,
+by the next refresh.
+"""
+
+from collections.abc import Callable
+from common import fileOperations
+import json
+import logging
+import os
+import uuid
+
+COMPACT_EVERY = int(os.environ.get("CHANGE_LOG_COMPACT_EVERY", "100"))
+
+log = logging.getLogger("uvicorn")
+
+
+def parse_lock(lock) -> tuple[str, int]:
+    """Splits the lock into base and sequence number."""
+    base, _, seq = str(lock).partition(":")
+    return base, int(seq) if seq else 0
+
+
+def make_lock(base, seq) -> str:
+    return "{}:{}".format(base, seq)
+
+
+class ConflictError(Exception):
+    """Another writer has appended to the log at the same lock."""
+
+
+class ChangeLog:
+    def __init__(self, data_file, lock_file, compact_every=COMPACT_EVERY):
+        self.dataFile = data_file
+        self.lockFile = lock_file
+        self.compactEvery = compact_every
+        # Generation and content of the lock file when it was last read.
+        self.__seen = (None, None)
+
+    def __prefix(self, base):
+        return "log_{}/{}/".format(self.dataFile, base)
+
+    def __record_path(self, base, seq):
+        return "{}{:012d}".format(self.__prefix(base), seq)
+
+    def __read_tail(self, lock, new_lock) -> list[list[dict]] | None:
+        """
+        Returns records leading from lock to new_lock, or None if they are
+        not available and the snapshot has to be loaded instead.
+        """
+        base, seq = parse_lock(lock)
+        new_base, new_seq = parse_lock(new_lock)
+        if base != new_base or seq > new_seq:
+            return None
+        try:
+            return [
+                json.loads(fileOperations.read_file(self.__record_path(base, i)))
+                for i in range(seq + 1, new_seq + 1)
+            ]
+        except Exception as e:
+            # Records are deleted after compaction.
+            log.warning("Cannot read change log tail: {}".format(e))
+            return None
+
+    def __read_committed(self, lock) -> list[list[dict]]:
+        """Returns records written after lock, which the lock file misses."""
+        base, seq = parse_lock(lock)
+        records = []
+        while True:
+            path = self.__record_path(base, seq + len(records) + 1)
+            if fileOperations.get_generation(path) == 0:
+                return records
+            records.append(json.loads(fileOperations.read_file(path)))
+
+    def save(self, lock, changes: list[dict], dump: Callable[[str], bytes]) -> str:
+        """
+        Persists changes made to data which was at lock and returns the new
+        lock. Every compactEvery changes, dump(new lock) is called instead
+        to get the snapshot of data, which starts a new log.
+        Raises ConflictError if the record has already been written; data
+        has to be refreshed from storage then, as it also has to be after
+        any other failure.
+        """
+        base, seq = parse_lock(lock)
+        if seq + 1 < self.compactEvery:
+            new_lock = make_lock(base, seq + 1)
+            path = self.__record_path(base, seq + 1)
+            if not fileOperations.save_file_if(path, json.dumps(changes), 0):
+                raise ConflictError("Change log record {} exists".format(path))
+            fileOperations.save_file(self.lockFile, new_lock)
+            return new_lock
+
+        new_lock = make_lock(uuid.uuid4(), 0)
+        fileOperations.save_bytes(self.dataFile, dump(new_lock))
+        fileOperations.save_file(self.lockFile, new_lock)
+        for path in fileOperations.list_files(self.__prefix(base)):
+            fileOperations.delete_file(path)
+        return new_lock
+
+    def refresh(
+        self,
+        lock,
+        load: Callable[[bytes], str],
+        replay: Callable[[list[dict]], None],
+    ) -> str:
+        """
+        Brings data which is at lock up to date and returns its new lock.
+        Records after lock are passed to replay if possible; otherwise
+        load(snapshot) replaces data and returns the snapshot's lock first.
+        The lock file is read only if its generation changed, so checking
+        for changes costs one metadata request.
+        """
+        generation = fileOperations.get_generation(self.lockFile)
+        if self.__seen == (generation, lock):
+            return lock
+        current = fileOperations.read_file(self.lockFile)
+        self.__seen = (generation, current)
+        committed = self.__read_committed(current)
+        if committed:
+            base, seq = parse_lock(current)
+            current = make_lock(base, seq + len(committed))
+            log.warning("{} is behind, moving it to {}".format(self.lockFile, current))
+            # Unless someone else has moved it in the meantime.
+            fileOperations.save_file_if(self.lockFile, current, generation)
+        if current == lock:
+            return lock
+
+        records = self.__read_tail(lock, current)
+        if records is None:
+            lock = load(fileOperations.read_bytes(self.dataFile))
+            records = self.__read_tail(lock, current)
+            if records is None:
+                return lock
+
+        for record in records:
+            replay(record)
+        return current
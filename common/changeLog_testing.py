@@ -0,0 +1,147 @@
+import json
+import tempfile
+import unittest
+from common import changeLog, fileOperations
+
+
+def dump_state(state):
+    """Returns dump for ChangeLog.save of a list of numbers."""
+    return lambda lock: json.dumps({"lock": lock, "state": state}).encode()
+
+
+class ChangeLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous = fileOperations.backend
+        fileOperations.backend = fileOperations.LocalStorage(self.directory.name)
+
+    def tearDown(self):
+        fileOperations.backend = self.previous
+        self.directory.cleanup()
+
+    def load_into(self, replayed):
+        """Returns load for ChangeLog.refresh filling replayed from a snapshot."""
+
+        def load(raw_data):
+            snapshot = json.loads(str(raw_data, "utf-8"))
+            replayed[:] = [{"op": "x", "n": n} for n in snapshot["state"]]
+            return snapshot["lock"]
+
+        return load
+
+    def test_save(self):
+        writer = changeLog.ChangeLog("data_A.json", "lock_A.lock", compact_every=5)
+        lock = writer.save("base:0", [{"op": "x", "n": 0}], None)
+        self.assertEqual("base:1", lock)
+        self.assertEqual("base:1", fileOperations.read_file("lock_A.lock"))
+        self.assertEqual(
+            [[{"op": "x", "n": 0}]],
+            [
+                json.loads(fileOperations.read_file(path))
+                for path in fileOperations.list_files("log_")
+            ],
+        )
+
+    def test_change_log(self):
+        writer = changeLog.ChangeLog("data_A.json", "lock_A.lock", compact_every=3)
+        state = []
+        dump = dump_state(state)
+
+        state.append(0)
+        lock = writer.save("base", [{"op": "x", "n": 0}], dump)
+        self.assertEqual("base:1", lock)
+        with self.assertRaises(changeLog.ConflictError):
+            writer.save("base", [{"op": "x", "n": 9}], dump)
+
+        replayed = []
+        reader = changeLog.ChangeLog("data_A.json", "lock_A.lock")
+        self.assertEqual(
+            "base:1", reader.refresh("base", None, replayed.extend)
+        )
+        self.assertEqual([{"op": "x", "n": 0}], replayed)
+
+        state.append(1)
+        lock = writer.save(lock, [{"op": "x", "n": 1}], dump)
+        state.append(2)
+        lock = writer.save(lock, [{"op": "x", "n": 2}], dump)
+        self.assertEqual([], fileOperations.list_files("log_"))
+
+        load = self.load_into(replayed)
+        self.assertEqual(lock, reader.refresh("base:1", load, replayed.extend))
+        self.assertEqual([0, 1, 2], [change["n"] for change in replayed])
+
+    def test_compaction(self):
+        writer = changeLog.ChangeLog("data_A.json", "lock_A.lock", compact_every=2)
+        state = [0]
+        lock = writer.save("base:0", [{"op": "x", "n": 0}], dump_state(state))
+        state.append(1)
+        lock = writer.save(lock, [{"op": "x", "n": 1}], dump_state(state))
+        base, seq = changeLog.parse_lock(lock)
+        self.assertNotEqual("base", base)
+        self.assertEqual(0, seq)
+        self.assertEqual([], fileOperations.list_files("log_"))
+
+        # A reader at the old base loads the snapshot.
+        replayed = []
+        reader = changeLog.ChangeLog("data_A.json", "lock_A.lock")
+        load = self.load_into(replayed)
+        self.assertEqual(lock, reader.refresh("base:1", load, replayed.extend))
+        self.assertEqual([0, 1], [change["n"] for change in replayed])
+
+    def test_conflict(self):
+        first = changeLog.ChangeLog("data_A.json", "lock_A.lock")
+        second = changeLog.ChangeLog("data_A.json", "lock_A.lock")
+        first.save("base:0", [{"op": "x", "n": 0}], None)
+        with self.assertRaises(changeLog.ConflictError):
+            second.save("base:0", [{"op": "x", "n": 1}], None)
+        self.assertEqual("base:1", fileOperations.read_file("lock_A.lock"))
+
+    def test_change_detection(self):
+        fileOperations.save_file("lock_A.lock", "base:0")
+        reader = changeLog.ChangeLog("data_A.json", "lock_A.lock")
+        reads = []
+        read = fileOperations.backend.read
+        fileOperations.backend.read = lambda path: reads.append(path) or read(path)
+
+        self.assertEqual("base:0", reader.refresh("base:0", None, None))
+        self.assertEqual("base:0", reader.refresh("base:0", None, None))
+        self.assertEqual(["lock_A.lock"], reads)
+
+        fileOperations.save_file("log_data_A.json/base/000000000001", "[[1]]")
+        fileOperations.save_file("lock_A.lock", "base:1")
+        replayed = []
+        self.assertEqual("base:1", reader.refresh("base:0", None, replayed.append))
+        self.assertEqual([[[1]]], replayed)
+        self.assertEqual("base:1", reader.refresh("base:1", None, None))
+        self.assertEqual(3, len(reads))
+
+    def test_recovery(self):
+        fileOperations.save_file("lock_A.lock", "base:0")
+        writer = changeLog.ChangeLog("data_A.json", "lock_A.lock")
+        save_file = fileOperations.save_file
+
+        def fail(path, data):
+            raise OSError("lock file not written")
+
+        # The record is written, the lock file update fails.
+        fileOperations.save_file = fail
+        try:
+            with self.assertRaises(OSError):
+                writer.save("base:0", [{"op": "x", "n": 0}], None)
+        finally:
+            fileOperations.save_file = save_file
+        self.assertEqual("base:0", fileOperations.read_file("lock_A.lock"))
+
+        # The record counts as committed: it is replayed and the lock moved.
+        replayed = []
+        restarted = changeLog.ChangeLog("data_A.json", "lock_A.lock")
+        self.assertEqual("base:1", restarted.refresh("base:0", None, replayed.extend))
+        self.assertEqual([{"op": "x", "n": 0}], replayed)
+        self.assertEqual("base:1", fileOperations.read_file("lock_A.lock"))
+        self.assertEqual(
+            "base:2", restarted.save("base:1", [{"op": "x", "n": 1}], None)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
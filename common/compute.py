@@ -0,0 +1,186 @@
+"""
+CPU-bound searches, run either in the request threadpool or, with
+COMPUTE_PROCESSES set above 0, in a pool of that many processes, so
+concurrent queries are not serialized by the GIL.
+
+Each process keeps the read-only data searches need (e.g. a shard's graph)
+together with its version. Tasks carry only the version and arguments;
+a process holding another version answers that it is stale and the task
+is sent again with the data, which the process then keeps. Data is read
+after its version, so processes never keep data older than its version.
+"""
+
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
+from starlette.concurrency import run_in_threadpool
+from common import graph
+from common.contraction import ContractionHierarchy
+
+# Data kept by this process, as key -> (version, data). Filled only in
+# pool processes.
+_loaded: dict[str, tuple] = {}
+
+
+def _run(key, version, data, function, args) -> tuple[bool, object]:
+    """Runs function in a pool process. Returns (False, None) if stale."""
+    if data is not None:
+        _loaded[key] = (version, data)
+    loaded = _loaded.get(key)
+    if loaded is None or loaded[0] != version:
+        return False, None
+    return True, function(loaded[1], *args)
+
+
+class ComputePool:
+    """Runs searches on versioned read-only data, in processes if enabled."""
+
+    def __init__(self, processes: int):
+        self.processes = processes
+        self.__executor = None
+        if processes > 0:
+            # Processes are started on demand. Forking a process with running
+            # threads is unsafe, so they start from a fresh interpreter.
+            self.__executor = ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    async def run(self, key, version, data: Callable[[], object], function, *args):
+        """
+        Returns function(data(), *args). Versions of the same key must differ
+        whenever data() would return something else. function must be defined
+        at the top level of a module, which pool processes import.
+        """
+        if self.__executor is None:
+            return await run_in_threadpool(lambda: function(data(), *args))
+
+        done, result = await asyncio.wrap_future(
+            self.__executor.submit(_run, key, version, None, function, args)
+        )
+        if not done:
+            # data() may have to build what it returns first.
+            payload = await run_in_threadpool(data)
+            done, result = await asyncio.wrap_future(
+                self.__executor.submit(_run, key, version, payload, function, args)
+            )
+        return result
+
+    def close(self):
+        """Stops pool processes."""
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+
+
+def connection(shard: tuple[graph.Graph, graph.DistanceIndex], a: str, b: str):
+    """
+    Returns the distance and the path from a to b in a shard, given as its
+    graph and landmarks, or (None, None) if they are not connected.
+    """
+    network, landmarks = shard
+    tree = network.point_to_point(a, b, landmarks)
+    return tree.distance(b), tree.path(b)
+
+
+def route(
+    overlay: tuple[graph.Graph, ContractionHierarchy | None],
+    start,
+    end,
+    starting_points: dict[str, int],
+    ending_points: dict[str, int],
+):
+    """
+    Finds the shortest path from start to end in the overlay, given as its
+    graph and hierarchy (None unless its engine uses one), leaving start's
+    datacenter through starting_points and entering end's through
+    ending_points, both mapping gateways to their distance from start (end).
+    Returns the distance and the path as [start, gateways..., end],
+    or (None, None) if there is no such path.
+    """
+    network, hierarchy = overlay
+    sources = [
+        (network.index[gateway], distance)
+        for gateway, distance in starting_points.items()
+        if gateway in network.index
+    ]
+    goals = {
+        network.index[gateway]: remaining
+        for gateway, remaining in ending_points.items()
+        if gateway in network.index
+    }
+
+    if hierarchy is not None:
+        found = hierarchy.search(sources, goals.items())
+        if found is None:
+            return None, None
+        distance, nodes = found
+        path = [network.nodes[i] for i in nodes]
+    else:
+        tree = network.search(sources, goals)
+        best, distance = None, graph.INFINITY
+        for i, remaining in goals.items():
+            if tree.dist[i] == graph.INFINITY:
+                continue
+            if tree.dist[i] + remaining < distance:
+                best, distance = network.nodes[i], tree.dist[i] + remaining
+        if best is None:
+            return None, None
+        path = tree.path(best)
+
+    if path[0] != start:
+        path.insert(0, start)
+    if path[-1] != end:
+        path.append(end)
+    return distance, path
+
+
+def distance_table(
+    shard: tuple[graph.Graph, graph.DistanceIndex],
+    sources: list[str],
+    targets: list[str],
+) -> list[list[int | None]]:
+    """
+    Returns distances in a shard from every source (rows) to every target,
+    None if not connected. The graph is undirected, so there is one search
+    per source or per target, whichever there are fewer of.
+    """
+    network, _ = shard
+    if not targets:
+        return [[] for _ in sources]
+    flip = len(targets) < len(sources)
+    if flip:
+        sources, targets = targets, sources
+    rows = []
+    for source in sources:
+        tree = network.search([(network.index[source], 0)])
+        rows.append([tree.distance(target) for target in targets])
+    if flip:
+        rows = [list(column) for column in zip(*rows)]
+    return rows
+
+
+def distances(
+    overlay: tuple[graph.Graph, ContractionHierarchy | None],
+    starting_points: dict[str, int],
+    ending_points: list[dict[str, int]],
+) -> list[int | None]:
+    """
+    Runs one search in the overlay from starting_points (gateways mapped to
+    their distance from the source) and returns the distance to every target,
+    given by its ending_points, or None if there is no path through the overlay.
+    """
+    network, _ = overlay
+    tree = network.search(
+        (network.index[gateway], distance)
+        for gateway, distance in starting_points.items()
+        if gateway in network.index
+    )
+    res = []
+    for points in ending_points:
+        best = graph.INFINITY
+        for gateway, remaining in points.items():
+            i = network.index.get(gateway)
+            if i is not None and tree.dist[i] != graph.INFINITY:
+                best = min(best, tree.dist[i] + remaining)
+        res.append(None if best == graph.INFINITY else best)
+    return res
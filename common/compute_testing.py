@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+from common import compute, graph
+
+
+def shard(length):
+    edges = {
+        "v1": [graph.Edge("v1", "v2", "e1", length)],
+        "v2": [graph.Edge("v2", "v1", "e1", length)],
+        "v3": [],
+    }
+    network = graph.Graph.from_edges(edges)
+    return network, graph.DistanceIndex.farthest_points(network, 2)
+
+
+class ComputeTestCase(unittest.TestCase):
+    def check_pool(self, processes):
+        pool = compute.ComputePool(processes)
+        loads = []
+
+        def data(length):
+            def load():
+                loads.append(length)
+                return shard(length)
+
+            return load
+
+        async def queries():
+            res = []
+            for version, length in [(1, 3), (1, 3), (2, 5)]:
+                res.append(
+                    await pool.run(
+                        "shard", version, data(length), compute.connection, "v1", "v2"
+                    )
+                )
+            res.append(
+                await pool.run("shard", 2, data(5), compute.connection, "v1", "v3")
+            )
+            return res
+
+        try:
+            res = asyncio.run(queries())
+        finally:
+            pool.close()
+        self.assertEqual(
+            [(3, ["v1", "v2"]), (3, ["v1", "v2"]), (5, ["v1", "v2"]), (None, None)],
+            res,
+        )
+        return loads
+
+    def test_threadpool(self):
+        self.assertEqual([3, 3, 5, 5], self.check_pool(0))
+
+    def test_processes(self):
+        # The process loads data once per version.
+        self.assertEqual([3, 5], self.check_pool(1))
+
+    def test_distance_table(self):
+        edges = {
+            "v1": [graph.Edge("v1", "v2", "e1", 2)],
+            "v2": [graph.Edge("v2", "v1", "e1", 2), graph.Edge("v2", "v3", "e2", 3)],
+            "v3": [graph.Edge("v3", "v2", "e2", 3)],
+            "v4": [],
+        }
+        network = graph.Graph.from_edges(edges)
+        expected = [[0, 2, 5, None], [5, 3, 0, None]]
+        targets = ["v1", "v2", "v3", "v4"]
+        self.assertEqual(
+            expected, compute.distance_table((network, None), ["v1", "v3"], targets)
+        )
+        # Searches from the targets, as there are fewer of them.
+        self.assertEqual(
+            [list(row) for row in zip(*expected)],
+            compute.distance_table((network, None), targets, ["v1", "v3"]),
+        )
+        self.assertEqual(
+            [[], []], compute.distance_table((network, None), targets[:2], [])
+        )
+
+    def test_distances(self):
+        edges = {
+            "g1": [graph.Edge("g1", "g2", None, 10)],
+            "g2": [graph.Edge("g2", "g1", None, 10)],
+            "g3": [],
+        }
+        overlay = (graph.Graph.from_edges(edges), None)
+        self.assertEqual(
+            [11, 3, None],
+            compute.distances(overlay, {"g1": 1}, [{"g2": 0}, {"g1": 2}, {"g3": 0}]),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+"""
+Customizable contraction hierarchy (CCH) of an undirected Graph.
+
+Preprocessing orders nodes with the minimum degree heuristic and contracts
+them in that order, connecting all remaining neighbors of every contracted
+node with shortcuts. This depends only on which nodes are connected, not on
+edge lengths. Customization then computes the length of every edge of the
+hierarchy from the lengths in a graph, so when only lengths change (or edges
+disappear) the hierarchy is customized again instead of being rebuilt.
+
+Queries are bidirectional searches which only go up in the order. Every
+shortcut remembers the node it bypasses, so paths unpack into edges of the
+original graph.
+"""
+
+from array import array
+from collections.abc import Iterable
+from heapq import heapify, heappop, heappush
+from common.graph import INFINITY, Graph
+
+
+class ContractionHierarchy:
+    # Nodes are numbered as in the graph the hierarchy was built from.
+    # rank[v] - position of v in the contraction order,
+    # up[v] - neighbors of v contracted after it, sorted,
+    # positions[v] - maps up[v][k] to k,
+    # weights[v][k] - length of the edge from v to up[v][k],
+    # middles[v][k] - node bypassed by that edge, -1 if it is not a shortcut.
+
+    def __init__(self, network: Graph):
+        self.nodes = network.nodes
+        n = len(self.nodes)
+        neighbors = [set() for _ in range(n)]
+        for node in range(n):
+            for slot in range(network.offsets[node], network.offsets[node + 1]):
+                target = network.targets[slot]
+                if target != node:
+                    neighbors[node].add(target)
+                    neighbors[target].add(node)
+
+        self.rank = array("q", [0]) * n
+        self.up: list[list[int]] = [[] for _ in range(n)]
+        contracted = 0
+        queue = [(len(adjacent), node) for node, adjacent in enumerate(neighbors)]
+        heapify(queue)
+        while queue:
+            degree, node = heappop(queue)
+            if self.rank[node] or degree != len(neighbors[node]):
+                continue  # contracted already or degree changed since pushed
+            contracted += 1
+            self.rank[node] = contracted
+            higher = neighbors[node]
+            self.up[node] = sorted(higher)
+            for v in higher:
+                neighbors[v].discard(node)
+                neighbors[v].update(w for w in higher if w != v)
+                heappush(queue, (len(neighbors[v]), v))
+            neighbors[node] = set()
+
+        self.order = sorted(range(n), key=self.rank.__getitem__)
+        self.positions = [{v: k for k, v in enumerate(up)} for up in self.up]
+        self.customize(network)
+
+    def customize(self, network: Graph) -> bool:
+        """
+        Sets lengths of the hierarchy's edges from network. Returns False and
+        leaves the hierarchy unchanged if network has other nodes or edges
+        which the hierarchy does not cover, so it has to be built again.
+        """
+        if network.nodes != self.nodes:
+            return False
+        rank, positions = self.rank, self.positions
+        weights = [array("q", [INFINITY]) * len(up) for up in self.up]
+        middles = [array("q", [-1]) * len(up) for up in self.up]
+        for node in range(len(self.nodes)):
+            for slot in range(network.offsets[node], network.offsets[node + 1]):
+                target = network.targets[slot]
+                if target == node:
+                    continue
+                low, high = sorted((node, target), key=rank.__getitem__)
+                k = positions[low].get(high)
+                if k is None:
+                    return False
+                if network.weights[slot] < weights[low][k]:
+                    weights[low][k] = network.weights[slot]
+
+        # Relax edge v-w through every lower triangle u-v-w, going up the
+        # order, so the lengths of u-v and u-w are final when u is processed.
+        for u in self.order:
+            up, lengths = self.up[u], weights[u]
+            for i, v in enumerate(up):
+                if lengths[i] == INFINITY:
+                    continue
+                for j, w in enumerate(up):
+                    if rank[w] <= rank[v] or lengths[j] == INFINITY:
+                        continue
+                    k = positions[v][w]
+                    if lengths[i] + lengths[j] < weights[v][k]:
+                        weights[v][k] = lengths[i] + lengths[j]
+                        middles[v][k] = u
+
+        self.weights = weights
+        self.middles = middles
+        return True
+
+    def search(
+        self, sources: Iterable[tuple[int, int]], goals: Iterable[tuple[int, int]]
+    ) -> tuple[int, list[int]] | None:
+        """
+        Finds the shortest path from any source to any goal, both given as
+        (node number, initial distance) pairs. Returns its length, including
+        the initial distances, and its nodes, or None if there is no path.
+        """
+        dist: list[dict[int, int]] = [{}, {}]
+        pred: list[dict[int, int]] = [{}, {}]
+        queues: list[list[tuple[int, int]]] = [[], []]
+        for side, seeds in enumerate([sources, goals]):
+            for node, initial in seeds:
+                if initial < dist[side].get(node, INFINITY):
+                    dist[side][node] = initial
+                    pred[side][node] = -1
+                    queues[side].append((initial, node))
+            heapify(queues[side])
+
+        best, meeting = INFINITY, -1
+        while queues[0] or queues[1]:
+            if not queues[1] or (queues[0] and queues[0][0][0] <= queues[1][0][0]):
+                side = 0
+            else:
+                side = 1
+            own, other = dist[side], dist[1 - side]
+            d, node = heappop(queues[side])
+            if d >= best:
+                queues[side].clear()  # nothing above can be on a better path
+                continue
+            if d > own[node]:
+                continue
+            if node in other and d + other[node] < best:
+                best, meeting = d + other[node], node
+            for v, length in zip(self.up[node], self.weights[node]):
+                if length == INFINITY:
+                    continue
+                new_dist = d + length
+                if new_dist < own.get(v, INFINITY):
+                    own[v] = new_dist
+                    pred[side][v] = node
+                    heappush(queues[side], (new_dist, v))
+
+        if meeting == -1:
+            return None
+        path = []
+        node = meeting
+        while node != -1:
+            path.append(node)
+            node = pred[0][node]
+        path.reverse()
+        node = pred[1][meeting]
+        while node != -1:
+            path.append(node)
+            node = pred[1][node]
+        return best, self.unpack(path)
+
+    def unpack(self, path: list[int]) -> list[int]:
+        """Replaces shortcuts between consecutive nodes with the nodes they bypass."""
+        res = path[:1]
+        stack = list(zip(path, path[1:]))
+        stack.reverse()
+        while stack:
+            a, b = stack.pop()
+            low, high = (a, b) if self.rank[a] < self.rank[b] else (b, a)
+            middle = self.middles[low][self.positions[low][high]]
+            if middle == -1:
+                res.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+        return res
@@ -0,0 +1,90 @@
+import random
+import unittest
+from common import contraction, graph
+
+
+def random_edges(node_count, edge_count, rng):
+    """Generates a random undirected graph as adjacency lists of Edge objects."""
+    edges = {f"v{i}": [] for i in range(node_count)}
+    for i in range(edge_count):
+        a, b = rng.sample(sorted(edges), 2)
+        length = rng.randint(0, 20)
+        edges[a].append(graph.Edge(a, b, f"e{i}", length))
+        edges[b].append(graph.Edge(b, a, f"e{i}", length))
+    return edges
+
+
+def reweighted(edges, rng):
+    """Returns the same graph with new lengths, dropping some edges."""
+    lengths = {}
+    res = {node: [] for node in edges}
+    for node, node_edges in edges.items():
+        for edge in node_edges:
+            if edge.id not in lengths:
+                lengths[edge.id] = rng.choice([None, 0, 1, 5, 30])
+            if lengths[edge.id] is not None:
+                length = lengths[edge.id]
+                res[node].append(graph.Edge(edge.n1, edge.n2, edge.id, length))
+    return res
+
+
+class ContractionTestCase(unittest.TestCase):
+    def assert_queries(self, edges, hierarchy, rng):
+        network = graph.Graph.from_edges(edges)
+        for _ in range(40):
+            sources = {
+                network.index[v]: rng.randint(0, 5)
+                for v in rng.sample(network.nodes, rng.randint(1, 3))
+            }
+            goals = {
+                network.index[v]: rng.randint(0, 5)
+                for v in rng.sample(network.nodes, rng.randint(1, 3))
+            }
+            tree = network.search(sources.items())
+            expected = min(tree.dist[g] + r for g, r in goals.items())
+            found = hierarchy.search(sources.items(), goals.items())
+            if expected >= graph.INFINITY:
+                self.assertIsNone(found)
+                continue
+
+            distance, path = found
+            self.assertEqual(expected, distance)
+            length = sources[path[0]] + goals[path[-1]]
+            for a, b in zip(path, path[1:]):
+                a, b = network.nodes[a], network.nodes[b]
+                length += min(e.length for e in edges[a] if e.n2 == b)
+            self.assertEqual(expected, length)
+
+    def test_queries(self):
+        rng = random.Random(1)
+        for _ in range(10):
+            edges = random_edges(50, rng.randint(30, 120), rng)
+            hierarchy = contraction.ContractionHierarchy(graph.Graph.from_edges(edges))
+            self.assert_queries(edges, hierarchy, rng)
+
+    def test_customize(self):
+        rng = random.Random(2)
+        edges = random_edges(40, 80, rng)
+        hierarchy = contraction.ContractionHierarchy(graph.Graph.from_edges(edges))
+        for _ in range(5):
+            changed = reweighted(edges, rng)
+            self.assertTrue(hierarchy.customize(graph.Graph.from_edges(changed)))
+            self.assert_queries(changed, hierarchy, rng)
+
+    def test_customize_new_edges(self):
+        edges = {
+            "v1": [graph.Edge("v1", "v2", "e1", 1)],
+            "v2": [graph.Edge("v2", "v1", "e1", 1)],
+            "v3": [],
+        }
+        hierarchy = contraction.ContractionHierarchy(graph.Graph.from_edges(edges))
+        edges["v2"].append(graph.Edge("v2", "v3", "e2", 1))
+        edges["v3"].append(graph.Edge("v3", "v2", "e2", 1))
+        self.assertFalse(hierarchy.customize(graph.Graph.from_edges(edges)))
+        # The hierarchy still answers for the old lengths.
+        self.assertIsNone(hierarchy.search([(0, 0)], [(2, 0)]))
+        self.assertEqual((1, [0, 1]), hierarchy.search([(0, 0)], [(1, 0)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,51 +1,233 @@
-from google.cloud import storage
-
-bucketName = "irio-bucket-2025"
-storage_client = storage.Client.from_service_account_json("keys.json")
+"""
+Access to files shared between services.
 
+The backend is chosen by the STORAGE_BACKEND environment variable:
+* "gcs" (default) - objects in the STORAGE_BUCKET bucket of Google Cloud
+  Storage, with credentials read from keys.json on first use,
+* "local" - files in the STORAGE_PATH directory, e.g. testing/empty_graph.
 
-def check_lock(path, last_lock):
-    """Checks if the lock (state of file) has changed."""
-    return read_file(path) == last_lock
+Every file has a generation, a number which changes whenever the file is
+written and is 0 for a missing file. Conditional writes succeed only if
+the file is still at the given generation.
+"""
 
+from google.api_core import exceptions
+from google.cloud import storage
+from common import metrics
+import fcntl
+import logging
+import mmap
+import os
+import tempfile
+import time
+
+bucketName = os.environ.get("STORAGE_BUCKET", "irio-bucket-2025")
+
+log = logging.getLogger("uvicorn")
+
+STORAGE_SECONDS = metrics.Histogram(
+    "routing_storage_seconds", "Latency of storage operations.", ("operation",)
+)
+STORAGE_BYTES = metrics.Counter(
+    "routing_storage_bytes_total",
+    "Bytes read from and written to the storage.",
+    ("operation",),
+)
+
+
+class GcsStorage:
+    """Files stored as objects in a GCS bucket."""
+
+    def __init__(self, bucket_name, keys="keys.json"):
+        self.bucketName = bucket_name
+        self.keys = keys
+        self.__client = None
+
+    def __bucket(self):
+        if self.__client is None:
+            self.__client = storage.Client.from_service_account_json(self.keys)
+        return self.__client.bucket(self.bucketName)
+
+    def read(self, path) -> bytes:
+        # `Bucket.blob` doesn't retrieve any metadata, unlike `Bucket.get_blob`.
+        return self.__bucket().blob(path).download_as_bytes()
+
+    def write(self, path, data: bytes, content_type="text/plain"):
+        self.__bucket().blob(path).upload_from_string(data, content_type=content_type)
+
+    def write_if(self, path, data: bytes, generation, content_type="text/plain"):
+        try:
+            self.__bucket().blob(path).upload_from_string(
+                data, content_type=content_type, if_generation_match=generation
+            )
+        except exceptions.PreconditionFailed:
+            return False
+        return True
+
+    def generation(self, path) -> int:
+        blob = self.__bucket().get_blob(path)
+        return 0 if blob is None else blob.generation
+
+    def list(self, prefix) -> list[str]:
+        return [blob.name for blob in self.__bucket().list_blobs(prefix=prefix)]
+
+    def sizes(self, prefix) -> dict[str, int]:
+        return {
+            blob.name: blob.size for blob in self.__bucket().list_blobs(prefix=prefix)
+        }
+
+    def delete(self, path):
+        self.__bucket().blob(path).delete()
+
+
+class LocalStorage:
+    """
+    Files stored in a local directory. Writes go to a temporary file which
+    is renamed over the target, so readers never see partial files, and
+    reads map the file into memory instead of copying it. The mapping stays
+    valid after the file is replaced.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def __path(self, path):
+        return os.path.join(self.root, *path.split("/"))
+
+    def read(self, path):
+        """Returns a read-only mapping of the file, which is bytes-like."""
+        with open(self.__path(path), "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b""  # empty files cannot be mapped
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def write(self, path, data: bytes, content_type=None):
+        target = self.__path(path)
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+        # Modification times serve as generations, but the filesystem may
+        # round them, so they are set explicitly and always increase.
+        generation = max(time.time_ns(), self.generation(path) + 1)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.utime(temporary, ns=(generation, generation))
+            os.replace(temporary, target)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def write_if(self, path, data: bytes, generation, content_type=None):
+        os.makedirs(self.root, exist_ok=True)
+        # Serializes conditional writes of all processes sharing the directory.
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.generation(path) != generation:
+                return False
+            self.write(path, data)
+            return True
+
+    def generation(self, path) -> int:
+        try:
+            return os.stat(self.__path(path)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def list(self, prefix) -> list[str]:
+        names = []
+        for directory, _, files in os.walk(self.root):
+            relative = os.path.relpath(directory, self.root).replace(os.sep, "/")
+            for file in files:
+                name = file if relative == "." else relative + "/" + file
+                if name.startswith(prefix) and not file.startswith("."):
+                    names.append(name)
+        return sorted(names)
+
+    def sizes(self, prefix) -> dict[str, int]:
+        return {name: os.stat(self.__path(name)).st_size for name in self.list(prefix)}
+
+    def delete(self, path):
+        os.remove(self.__path(path))
+
+
+def create_backend():
+    """Creates the backend selected by the environment."""
+    backend = os.environ.get("STORAGE_BACKEND", "gcs")
+    if backend == "gcs":
+        return GcsStorage(bucketName)
+    if backend == "local":
+        return LocalStorage(os.environ["STORAGE_PATH"])
+    raise ValueError("Unknown storage backend: {}".format(backend))
+
+
+backend = create_backend()
+
+
+def timed(operation, path, action):
+    """Runs the action and logs its latency, never the file contents."""
+    start = time.perf_counter()
+    result = action()
+    elapsed = time.perf_counter() - start
+    STORAGE_SECONDS.observe(elapsed, operation)
+    log.debug("Storage {} {} took {:.1f} ms".format(operation, path, elapsed * 1000))
+    return result
+
+
+def read_file(path) -> str:
+    """Reads a text file."""
+    return str(read_bytes(path), "utf-8")
 
-def download_blob_into_memory(bucket_name, blob_name):
-    """Downloads a blob into memory."""
-    bucket = storage_client.bucket(bucket_name)
-
-    # Construct a client side representation of a blob.
-    # Note `Bucket.blob` differs from `Bucket.get_blob` as it doesn't retrieve
-    # any content from Google Cloud Storage. As we don't need additional data,
-    # using `Bucket.blob` is preferred here.
-    blob = bucket.blob(blob_name)
-    contents = blob.download_as_bytes()
 
-    print(
-        "Downloaded storage object {} from bucket {} as the following bytes object: {}.".format(
-            blob_name, bucket_name, contents.decode("utf-8")
-        )
+def save_file(path, data: str):
+    """Saves a text file."""
+    encoded = str(data).encode()
+    STORAGE_BYTES.inc("write", amount=len(encoded))
+    timed("write", path, lambda: backend.write(path, encoded))
+
+
+def save_file_if(path, data: str, generation) -> bool:
+    """
+    Saves a text file if it is still at the given generation (0 if it must
+    not exist yet) and returns whether it was saved.
+    """
+    encoded = str(data).encode()
+    STORAGE_BYTES.inc("write", amount=len(encoded))
+    return timed("write", path, lambda: backend.write_if(path, encoded, generation))
+
+
+def read_bytes(path):
+    """Reads a binary file as a bytes-like object."""
+    data = timed("read", path, lambda: backend.read(path))
+    STORAGE_BYTES.inc("read", amount=len(data))
+    return data
+
+
+def save_bytes(path, data: bytes):
+    """Saves a binary file."""
+    STORAGE_BYTES.inc("write", amount=len(data))
+    timed(
+        "write",
+        path,
+        lambda: backend.write(path, data, content_type="application/octet-stream"),
     )
 
-    return contents.decode("utf-8")
-
 
-def upload_blob_from_memory(bucket_name, contents, destination_blob_name):
-    """Uploads a file to the bucket."""
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
+def get_generation(path) -> int:
+    """Returns the generation of the file, 0 if it doesn't exist."""
+    return timed("stat", path, lambda: backend.generation(path))
 
-    blob.upload_from_string(contents)
 
-    print(
-        f"{destination_blob_name} with contents {contents} uploaded to {bucket_name}."
-    )
+def list_files(prefix) -> list[str]:
+    """Lists names of files starting with the prefix."""
+    return timed("list", prefix, lambda: backend.list(prefix))
 
 
-def read_file(path):
-    """Reads a file from GCS."""
-    return download_blob_into_memory(bucketName, path)
+def file_sizes(prefix) -> dict[str, int]:
+    """Returns sizes in bytes of files starting with the prefix, by name."""
+    return timed("list", prefix, lambda: backend.sizes(prefix))
 
 
-def save_file(path, data: str):
-    """Saves a file to GCS."""
-    upload_blob_from_memory(bucketName, str(data).encode(), path)
+def delete_file(path):
+    """Deletes a file."""
+    timed("delete", path, lambda: backend.delete(path))
@@ -0,0 +1,53 @@
+import tempfile
+import unittest
+from common import fileOperations
+
+
+class LocalStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous = fileOperations.backend
+        fileOperations.backend = fileOperations.LocalStorage(self.directory.name)
+
+    def tearDown(self):
+        fileOperations.backend = self.previous
+        self.directory.cleanup()
+
+    def test_files(self):
+        fileOperations.save_file("lock_A.lock", "1")
+        fileOperations.save_bytes("data_A.json", b"\x00\x01")
+        fileOperations.save_file("log_data_A.json/1/000000000001", "[]")
+        fileOperations.save_file("empty", "")
+
+        self.assertEqual("1", fileOperations.read_file("lock_A.lock"))
+        self.assertEqual(b"\x00\x01", bytes(fileOperations.read_bytes("data_A.json")))
+        self.assertEqual("", fileOperations.read_file("empty"))
+        self.assertEqual(["data_A.json"], fileOperations.list_files("data_"))
+        self.assertEqual({"data_A.json": 2}, fileOperations.file_sizes("data_"))
+        self.assertEqual(
+            ["log_data_A.json/1/000000000001"], fileOperations.list_files("log_")
+        )
+
+        fileOperations.delete_file("lock_A.lock")
+        self.assertEqual(0, fileOperations.get_generation("lock_A.lock"))
+        with self.assertRaises(FileNotFoundError):
+            fileOperations.read_file("lock_A.lock")
+
+    def test_read_survives_replace(self):
+        fileOperations.save_file("lock_A.lock", "first")
+        mapped = fileOperations.read_bytes("lock_A.lock")
+        fileOperations.save_file("lock_A.lock", "second")
+        self.assertEqual(b"first", bytes(mapped))
+        self.assertEqual("second", fileOperations.read_file("lock_A.lock"))
+
+    def test_conditional_write(self):
+        self.assertTrue(fileOperations.save_file_if("lock_A.lock", "1", 0))
+        self.assertFalse(fileOperations.save_file_if("lock_A.lock", "2", 0))
+        generation = fileOperations.get_generation("lock_A.lock")
+        self.assertNotEqual(0, generation)
+        self.assertTrue(fileOperations.save_file_if("lock_A.lock", "3", generation))
+        self.assertEqual("3", fileOperations.read_file("lock_A.lock"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,34 @@
-from collections.abc import Callable
-from queue import PriorityQueue
+from array import array
+from bisect import bisect_right
+from collections.abc import Callable, Iterable
+from heapq import heapify, heappop, heappush
+from common import metrics
 
-import logging
+# Distance of nodes not reachable from the source(s) of a search.
+INFINITY = (1 << 63) - 1
 
-logger = logging.getLogger("uvicorn")
+SEARCHES = metrics.Counter(
+    "routing_graph_searches_total", "Shortest path searches.", ("kind",)
+)
+SETTLED = metrics.Counter(
+    "routing_graph_settled_nodes_total", "Nodes settled by searches.", ("kind",)
+)
+RELAXED = metrics.Counter(
+    "routing_graph_relaxed_edges_total", "Edges relaxed by searches.", ("kind",)
+)
+HEAP_OPERATIONS = metrics.Counter(
+    "routing_graph_heap_operations_total",
+    "Pushes to and pops from priority queues of searches.",
+    ("kind",),
+)
+
+
+def record_search(kind, settled, relaxed, heap_operations):
+    """Adds the work done by one search to the metrics."""
+    SEARCHES.inc(kind)
+    SETTLED.inc(kind, amount=settled)
+    RELAXED.inc(kind, amount=relaxed)
+    HEAP_OPERATIONS.inc(kind, amount=heap_operations)
 
 
 class Edge:
@@ -42,7 +67,6 @@ class PathResult:
 
     def callback(self, node: str, dist: int, from_: str):
         """Updates node's info about its predecessor on path"""
-        logger.info(f"Visiting {node} from, {from_}")
         self.paths[node] = from_
         if self.target == node:
             self.dist = dist
@@ -63,22 +87,26 @@ def internal_dijkstra(
     edges: dict[str, list[Edge]],
     callback: Callable[[str, int, str], bool],
     visited: dict[str, int],
-    queue: PriorityQueue,
+    queue: list[tuple[int, str, str]],
 ):
     """Does a Dijkstra algorithm, starting from starting node, and calls callback on each visited node."""
-    logger.info(f"Visited {visited}")
-    while queue.qsize() > 0:
-        (dist, element, from_) = queue.get()
+    settled = relaxed = heap_operations = 0
+    while queue:
+        (dist, element, from_) = heappop(queue)
+        heap_operations += 1
         if visited[element] < dist:
             continue
         callback(element, dist, from_)  # Lets node (element) update its info.
+        settled += 1
+        relaxed += len(edges[element])
         for edge in edges[element]:
-            logger.info(f"Checking {edge.n2} from {from_}")
-            if edge.n2 in visited.keys() and visited[edge.n2] <= dist + edge.length:
+            if edge.n2 in visited and visited[edge.n2] <= dist + edge.length:
                 continue
 
             visited[edge.n2] = dist + edge.length
-            queue.put((dist + edge.length, edge.n2, element))
+            heappush(queue, (dist + edge.length, edge.n2, element))
+            heap_operations += 1
+    record_search("legacy", settled, relaxed, heap_operations)
 
 
 def dijkstra(
@@ -87,8 +115,552 @@ def dijkstra(
     callback: Callable[[str, int, str], bool],
 ):
     """Prepares environment to perform Dijkstra algorithm."""
-    visited = {}
-    queue: PriorityQueue[tuple[int, str, str]] = PriorityQueue()
-    queue.put((0, starting, ""))
-    visited[starting] = 0
+    visited = {starting: 0}
+    queue = [(0, starting, "")]
     return internal_dijkstra(edges, callback, visited, queue)
+
+
+class Graph:
+    # Immutable graph with node ids interned into integers 0..n-1.
+    # Adjacency is stored in CSR form: outgoing edges of node i occupy
+    # slots offsets[i]..offsets[i + 1] - 1 of targets, weights and edgeIds.
+    # edgeIds holds indices into edgeNames, which keeps the original ids.
+
+    def __init__(
+        self,
+        nodes: list[str],
+        offsets: array,
+        targets: array,
+        weights: array,
+        edge_ids: array,
+        edge_names: list,
+    ):
+        self.nodes = nodes
+        self.index = {node: i for i, node in enumerate(nodes)}
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.edgeIds = edge_ids
+        self.edgeNames = edge_names
+        self.edgeIndex = {name: i for i, name in enumerate(edge_names)}
+
+    @classmethod
+    def from_edges(cls, edges: dict[str, list[Edge]], nodes: Iterable[str] = ()):
+        """Builds a graph from adjacency lists of Edge objects."""
+        index: dict[str, int] = {}
+        for node in nodes:
+            index.setdefault(node, len(index))
+        for node in edges:
+            index.setdefault(node, len(index))
+        for node_edges in edges.values():
+            for edge in node_edges:
+                index.setdefault(edge.n2, len(index))
+
+        offsets = array("q", [0]) * (len(index) + 1)
+        for node, node_edges in edges.items():
+            offsets[index[node] + 1] += len(node_edges)
+        for i in range(len(index)):
+            offsets[i + 1] += offsets[i]
+
+        size = offsets[len(index)]
+        targets = array("q", [0]) * size
+        weights = array("q", [0]) * size
+        edge_ids = array("q", [0]) * size
+        edge_index: dict = {}
+        for node, node_edges in edges.items():
+            slot = offsets[index[node]]
+            for edge in node_edges:
+                targets[slot] = index[edge.n2]
+                weights[slot] = edge.length
+                edge_ids[slot] = edge_index.setdefault(edge.id, len(edge_index))
+                slot += 1
+
+        return cls(list(index), offsets, targets, weights, edge_ids, list(edge_index))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __copy_with(self, offsets, targets, weights, edge_ids):
+        """Returns a graph sharing nodes and edge names, with new adjacency."""
+        res = Graph.__new__(Graph)
+        res.__dict__.update(self.__dict__)
+        res.offsets = offsets
+        res.targets = targets
+        res.weights = weights
+        res.edgeIds = edge_ids
+        return res
+
+    def __find_slots(self, edge_id) -> list[int]:
+        """Returns CSR slots of the given edge in increasing order."""
+        name = self.edgeIndex.get(edge_id)
+        res = []
+        while name is not None:
+            try:
+                res.append(self.edgeIds.index(name, res[-1] + 1 if res else 0))
+            except ValueError:
+                break
+        return res
+
+    def with_edge(self, n1: str, n2: str, edge_id, length: int) -> "Graph":
+        """
+        Returns a copy of the graph with an undirected edge between n1 and n2
+        added. Node numbers are kept, so search results stay compatible.
+        """
+        a, b = self.index[n1], self.index[n2]
+        offsets = array("q", self.offsets)
+        targets = array("q", self.targets)
+        weights = array("q", self.weights)
+        edge_ids = array("q", self.edgeIds)
+        name = self.edgeIndex.get(edge_id, len(self.edgeNames))
+
+        # Inserting at the later position first keeps the earlier one valid.
+        for node, other in sorted([(a, b), (b, a)], reverse=True):
+            slot = self.offsets[node + 1]
+            targets[slot:slot] = array("q", [other])
+            weights[slot:slot] = array("q", [length])
+            edge_ids[slot:slot] = array("q", [name])
+            for i in range(node + 1, len(offsets)):
+                offsets[i] += 1
+
+        res = self.__copy_with(offsets, targets, weights, edge_ids)
+        if name == len(self.edgeNames):
+            res.edgeNames = self.edgeNames + [edge_id]
+            res.edgeIndex = {**self.edgeIndex, edge_id: name}
+        return res
+
+    def edge_slots(self, edge_id) -> list[tuple[int, int, int]]:
+        """Returns (from, to, length) of every directed slot of the given edge."""
+        return [
+            (bisect_right(self.offsets, slot) - 1, self.targets[slot], self.weights[slot])
+            for slot in self.__find_slots(edge_id)
+        ]
+
+    def without_edge(self, edge_id) -> "Graph":
+        """Returns a copy of the graph with all slots of the given edge removed."""
+        offsets = array("q", self.offsets)
+        targets = array("q", self.targets)
+        weights = array("q", self.weights)
+        edge_ids = array("q", self.edgeIds)
+        for slot in reversed(self.__find_slots(edge_id)):
+            node = bisect_right(self.offsets, slot) - 1
+            del targets[slot], weights[slot], edge_ids[slot]
+            for i in range(node + 1, len(offsets)):
+                offsets[i] -= 1
+
+        return self.__copy_with(offsets, targets, weights, edge_ids)
+
+    def search(
+        self,
+        sources: Iterable[tuple[int, int]],
+        goals: dict[int, int] | None = None,
+    ) -> "ShortestPathTree":
+        """
+        Runs Dijkstra's algorithm from the given (node number, initial distance)
+        pairs and returns the resulting shortest path tree.
+        If goals (node number -> remaining distance) are given, the search stops
+        once no unsettled node can lead to a goal better than the best one
+        found. Only distances and paths to that goal are final then.
+        """
+        n = len(self.nodes)
+        dist = array("q", [INFINITY]) * n
+        pred = array("q", [-1]) * n
+        queue = []
+        for node, initial in sources:
+            if initial < dist[node]:
+                dist[node] = initial
+                queue.append((initial, node))
+        heapify(queue)
+
+        best = INFINITY
+        settled = relaxed = pushes = 0
+        popped = len(queue)
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        while queue:
+            d, node = heappop(queue)
+            if d > dist[node]:
+                continue
+            if goals is not None:
+                if d >= best:
+                    break
+                remaining = goals.get(node)
+                if remaining is not None and d + remaining < best:
+                    best = d + remaining
+            settled += 1
+            start, end = offsets[node], offsets[node + 1]
+            relaxed += end - start
+            for slot in range(start, end):
+                target = targets[slot]
+                new_dist = d + weights[slot]
+                if new_dist < dist[target]:
+                    dist[target] = new_dist
+                    pred[target] = node
+                    heappush(queue, (new_dist, target))
+                    pushes += 1
+
+        popped += pushes - len(queue)
+        record_search("search", settled, relaxed, pushes + popped)
+        return ShortestPathTree(self, dist, pred, settled)
+
+    def dijkstra(self, source: str) -> "ShortestPathTree":
+        """Runs Dijkstra's algorithm from a single node given by its id."""
+        return self.search([(self.index[source], 0)])
+
+    def point_to_point(
+        self, source: str, target: str, landmarks: "DistanceIndex | None" = None
+    ) -> "ShortestPathTree":
+        """
+        Searches for the shortest path from source to target, stopping as soon
+        as target is settled. If landmarks are given, the search is an A* guided
+        by their lower bounds (ALT). Only the path to target is meaningful
+        in the returned tree.
+        """
+        s, t = self.index[source], self.index[target]
+        n = len(self.nodes)
+        dist = array("q", [INFINITY]) * n
+        pred = array("q", [-1]) * n
+        dist[s] = 0
+
+        bound = None if landmarks is None else landmarks.bound_to(s, t)
+        queue = [(0 if bound is None else bound(s), s)]
+        settled = relaxed = pushes = 0
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        while queue:
+            key, node = heappop(queue)
+            if node == t:
+                break
+            d = dist[node]
+            if bound is not None:
+                if key > d + bound(node):
+                    continue
+            elif key > d:
+                continue
+            settled += 1
+            start, end = offsets[node], offsets[node + 1]
+            relaxed += end - start
+            for slot in range(start, end):
+                target_node = targets[slot]
+                new_dist = d + weights[slot]
+                if new_dist < dist[target_node]:
+                    dist[target_node] = new_dist
+                    pred[target_node] = node
+                    if bound is not None:
+                        new_dist += bound(target_node)
+                    heappush(queue, (new_dist, target_node))
+                    pushes += 1
+
+        popped = 1 + pushes - len(queue)
+        kind = "point_to_point" if bound is None else "alt"
+        record_search(kind, settled, relaxed, pushes + popped)
+        return ShortestPathTree(self, dist, pred, settled)
+
+    def bidirectional(self, source: str, target: str) -> "ShortestPathTree":
+        """
+        Searches for the shortest path from source to target with Dijkstra's
+        algorithm run from both ends at once, until the searches meet.
+        Only the path to target is meaningful in the returned tree.
+        """
+        s, t = self.index[source], self.index[target]
+        n = len(self.nodes)
+        dist = [array("q", [INFINITY]) * n, array("q", [INFINITY]) * n]
+        pred = [array("q", [-1]) * n, array("q", [-1]) * n]
+        dist[0][s] = dist[1][t] = 0
+        queues = [[(0, s)], [(0, t)]]
+        # Length of the best path found so far and its node met by both searches.
+        best, meeting = (0, s) if s == t else (INFINITY, -1)
+
+        settled = relaxed = pushes = 0
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        while queues[0] and queues[1]:
+            if queues[0][0][0] + queues[1][0][0] >= best:
+                break
+            side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+            own, other = dist[side], dist[1 - side]
+            d, node = heappop(queues[side])
+            if d > own[node]:
+                continue
+            settled += 1
+            start, end = offsets[node], offsets[node + 1]
+            relaxed += end - start
+            for slot in range(start, end):
+                target_node = targets[slot]
+                new_dist = d + weights[slot]
+                if new_dist < own[target_node]:
+                    own[target_node] = new_dist
+                    pred[side][target_node] = node
+                    heappush(queues[side], (new_dist, target_node))
+                    pushes += 1
+                    if other[target_node] != INFINITY:
+                        if new_dist + other[target_node] < best:
+                            best = new_dist + other[target_node]
+                            meeting = target_node
+
+        # Append the backward path from the meeting node to the forward tree,
+        # keeping nodes already on the forward path (possible with 0 lengths).
+        forward, backward = dist[0], dist[1]
+        if best != INFINITY:
+            on_path = set()
+            node = meeting
+            while node != -1:
+                on_path.add(node)
+                node = pred[0][node]
+            node = meeting
+            while node != t:
+                next_node = pred[1][node]
+                if next_node not in on_path:
+                    forward[next_node] = best - backward[next_node]
+                    pred[0][next_node] = node
+                node = next_node
+
+        popped = 2 + pushes - len(queues[0]) - len(queues[1])
+        record_search("bidirectional", settled, relaxed, pushes + popped)
+        return ShortestPathTree(self, forward, pred[0], settled)
+
+
+class ShortestPathTree:
+    # Result of Graph.search, stored as arrays indexed by node number:
+    # dist - distance from the closest source (INFINITY if unreachable),
+    # pred - previous node on the shortest path (-1 for sources and unreachable).
+    # settled - number of nodes the search settled, a measure of its work.
+
+    def __init__(self, graph: Graph, dist: array, pred: array, settled: int = 0):
+        self.graph = graph
+        self.dist = dist
+        self.pred = pred
+        self.settled = settled
+
+    def distance(self, node: str) -> int | None:
+        """Returns distance to the node, or None if it is unreachable."""
+        d = self.dist[self.graph.index[node]]
+        return None if d == INFINITY else d
+
+    def distances(self) -> dict[str, int]:
+        """Returns distances to all reachable nodes as a dictionary."""
+        nodes = self.graph.nodes
+        return {nodes[i]: d for i, d in enumerate(self.dist) if d != INFINITY}
+
+    def path(self, node: str) -> list[str] | None:
+        """Returns list containing a path from the source to node, or None."""
+        i = self.graph.index[node]
+        if self.dist[i] == INFINITY:
+            return None
+        res = []
+        while i != -1:
+            res.append(self.graph.nodes[i])
+            i = self.pred[i]
+        res.reverse()
+        return res
+
+    def copy(self, graph: Graph) -> "ShortestPathTree":
+        """Returns a copy of the tree on graph, which can be improved separately."""
+        return ShortestPathTree(
+            graph, array("q", self.dist), array("q", self.pred), self.settled
+        )
+
+    def improve(self, seeds: Iterable[tuple[int, int, int]]):
+        """
+        Updates the tree after edges were added to its graph. Seeds are
+        (node, new distance, predecessor) candidates; only nodes whose distance
+        decreases are visited again.
+        """
+        dist, pred = self.dist, self.pred
+        queue = []
+        for node, d, from_ in seeds:
+            if d < dist[node]:
+                dist[node] = d
+                pred[node] = from_
+                queue.append((d, node))
+        heapify(queue)
+
+        offsets, targets, weights = (
+            self.graph.offsets,
+            self.graph.targets,
+            self.graph.weights,
+        )
+        settled = relaxed = pushes = 0
+        popped = len(queue)
+        while queue:
+            d, node = heappop(queue)
+            if d > dist[node]:
+                continue
+            settled += 1
+            start, end = offsets[node], offsets[node + 1]
+            relaxed += end - start
+            for slot in range(start, end):
+                target = targets[slot]
+                new_dist = d + weights[slot]
+                if new_dist < dist[target]:
+                    dist[target] = new_dist
+                    pred[target] = node
+                    heappush(queue, (new_dist, target))
+                    pushes += 1
+
+        popped += pushes
+        record_search("improve", settled, relaxed, pushes + popped)
+
+    def uses(self, slots: Iterable[tuple[int, int, int]]) -> bool:
+        """Checks if any of the (from, to, length) edge slots may be in the tree."""
+        dist, pred = self.dist, self.pred
+        for a, b, length in slots:
+            if pred[b] == a and dist[b] == dist[a] + length:
+                return True
+        return False
+
+
+class DistanceIndex:
+    # Shortest path trees from a fixed list of source nodes, kept for O(1)
+    # distance lookups. Since all graphs here are undirected, tree i also
+    # holds the distance from every node to sources[i]. The same trees serve
+    # as landmarks for ALT lower bounds in Graph.point_to_point.
+
+    # Updates replace trees instead of changing them, so a copy of the index
+    # can be updated while the original is being searched.
+
+    # Number of landmarks used to bound a single point-to-point query.
+    ACTIVE_LANDMARKS = 4
+
+    def __init__(self, network: Graph, sources: list[str]):
+        self.network = network
+        self.sources = sources
+        self.trees = [network.dijkstra(source) for source in sources]
+
+    @classmethod
+    def farthest_points(cls, network: Graph, count: int) -> "DistanceIndex":
+        """
+        Returns an index of count landmarks for ALT, chosen one by one as the
+        node farthest from the landmarks chosen so far. Nodes in components
+        without a landmark count as the farthest.
+        """
+        index = cls(network, [])
+        if not network.nodes:
+            return index
+        # Distance to the closest landmark; the first one is taken as
+        # farthest from an arbitrary node.
+        nearest = network.search([(0, 0)]).dist
+        while len(index.sources) < count:
+            node = max(range(len(nearest)), key=nearest.__getitem__)
+            if nearest[node] == 0:
+                break  # every node is a landmark
+            index.add_source(network.nodes[node])
+            dist = index.trees[-1].dist
+            if len(index.sources) == 1:
+                nearest = array("q", dist)
+            else:
+                for i, d in enumerate(dist):
+                    if d < nearest[i]:
+                        nearest[i] = d
+        return index
+
+    def copy(self) -> "DistanceIndex":
+        """Returns an index of the same trees, which can be updated separately."""
+        index = DistanceIndex(self.network, [])
+        index.sources = list(self.sources)
+        index.trees = list(self.trees)
+        return index
+
+    def add_edge(self, network: Graph, n1: str, n2: str, length: int):
+        """
+        Switches to network, which is the indexed graph with an edge between
+        n1 and n2 added, relaxing only the distances the new edge improves.
+        """
+        self.network = network
+        a, b = network.index[n1], network.index[n2]
+        for i, tree in enumerate(self.trees):
+            da, db = tree.dist[a], tree.dist[b]
+            if da != INFINITY and da + length < db:
+                seed = (b, da + length, a)
+            elif db != INFINITY and db + length < da:
+                seed = (a, db + length, b)
+            else:
+                self.trees[i] = ShortestPathTree(
+                    network, tree.dist, tree.pred, tree.settled
+                )
+                continue
+            self.trees[i] = tree.copy(network)
+            self.trees[i].improve([seed])
+
+    def remove_edge(self, network: Graph, slots: list[tuple[int, int, int]]):
+        """
+        Switches to network, which is the indexed graph with an edge removed.
+        Slots are the removed edge's slots as returned by Graph.edge_slots.
+        Only the trees which may have used the edge are computed again.
+        """
+        self.network = network
+        for i, tree in enumerate(self.trees):
+            if tree.uses(slots):
+                self.trees[i] = network.dijkstra(self.sources[i])
+            else:
+                self.trees[i] = ShortestPathTree(
+                    network, tree.dist, tree.pred, tree.settled
+                )
+
+    def add_source(self, source: str):
+        """Adds a new source at the end of the list and computes its tree."""
+        self.sources.append(source)
+        self.trees.append(self.network.dijkstra(source))
+
+    def remove_source(self, source: str):
+        """Removes a source and its tree."""
+        i = self.sources.index(source)
+        del self.sources[i], self.trees[i]
+
+    def path(self, n1: str, n2: str) -> list[str] | None:
+        """
+        Returns the shortest path from n1 to n2, where n1 or n2 is a source,
+        read from its tree, or None if they are not connected.
+        Raises KeyError if neither is a source.
+        """
+        if n1 in self.sources:
+            return self.trees[self.sources.index(n1)].path(n2)
+        if n2 in self.sources:
+            path = self.trees[self.sources.index(n2)].path(n1)
+            return None if path is None else path[::-1]
+        raise KeyError("Neither {} nor {} is a source".format(n1, n2))
+
+    def distances_to_sources(self, node: str) -> dict[str, int]:
+        """Returns distances from node to all sources it can reach."""
+        i = self.network.index[node]
+        res = {}
+        for source, tree in zip(self.sources, self.trees):
+            if tree.dist[i] != INFINITY:
+                res[source] = tree.dist[i]
+        return res
+
+    def matrix(self) -> dict[str, list[int | None]]:
+        """Returns distances between all pairs of sources (None if unreachable)."""
+        columns = [self.network.index[source] for source in self.sources]
+        return {
+            source: [None if tree.dist[i] == INFINITY else tree.dist[i] for i in columns]
+            for source, tree in zip(self.sources, self.trees)
+        }
+
+    def bound_to(self, source: int, target: int) -> Callable[[int], int] | None:
+        """
+        Returns a function giving a lower bound on the distance from a node to
+        target, using the landmarks that best separate source from target.
+        """
+        ranked = []
+        for tree in self.trees:
+            ds, dt = tree.dist[source], tree.dist[target]
+            if ds != INFINITY and dt != INFINITY:
+                ranked.append((abs(ds - dt), tree))
+        if not ranked:
+            return None
+        ranked.sort(key=lambda pair: pair[0], reverse=True)
+        active = [
+            (tree.dist, tree.dist[target])
+            for _, tree in ranked[: self.ACTIVE_LANDMARKS]
+        ]
+
+        def bound(node: int) -> int:
+            res = 0
+            for dist, dt in active:
+                d = dist[node]
+                if d == INFINITY:
+                    continue
+                if d - dt > res:
+                    res = d - dt
+                elif dt - d > res:
+                    res = dt - d
+            return res
+
+        return bound
@@ -0,0 +1,96 @@
+"""
+Adjacency lists of an undirected graph, changed in place by both services.
+
+Besides the lists (node -> edges, as used everywhere else) the store keeps:
+* the kind of every node (e.g. "external" or "internal"), and nodes of each
+  kind in order of addition, as dictionaries used as ordered sets,
+* positions of both halves of every edge in the lists, by edge id,
+* a version, incremented on every change, for caches of derived data.
+
+Edges are removed by moving the last edge of the list into the freed
+position, so no operation depends on the size of the graph.
+"""
+
+from collections.abc import Iterable
+from common.graph import Edge
+
+
+class GraphStore:
+    def __init__(
+        self,
+        edges: dict[str, list[Edge]],
+        kinds: dict[str, Iterable[str]] | None = None,
+    ):
+        # Shared with the caller, who may read (not change) it directly.
+        self.edges = edges
+        self.kinds: dict[str, dict[str, None]] = {}
+        self.__kind: dict[str, str] = {}
+        self.__positions: dict[str, list[tuple[str, int]]] = {}
+        self.version = 0
+        for kind, nodes in (kinds or {}).items():
+            self.kinds[kind] = {}
+            for node in nodes:
+                self.add_node(node, kind)
+        for node, node_edges in edges.items():
+            if node_edges is None:
+                edges[node] = node_edges = []
+            for position, edge in enumerate(node_edges):
+                self.__positions.setdefault(edge.id, []).append((node, position))
+
+    def __contains__(self, node) -> bool:
+        return node in self.__kind
+
+    def kind(self, node) -> str:
+        return self.__kind[node]
+
+    def nodes(self, kind) -> list[str]:
+        """Returns nodes of the kind in order of addition."""
+        return list(self.kinds.get(kind, ()))
+
+    def add_node(self, node, kind):
+        self.__kind[node] = kind
+        self.kinds.setdefault(kind, {})[node] = None
+        self.edges.setdefault(node, [])
+        self.version += 1
+
+    def set_kind(self, node, kind) -> bool:
+        """Moves the node to the end of nodes of the kind, if it isn't one."""
+        old = self.__kind[node]
+        if old == kind:
+            return False
+        del self.kinds[old][node]
+        self.kinds.setdefault(kind, {})[node] = None
+        self.__kind[node] = kind
+        self.version += 1
+        return True
+
+    def has_edge(self, edge_id) -> bool:
+        return edge_id in self.__positions
+
+    def endpoints(self, edge_id) -> list[str]:
+        """Returns nodes whose lists hold halves of the edge, none if unknown."""
+        return [node for node, _ in self.__positions.get(edge_id, ())]
+
+    def add_edge(self, v1, v2, edge_id, length):
+        """Adds the edge to lists of both of its endpoints."""
+        for a, b in [(v1, v2), (v2, v1)]:
+            node_edges = self.edges.setdefault(a, [])
+            self.__positions.setdefault(edge_id, []).append((a, len(node_edges)))
+            node_edges.append(Edge(a, b, edge_id, length))
+        self.version += 1
+
+    def remove_edge(self, edge_id) -> bool:
+        """Removes both halves of the edge. Returns False if it is unknown."""
+        positions = self.__positions.pop(edge_id, None)
+        if positions is None:
+            return False
+        # The later half goes first, so the earlier one can't be moved.
+        for node, position in sorted(positions, key=lambda p: -p[1]):
+            node_edges = self.edges[node]
+            last = node_edges.pop()
+            if position < len(node_edges):
+                node_edges[position] = last
+                moved = self.__positions[last.id]
+                moved[moved.index((node, len(node_edges)))] = (node, position)
+        self.version += 1
+        return True
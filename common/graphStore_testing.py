@@ -0,0 +1,71 @@
+import random
+import unittest
+from common import graph, graphStore
+
+
+class GraphStoreTestCase(unittest.TestCase):
+    def test_nodes(self):
+        store = graphStore.GraphStore({}, {"external": ["v1"], "internal": ["v2", "v3"]})
+        self.assertIn("v2", store)
+        self.assertNotIn("v4", store)
+        self.assertTrue(store.set_kind("v2", "external"))
+        self.assertFalse(store.set_kind("v2", "external"))
+        self.assertEqual(["v1", "v2"], store.nodes("external"))
+        self.assertEqual(["v3"], store.nodes("internal"))
+        self.assertEqual({"v1": [], "v2": [], "v3": []}, store.edges)
+
+    def test_edges(self):
+        edges = {
+            "v1": [graph.Edge("v1", "v2", "e1", 1)],
+            "v2": [graph.Edge("v2", "v1", "e1", 1)],
+        }
+        store = graphStore.GraphStore(edges)
+        store.add_edge("v2", "v3", "e2", 5)
+        self.assertEqual(["v2", "v3"], store.endpoints("e2"))
+        version = store.version
+        self.assertTrue(store.remove_edge("e1"))
+        self.assertFalse(store.remove_edge("e1"))
+        self.assertGreater(store.version, version)
+        self.assertEqual([], store.endpoints("e1"))
+        self.assertEqual(
+            {"v1": [], "v2": [("v3", "e2", 5)], "v3": [("v2", "e2", 5)]},
+            {
+                node: [(edge.n2, edge.id, edge.length) for edge in node_edges]
+                for node, node_edges in edges.items()
+            },
+        )
+
+    def test_random_changes(self):
+        rng = random.Random(1)
+        store = graphStore.GraphStore({})
+        expected = {}
+        for i in range(500):
+            if expected and rng.random() < 0.4:
+                edge_id = rng.choice(sorted(expected))
+                del expected[edge_id]
+                self.assertTrue(store.remove_edge(edge_id))
+            else:
+                # Self-loops included.
+                a, b = rng.choice("abcde"), rng.choice("abcde")
+                expected[f"e{i}"] = (a, b)
+                store.add_edge(a, b, f"e{i}", i)
+            halves = sorted(
+                (edge.n1, edge.n2, edge.id)
+                for node, node_edges in store.edges.items()
+                for edge in node_edges
+                if edge.n1 == node
+            )
+            self.assertEqual(
+                sorted(
+                    half
+                    for edge_id, (a, b) in expected.items()
+                    for half in [(a, b, edge_id), (b, a, edge_id)]
+                ),
+                halves,
+            )
+            for edge_id, (a, b) in expected.items():
+                self.assertEqual(sorted([a, b]), sorted(store.endpoints(edge_id)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,18 @@
+from array import array
+import random
 import unittest
-import graph
+from common import graph
+
+
+def random_edges(node_count, edge_count, rng):
+    """Generates a random undirected graph as adjacency lists of Edge objects."""
+    edges = {f"v{i}": [] for i in range(node_count)}
+    for i in range(edge_count):
+        a, b = rng.sample(sorted(edges), 2)
+        length = rng.randint(1, 20)
+        edges[a].append(graph.Edge(a, b, f"e{i}", length))
+        edges[b].append(graph.Edge(b, a, f"e{i}", length))
+    return edges
 
 
 class DijkstraTestCase(unittest.TestCase):
@@ -42,6 +55,132 @@ class DijkstraTestCase(unittest.TestCase):
         expected_path = ["v3", "v1"]
         self.assertEqual(expected_path, result_path.compute())
 
+    def test_graph_search(self):
+        tree = graph.Graph.from_edges(self.edges).dijkstra("v1")
+        self.assertEqual({"v1": 0, "v2": 2, "v3": 3}, tree.distances())
+        self.assertEqual(["v1", "v2", "v3"], tree.path("v3"))
+
+    def test_graph_unreachable(self):
+        network = graph.Graph.from_edges(self.edges2, ["v1", "v2", "v3", "v4"])
+        tree = network.dijkstra("v1")
+        self.assertEqual({"v1": 0, "v2": 2, "v3": 1}, tree.distances())
+        self.assertIsNone(tree.distance("v4"))
+        self.assertIsNone(tree.path("v4"))
+
+    def test_graph_multiple_sources(self):
+        network = graph.Graph.from_edges(self.edges)
+        tree = network.search([(network.index["v1"], 5), (network.index["v3"], 0)])
+        self.assertEqual({"v1": 3, "v2": 1, "v3": 0}, tree.distances())
+        self.assertEqual(["v3", "v2"], tree.path("v2"))
+
+    def test_distance_index(self):
+        network = graph.Graph.from_edges(self.edges)
+        index = graph.DistanceIndex(network, ["v1", "v3"])
+        self.assertEqual({"v1": 2, "v3": 1}, index.distances_to_sources("v2"))
+        self.assertEqual({"v1": [0, 3], "v3": [3, 0]}, index.matrix())
+        self.assertEqual(["v1", "v2", "v3"], index.path("v1", "v3"))
+        self.assertEqual(["v2", "v3"], index.path("v2", "v3"))
+        self.assertRaises(KeyError, index.path, "v2", "v2")
+
+    def test_point_to_point(self):
+        rng = random.Random(1)
+        edges = random_edges(60, 90, rng)
+        network = graph.Graph.from_edges(edges)
+        index = graph.DistanceIndex(network, ["v0", "v7", "v13"])
+        farthest = graph.DistanceIndex.farthest_points(network, 5)
+        for _ in range(50):
+            a, b = rng.sample(network.nodes, 2)
+            expected = network.dijkstra(a).distance(b)
+            for tree in [
+                network.point_to_point(a, b),
+                network.point_to_point(a, b, index),
+                network.point_to_point(a, b, farthest),
+                network.bidirectional(a, b),
+            ]:
+                self.assertEqual(expected, tree.distance(b))
+                if expected is not None:
+                    path = tree.path(b)
+                    self.assertEqual([a, b], [path[0], path[-1]])
+                    length = sum(
+                        min(e.length for e in edges[x] if e.n2 == y)
+                        for x, y in zip(path, path[1:])
+                    )
+                    self.assertEqual(expected, length)
+
+    def test_farthest_points(self):
+        network = graph.Graph.from_edges(self.edges2, ["v1", "v2", "v3", "v4"])
+        index = graph.DistanceIndex.farthest_points(network, 3)
+        # v4 is unreachable from v1, then other nodes are unreachable from v4
+        # and v2 is the farthest from v1.
+        self.assertEqual(["v4", "v1", "v2"], index.sources)
+        self.assertEqual(
+            ["v4", "v1", "v2", "v3"],
+            graph.DistanceIndex.farthest_points(network, 10).sources,
+        )
+
+    def test_search_goals(self):
+        rng = random.Random(4)
+        network = graph.Graph.from_edges(random_edges(80, 160, rng))
+        for _ in range(30):
+            sources = {network.index[v]: rng.randint(0, 5) for v in network.nodes[:3]}
+            goals = {
+                network.index[v]: rng.randint(0, 5)
+                for v in rng.sample(network.nodes[3:], 3)
+            }
+            full = network.search(sources.items())
+            tree = network.search(sources.items(), goals)
+            expected = min(full.dist[g] + r for g, r in goals.items())
+            self.assertEqual(expected, min(tree.dist[g] + r for g, r in goals.items()))
+            self.assertLessEqual(tree.settled, full.settled)
+
+    def test_incremental_index(self):
+        rng = random.Random(2)
+        edges = random_edges(40, 50, rng)
+        network = graph.Graph.from_edges(edges)
+        index = graph.DistanceIndex(network, ["v0", "v5", "v9"])
+        names = [f"e{i}" for i in range(50)]
+        for step in range(40):
+            if step % 3 == 2:
+                name = names.pop(rng.randrange(len(names)))
+                slots = network.edge_slots(name)
+                self.assertEqual(2, len(slots))
+                network = network.without_edge(name)
+                index.remove_edge(network, slots)
+            else:
+                a, b = rng.sample(network.nodes, 2)
+                length = rng.randint(1, 20)
+                names.append(f"n{step}")
+                network = network.with_edge(a, b, f"n{step}", length)
+                index.add_edge(network, a, b, length)
+            expected = graph.DistanceIndex(network, ["v0", "v5", "v9"])
+            for tree, fresh in zip(index.trees, expected.trees):
+                self.assertEqual(fresh.dist, tree.dist)
+                for node in network.nodes:
+                    path = tree.path(node)
+                    if path is not None:
+                        self.assertEqual(path[-1], node)
+        self.assertEqual(len(network.targets), 2 * len(names))
+
+    def test_index_copy(self):
+        rng = random.Random(6)
+        network = graph.Graph.from_edges(random_edges(30, 40, rng))
+        index = graph.DistanceIndex(network, ["v0", "v3"])
+        before = [(array("q", tree.dist), tree.graph) for tree in index.trees]
+
+        updated = index.copy()
+        with_edge = network.with_edge("v0", "v29", "short", 1)
+        updated.add_edge(with_edge, "v0", "v29", 1)
+        slots = with_edge.edge_slots("e0")
+        updated.remove_edge(with_edge.without_edge("e0"), slots)
+        updated.add_source("v7")
+
+        self.assertEqual(["v0", "v3"], index.sources)
+        self.assertIs(network, index.network)
+        for tree, (dist, tree_graph) in zip(index.trees, before):
+            self.assertEqual(dist, tree.dist)
+            self.assertIs(tree_graph, tree.graph)
+        self.assertEqual(1, updated.trees[0].distance("v29"))
+
 
 if __name__ == "__main__":
     unittest.main()
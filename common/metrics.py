@@ -0,0 +1,161 @@
+"""
+Metrics of a process, exposed at /metrics in the Prometheus text format.
+
+Metrics are created at import time of the module which records them and
+kept in memory. Recording a value is a dictionary update under a lock;
+all formatting is done only when the endpoint is scraped.
+"""
+
+from bisect import bisect_left
+from collections.abc import Iterable
+from contextlib import contextmanager
+from threading import Lock
+import time
+
+# Upper bounds of histogram buckets, in seconds.
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)  # fmt: skip
+
+# All metrics of the process, in order of creation.
+registry: list["Counter | Histogram"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonically increasing values, one per combination of label values."""
+
+    def __init__(self, name, documentation, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = labels
+        self.__mutex = Lock()
+        self.__values: dict[tuple, float] = {}
+        registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self.__mutex:
+            self.__values[labels] = self.__values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self.__mutex:
+            values = list(self.__values.items())
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} counter".format(self.name),
+        ]
+        for labels, value in values:
+            lines.append(
+                "{}{} {}".format(self.name, _labels(self.labelNames, labels), value)
+            )
+        return lines
+
+
+class Histogram:
+    """Distributions of observed values, one per combination of label values."""
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = labels
+        self.buckets = buckets
+        self.__mutex = Lock()
+        # Per labels: counts of values in each bucket (the last one is +Inf)
+        # followed by the sum of all values.
+        self.__values: dict[tuple, list[float]] = {}
+
+        registry.append(self)
+
+    def observe(self, value, *labels):
+        bucket = bisect_left(self.buckets, value)
+        with self.__mutex:
+            counts = self.__values.get(labels)
+            if counts is None:
+                counts = self.__values[labels] = [0] * (len(self.buckets) + 2)
+            counts[bucket] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observes the time spent in the block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> list[str]:
+        with self.__mutex:
+            values = [(labels, list(counts)) for labels, counts in self.__values.items()]
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        names = self.labelNames + ("le",)
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name, _labels(names, labels + (bound,)), total
+                    )
+                )
+            suffix = _labels(self.labelNames, labels)
+            lines.append("{}_sum{} {}".format(self.name, suffix, counts[-1]))
+            lines.append("{}_count{} {}".format(self.name, suffix, total))
+        return lines
+
+
+def render() -> str:
+    """Returns all metrics in the Prometheus text format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram(
+    "routing_http_request_seconds",
+    "Time spent handling HTTP requests.",
+    ("method", "route", "status"),
+)
+
+
+def instrument(app):
+    """Adds the /metrics endpoint and request latency measurement to the app."""
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse
+
+    @app.middleware("http")
+    async def measure(request: Request, call_next):
+        start = time.perf_counter()
+        response = await call_next(request)
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            request.method,
+            route.path if route is not None else "unmatched",
+            response.status_code,
+        )
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        """Returns metrics of this process in the Prometheus text format."""
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,67 @@
+import unittest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from common import graph, metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_counter(self):
+        counter = metrics.Counter("test_counter_total", "Test.", ("kind",))
+        counter.inc("a")
+        counter.inc("a", amount=2)
+        self.assertEqual(
+            [
+                "# HELP test_counter_total Test.",
+                "# TYPE test_counter_total counter",
+                'test_counter_total{kind="a"} 3',
+            ],
+            counter.render(),
+        )
+
+    def test_histogram(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", buckets=(1.0, 2.0))
+        histogram.observe(0.5)
+        histogram.observe(1.5)
+        histogram.observe(3)
+        self.assertEqual(
+            [
+                "# HELP test_seconds Test.",
+                "# TYPE test_seconds histogram",
+                'test_seconds_bucket{le="1.0"} 1',
+                'test_seconds_bucket{le="2.0"} 2',
+                'test_seconds_bucket{le="+Inf"} 3',
+                "test_seconds_sum 5.0",
+                "test_seconds_count 3",
+            ],
+            histogram.render(),
+        )
+
+    def test_search_counters(self):
+        edges = {
+            "v1": [graph.Edge("v1", "v2", "e1", 1), graph.Edge("v1", "v3", "e2", 5)],
+            "v2": [graph.Edge("v2", "v3", "e3", 1)],
+            "v3": [],
+        }
+        before = graph.RELAXED.render()
+        graph.Graph.from_edges(edges).search([(0, 0)])
+        self.assertNotEqual(before, graph.RELAXED.render())
+        self.assertIn(
+            'routing_graph_heap_operations_total{kind="search"}', metrics.render()
+        )
+
+    def test_endpoint(self):
+        app = FastAPI()
+        metrics.instrument(app)
+
+        @app.get("/items/{item}")
+        def get_item(item: str):
+            return item
+
+        client = TestClient(app)
+        client.get("/items/a")
+        text = client.get("/metrics").text
+        self.assertIn('route="/items/{item}",status="200"', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
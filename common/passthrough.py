@@ -0,0 +1,119 @@
+"""
+Changes of a datacenter's passthrough matrix between versions of its data,
+so main is sent only what changed since the version it already has.
+
+A matrix maps every gateway (external node) to its row of distances to all
+gateways, in the order of the matrix's keys, None marking unreachable pairs.
+A Delta from version base to version lock lists the removed gateways and
+every changed cell, including all cells in rows and columns of new gateways.
+A Delta without base holds the whole matrix.
+"""
+
+from collections import deque
+from threading import Lock
+
+
+class Delta:
+    def __init__(self, base: str | None, lock: str):
+        self.base = base
+        self.lock = lock
+        self.removed: list[str] = []
+        # Changed cells as row -> column -> length.
+        self.rows: dict[str, dict[str, int | None]] = {}
+
+
+def full(lock, matrix: dict[str, list[int | None]]) -> Delta:
+    """Returns the whole matrix as a Delta without base."""
+    delta = Delta(None, lock)
+    columns = list(matrix)
+    delta.rows = {a: dict(zip(columns, row)) for a, row in matrix.items()}
+    return delta
+
+
+def diff(base, old: dict[str, list], lock, new: dict[str, list]) -> Delta:
+    """Returns changes from the matrix old at version base to new at lock."""
+    delta = Delta(base, lock)
+    delta.removed = [gateway for gateway in old if gateway not in new]
+    old_columns = {gateway: j for j, gateway in enumerate(old)}
+    columns = list(new)
+    for a, row in new.items():
+        old_row = old.get(a)
+        if old_row is None:
+            delta.rows[a] = dict(zip(columns, row))
+            continue
+        changed = {
+            b: length
+            for b, length in zip(columns, row)
+            if b not in old_columns or old_row[old_columns[b]] != length
+        }
+        if changed:
+            delta.rows[a] = changed
+    return delta
+
+
+def apply(cells: dict[str, dict[str, int]], delta: Delta):
+    """
+    Applies the delta to cells, a matrix kept as row -> column -> length
+    without unreachable pairs and without the diagonal. Removals go first,
+    so a gateway removed and added again gets all of its new cells.
+    """
+    if delta.base is None:
+        cells.clear()
+    for gateway in delta.removed:
+        cells.pop(gateway, None)
+        for row in cells.values():
+            row.pop(gateway, None)
+    for a, changed in delta.rows.items():
+        row = cells.setdefault(a, {})
+        for b, length in changed.items():
+            if a == b or length is None:
+                row.pop(b, None)
+            else:
+                row[b] = length
+
+
+class History:
+    """Deltas between the last `limit` versions of a matrix"""
+
+    def __init__(self, limit: int):
+        self.lock = None
+        self.matrix: dict[str, list] = {}
+        self.__deltas: deque[Delta] = deque(maxlen=limit)
+        self.__mutex = Lock()
+
+    def update(self, lock, matrix: dict[str, list]):
+        """Records the matrix of version lock, if it is a new version."""
+        if lock == self.lock:
+            return
+        delta = None
+        if self.lock is not None:
+            delta = diff(self.lock, self.matrix, lock, matrix)
+        with self.__mutex:
+            if delta is not None:
+                self.__deltas.append(delta)
+            self.lock, self.matrix = lock, matrix
+
+    def since(self, base) -> Delta:
+        """
+        Returns changes from version base to the current one, or the whole
+        matrix if base is not one of the recorded versions.
+        """
+        with self.__mutex:
+            lock, matrix, deltas = self.lock, self.matrix, list(self.__deltas)
+        merged = Delta(base, lock)
+        if base == lock:
+            return merged
+        starts = [delta.base for delta in deltas]
+        if base not in starts:
+            return full(lock, matrix)
+
+        for delta in deltas[starts.index(base) :]:
+            for gateway in delta.removed:
+                merged.rows.pop(gateway, None)
+                for row in merged.rows.values():
+                    row.pop(gateway, None)
+                if gateway not in merged.removed:
+                    merged.removed.append(gateway)
+            for a, changed in delta.rows.items():
+                merged.rows.setdefault(a, {}).update(changed)
+        return merged
@@ -0,0 +1,61 @@
+import random
+import unittest
+from common import passthrough
+
+
+def random_matrix(rng, gateways):
+    return {
+        a: [None if rng.random() < 0.2 else rng.randint(0, 50) for _ in gateways]
+        for a in gateways
+    }
+
+
+def cells(matrix):
+    """Returns the matrix as passthrough.apply keeps it."""
+    columns = list(matrix)
+    return {
+        a: {
+            b: length
+            for b, length in zip(columns, row)
+            if a != b and length is not None
+        }
+        for a, row in matrix.items()
+    }
+
+
+class PassthroughTestCase(unittest.TestCase):
+    def test_diff(self):
+        old = {"g1": [0, 5], "g2": [5, 0]}
+        new = {"g2": [0, 7], "g3": [7, 0]}
+        delta = passthrough.diff("l1", old, "l2", new)
+        self.assertEqual(["g1"], delta.removed)
+        self.assertEqual({"g2": {"g3": 7}, "g3": {"g2": 7, "g3": 0}}, delta.rows)
+
+    def test_history(self):
+        rng = random.Random(5)
+        history = passthrough.History(4)
+        gateways = [f"g{i}" for i in range(8)]
+        versions = []
+        for version in range(10):
+            # Gateways come and go, and some distances change.
+            rng.shuffle(gateways)
+            matrix = random_matrix(rng, gateways[: rng.randint(2, 8)])
+            lock = f"lock:{version}"
+            history.update(lock, matrix)
+            versions.append((lock, matrix))
+
+        for base, matrix in versions:
+            delta = history.since(base)
+            known = cells(matrix)
+            passthrough.apply(known, delta)
+            self.assertEqual(cells(versions[-1][1]), known, base)
+            self.assertEqual("lock:9", delta.lock)
+            # Only the last versions are kept.
+            self.assertEqual(base < "lock:5", delta.base is None, base)
+
+        self.assertEqual({}, history.since("lock:9").rows)
+        self.assertIsNone(history.since("unknown").base)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,264 @@
+"""
+Compact binary snapshots of worker (LocalData) and main (MainData) state.
+
+A snapshot consists of a header (magic, format version, kind), a string
+table and a fixed sequence of columns for the given kind. Every string
+(node, edge and datacenter ids, locks) is stored once in the table and
+referred to by its index. Columns are packed arrays of unsigned 32-bit
+string indices or signed 64-bit integers, little-endian and 8-byte aligned,
+so the loader reads them through memoryview casts of the input buffer
+(bytes or mmap) without copying.
+
+Adjacency lists are stored as columns of keys, list lengths and Edge
+attributes, all in the original order, so loading gives back exactly
+the state that was dumped. Edge ids and locks are always loaded as str.
+
+The same format carries changes of passthrough matrices from workers to
+main: a whole matrix as one dense column, a delta as sparse cells.
+"""
+
+from array import array
+from common import graph, passthrough
+import struct
+import sys
+
+MAGIC = b"RTSN"
+VERSION = 1
+
+LOCAL_DATA = 1
+MAIN_DATA = 2
+PASSTHROUGH = 3
+
+# Marks None in integer columns.
+NONE = -(1 << 63)
+
+_HEADER = struct.Struct("<4sHH")
+_COLUMN = struct.Struct("<cxxxI")
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _pad(size):
+    return b"\0" * (-size % 8)
+
+
+class _Writer:
+    def __init__(self, kind):
+        self.kind = kind
+        self.strings: dict[str, int] = {}
+        self.columns: list[array] = []
+
+    def string(self, value) -> int:
+        """Interns the value (converted to str) and returns its index."""
+        return self.strings.setdefault(str(value), len(self.strings))
+
+    def string_column(self, values):
+        self.columns.append(array("I", [self.string(value) for value in values]))
+
+    def int_column(self, values):
+        self.columns.append(
+            array("q", [NONE if value is None else value for value in values])
+        )
+
+    def edges(self, edges: dict[str, list[graph.Edge]]):
+        """Writes adjacency lists as columns of keys, lengths and edge attributes."""
+        self.string_column(edges.keys())
+        self.int_column(len(node_edges) for node_edges in edges.values())
+        all_edges = [edge for node_edges in edges.values() for edge in node_edges]
+        self.string_column(edge.n2 for edge in all_edges)
+        self.string_column(edge.id for edge in all_edges)
+        self.int_column(edge.length for edge in all_edges)
+
+    def finish(self) -> bytes:
+        blobs = [value.encode() for value in self.strings]
+        offsets = array("I", [0])
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        text = b"".join(blobs)
+
+        parts = [_HEADER.pack(MAGIC, VERSION, self.kind)]
+        for column in [offsets, array("B", text)] + self.columns:
+            if not _LITTLE_ENDIAN and column.itemsize > 1:
+                column = array(column.typecode, column)
+                column.byteswap()
+            data = column.tobytes()
+            parts += [_COLUMN.pack(column.typecode.encode(), len(column)), data]
+            parts.append(_pad(len(data)))
+        return b"".join(parts)
+
+
+class _Reader:
+    def __init__(self, buffer, kind):
+        self.view = memoryview(buffer).cast("B")
+        magic, version, found_kind = _HEADER.unpack_from(self.view, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a snapshot")
+        if version != VERSION:
+            raise ValueError("Unsupported snapshot version {}".format(version))
+        if found_kind != kind:
+            raise ValueError("Snapshot of kind {} expected".format(kind))
+        self.position = _HEADER.size
+
+        offsets = self.column("I")
+        text = self.column("B")
+        self.strings = [
+            str(text[offsets[i] : offsets[i + 1]], "utf-8")
+            for i in range(len(offsets) - 1)
+        ]
+
+    def column(self, typecode):
+        """Returns the next column as a memoryview (or array) of typecode."""
+        found, size = _COLUMN.unpack_from(self.view, self.position)
+        if found != typecode.encode():
+            raise ValueError("Corrupted snapshot")
+        start = self.position + _COLUMN.size
+        end = start + size * array(typecode).itemsize
+        self.position = end + (-end % 8)
+        values = self.view[start:end].cast(typecode)
+        if not _LITTLE_ENDIAN and values.itemsize > 1:
+            values = array(typecode, values)
+            values.byteswap()
+        return values
+
+    def string_column(self) -> list[str]:
+        strings = self.strings
+        return [strings[i] for i in self.column("I")]
+
+    def int_column(self) -> list:
+        return [None if value == NONE else value for value in self.column("q")]
+
+    def edges(self) -> dict[str, list[graph.Edge]]:
+        keys = self.string_column()
+        lengths = self.column("q")
+        targets = self.string_column()
+        ids = self.string_column()
+        weights = self.column("q")
+        edges = {}
+        position = 0
+        for key, count in zip(keys, lengths):
+            edges[key] = [
+                graph.Edge(key, targets[i], ids[i], weights[i])
+                for i in range(position, position + count)
+            ]
+            position += count
+        return edges
+
+
+def is_snapshot(buffer) -> bool:
+    """Checks if the buffer starts like a snapshot (and not like JSON)."""
+    return bytes(memoryview(buffer)[: len(MAGIC)]) == MAGIC
+
+
+def dump_local_data(data) -> bytes:
+    """Returns a snapshot of worker's LocalData."""
+    writer = _Writer(LOCAL_DATA)
+    writer.string_column([data.dataLock])
+    writer.string_column(data.internalNodes)
+    writer.string_column(data.externalNodes)
+    writer.edges(data.edges)
+
+    rows = list(data.passthroughMatrix)
+    width = len(data.passthroughMatrix[rows[0]]) if rows else 0
+    if any(len(data.passthroughMatrix[row]) != width for row in rows):
+        raise ValueError("Passthrough matrix is not rectangular")
+    writer.string_column(rows)
+    writer.int_column([width])
+    writer.int_column(
+        length for row in rows for length in data.passthroughMatrix[row]
+    )
+    return writer.finish()
+
+
+def load_local_data(buffer, data):
+    """Fills worker's LocalData (data) from a snapshot."""
+    reader = _Reader(buffer, LOCAL_DATA)
+    (data.dataLock,) = reader.string_column()
+    data.internalNodes = reader.string_column()
+    data.externalNodes = reader.string_column()
+    data.edges = reader.edges()
+
+    rows = reader.string_column()
+    (width,) = reader.column("q")
+    matrix = reader.int_column()
+    data.passthroughMatrix = {
+        row: matrix[i * width : (i + 1) * width] for i, row in enumerate(rows)
+    }
+    return data
+
+
+def dump_main_data(data) -> bytes:
+    """Returns a snapshot of main's MainData."""
+    writer = _Writer(MAIN_DATA)
+    writer.string_column([data.dataLock])
+    writer.string_column(data.dataCenters)
+    writer.string_column(data.serverToDcMapping.keys())
+    writer.string_column(data.serverToDcMapping.values())
+    writer.string_column(data.noExternalConnections.keys())
+    writer.int_column(data.noExternalConnections.values())
+    writer.string_column(data.edgesToDC.keys())
+    # External edges are marked with -1 instead of a datacenter.
+    writer.int_column(
+        None if dc == -1 else writer.string(dc) for dc in data.edgesToDC.values()
+    )
+    writer.edges(data.externalEdges)
+    return writer.finish()
+
+
+def load_main_data(buffer, data):
+    """Fills main's MainData (data) from a snapshot."""
+    reader = _Reader(buffer, MAIN_DATA)
+    (data.dataLock,) = reader.string_column()
+    data.dataCenters = reader.string_column()
+    data.serverToDcMapping = dict(zip(reader.string_column(), reader.string_column()))
+    data.noExternalConnections = dict(zip(reader.string_column(), reader.int_column()))
+    keys = reader.string_column()
+    data.edgesToDC = {
+        key: -1 if dc is None else reader.strings[dc]
+        for key, dc in zip(keys, reader.int_column())
+    }
+    data.externalEdges = reader.edges()
+    return data
+
+
+def dump_passthrough(delta: passthrough.Delta) -> bytes:
+    """Returns a passthrough.Delta in binary form."""
+    writer = _Writer(PASSTHROUGH)
+    writer.string_column([delta.lock] + ([] if delta.base is None else [delta.base]))
+    rows = list(delta.rows)
+    writer.string_column(rows)
+    if delta.base is None:
+        # The whole matrix, with columns in the order of rows.
+        writer.int_column(delta.rows[a][b] for a in rows for b in rows)
+        return writer.finish()
+
+    writer.string_column(delta.removed)
+    writer.int_column(len(delta.rows[a]) for a in rows)
+    writer.string_column(b for a in rows for b in delta.rows[a])
+    writer.int_column(length for a in rows for length in delta.rows[a].values())
+    return writer.finish()
+
+
+def load_passthrough(buffer) -> passthrough.Delta:
+    """Reads a passthrough.Delta dumped by dump_passthrough."""
+    reader = _Reader(buffer, PASSTHROUGH)
+    locks = reader.string_column()
+    delta = passthrough.Delta(locks[1] if len(locks) > 1 else None, locks[0])
+    rows = reader.string_column()
+    if delta.base is None:
+        lengths = reader.int_column()
+        width = len(rows)
+        delta.rows = {
+            a: dict(zip(rows, lengths[i * width : (i + 1) * width]))
+            for i, a in enumerate(rows)
+        }
+        return delta
+
+    delta.removed = reader.string_column()
+    counts = reader.column("q")
+    columns = reader.string_column()
+    lengths = reader.int_column()
+    position = 0
+    for a, count in zip(rows, counts):
+        end = position + count
+        delta.rows[a] = dict(zip(columns[position:end], lengths[position:end]))
+        position = end
+    return delta
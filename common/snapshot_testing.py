@@ -0,0 +1,113 @@
+import json
+import os
+import random
+import unittest
+import jsonpickle
+from common import graph, passthrough, snapshot
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "testing", "empty_graph")
+
+
+class LocalData:
+    pass
+
+
+class MainData:
+    pass
+
+
+CLASSES = {"worker.main.LocalData": LocalData, "main.main.MainData": MainData}
+
+
+def state(data):
+    """Returns plain JSON state of the data, as stored before snapshots."""
+    return json.loads(jsonpickle.encode(data, unpicklable=False))
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def assert_equivalent(self, data, dump, load):
+        buffer = dump(data)
+        self.assertTrue(snapshot.is_snapshot(buffer))
+        loaded = load(memoryview(buffer), type(data)())
+        expected = state(data)
+        # Overlay data main no longer keeps, still present in old fixtures.
+        expected.pop("internalPassthrough", None)
+        self.assertEqual(expected, state(loaded))
+
+    def test_fixtures(self):
+        for name in sorted(os.listdir(FIXTURES)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(FIXTURES, name)) as file:
+                text = file.read()
+            self.assertFalse(snapshot.is_snapshot(text.encode()))
+            data = jsonpickle.decode(text, classes=CLASSES)
+            if isinstance(data, LocalData):
+                self.assert_equivalent(
+                    data, snapshot.dump_local_data, snapshot.load_local_data
+                )
+            else:
+                self.assert_equivalent(
+                    data, snapshot.dump_main_data, snapshot.load_main_data
+                )
+
+    def test_local_data(self):
+        rng = random.Random(3)
+        data = LocalData()
+        nodes = [f"A{i}" for i in range(30)]
+        data.dataLock = "lock"
+        data.externalNodes = nodes[:5]
+        data.internalNodes = nodes[5:]
+        data.edges = {node: [] for node in nodes}
+        for i in range(60):
+            a, b = rng.sample(nodes, 2)
+            length = rng.randint(1, 100)
+            data.edges[a].append(graph.Edge(a, b, f"e{i}", length))
+            data.edges[b].append(graph.Edge(b, a, f"e{i}", length))
+        data.passthroughMatrix = {
+            a: [rng.choice([None, rng.randint(0, 500)]) for _ in data.externalNodes]
+            for a in data.externalNodes
+        }
+        self.assert_equivalent(data, snapshot.dump_local_data, snapshot.load_local_data)
+
+    def test_main_data(self):
+        data = MainData()
+        data.dataLock = "ąę-lock"
+        data.dataCenters = ["A", "B"]
+        data.serverToDcMapping = {"A1": "A", "A2": "A", "B1": "B"}
+        data.noExternalConnections = {"A1": 1, "A2": 0, "B1": 1}
+        data.edgesToDC = {"e1": -1, "e2": "A"}
+        data.externalEdges = {
+            "A1": [graph.Edge("A1", "B1", "e1", 7)],
+            "B1": [graph.Edge("B1", "A1", "e1", 7)],
+        }
+        self.assert_equivalent(data, snapshot.dump_main_data, snapshot.load_main_data)
+
+    def test_passthrough(self):
+        matrix = {"g1": [0, 5, None], "g2": [5, 0, 8], "g3": [None, 8, 0]}
+        whole = passthrough.full("l1", matrix)
+        loaded = snapshot.load_passthrough(snapshot.dump_passthrough(whole))
+        self.assertEqual((None, "l1"), (loaded.base, loaded.lock))
+        self.assertEqual(whole.rows, loaded.rows)
+
+        new = {"g2": [0, 9], "g4": [9, 0]}
+        delta = passthrough.diff("l1", matrix, "l2", new)
+        loaded = snapshot.load_passthrough(snapshot.dump_passthrough(delta))
+        self.assertEqual(("l1", "l2"), (loaded.base, loaded.lock))
+        self.assertEqual(["g1", "g3"], loaded.removed)
+        self.assertEqual(delta.rows, loaded.rows)
+
+    def test_rejects_other_data(self):
+        with self.assertRaises(ValueError):
+            snapshot.load_local_data(b'{"py/object": "x"}', LocalData())
+        data = MainData()
+        data.__dict__.update(
+            dataLock="", dataCenters=[], serverToDcMapping={},
+            noExternalConnections={}, edgesToDC={}, externalEdges={},
+        )
+        with self.assertRaises(ValueError):
+            snapshot.load_local_data(snapshot.dump_main_data(data), LocalData())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from time import monotonic
+
+
+class ResultCache:
+    """LRU cache of query results whose entries expire after ttl seconds
+
+    Callers put versions of all data a result depends on into its key,
+    so entries computed from outdated data are simply never hit again
+    and get evicted as least recently used.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__entries: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        """Returns the cached value or None, counting hits and misses."""
+        entry = self.__entries.get(key)
+        if entry is not None and entry[1] < monotonic():
+            del self.__entries[key]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.__entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        """Stores the value, evicting the least recently used entries if full."""
+        if self.size <= 0:
+            return
+        self.__entries[key] = (value, monotonic() + self.ttl)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.size:
+            self.__entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.__entries),
+            "capacity": self.size,
+            "ttl": self.ttl,
+        }
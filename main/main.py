@@ -1,12 +1,23 @@
+import asyncio
+from contextlib import asynccontextmanager
+import httpx
 import jsonpickle
 from fastapi import FastAPI, HTTPException
-from common import fileOperations, graph
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from common import changeLog, compute, graph, graphStore, metrics, snapshot
+import json
 import uuid
 import logging
+import threading
+from main.cache import ResultCache
+from main.overlay import Overlay
 from main.workers import Workers
+from models import AddEdge, Batch, DeleteEdge, DistanceQuery, SetNodeStatus
 import os
 
 app = FastAPI()
+metrics.instrument(app)
 logger = logging.getLogger("uvicorn")
 workers = Workers()
 
@@ -28,38 +39,155 @@ class MainData:
     edgesToDC = {}
     # Maps each datacenter into its external connections.
     externalEdges: dict[str, list[graph.Edge]] = {}
-    # Maps each datacenter into its passthrough connections [datacenter->(server->edges)].
-    internalPassthrough: dict[str, dict[str, list[graph.Edge]]] = {}
 
 
 data = MainData()
+# Index of data.externalEdges, which it changes in place.
+store = graphStore.GraphStore(data.externalEdges)
+# Gateways with passthrough and external edges, kept between queries.
+overlay = Overlay(os.environ.get("OVERLAY_ENGINE", "dijkstra"))
+# Results of getRoute and getDistance queries.
+results = ResultCache(
+    int(os.environ.get("RESULT_CACHE_SIZE", "10000")),
+    float(os.environ.get("RESULT_CACHE_TTL", "60")),
+)
 dataFile = "datam.json"
 lockFile = "lockm.lock"
+dataLog = changeLog.ChangeLog(dataFile, lockFile)
+# Seconds between checks for new data written by the authoritative main.
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", "1"))
+# Seconds between fetches of passthrough data changed by workers. Cached
+# results may be this much older than the workers' data.
+WORKER_REFRESH_INTERVAL = float(os.environ.get("WORKER_REFRESH_INTERVAL", "1"))
+# Held while data is refreshed or saved, which happens in different threads.
+dataMutex = threading.RLock()
+# Held by mutations from validation until their changes are saved, and by
+# periodic refreshes, so data is not changed under a mutation in progress.
+mutationLock = asyncio.Lock()
+# Overlay searches run in this many processes, or in the threadpool if 0.
+pool = compute.ComputePool(int(os.environ.get("COMPUTE_PROCESSES", "0")))
 
 
 def refresh_data():
-    """For non-authoritative workers, check if there is new data present and load."""
-    logger.info("refreshData()")
-    global data
-    if fileOperations.check_lock(lockFile, data.dataLock):
-        logger.info("refreshData(): nothing to refresh")
-        return
-    text_data = fileOperations.read_file(dataFile)
-    data = jsonpickle.loads(text_data)
-    logger.info("refreshData(): refreshed")
-
-
-def save_data():
-    """Save main data into the storage."""
-    data.dataLock = uuid.uuid4()
-    text_data = jsonpickle.encode(data)
-    fileOperations.save_file(dataFile, text_data)
-    fileOperations.save_file(lockFile, str(data.dataLock))
-
-
-def pass_to_workers(dc_id, endpoint) -> dict:
-    """Call given worker with given endpoint."""
-    received_data = workers.request(dc_id, endpoint)
+    """
+    For non-authoritative workers, check if there is new data present and load.
+    Only the change log records after the current lock are fetched if possible.
+    Called periodically by refresh_periodically, and explicitly by writes
+    which must see the latest data.
+    """
+
+    def load(raw_data):
+        global data, store
+        if snapshot.is_snapshot(raw_data):
+            data = snapshot.load_main_data(raw_data, MainData())
+        else:
+            # Data saved before snapshots were introduced.
+            data = jsonpickle.loads(str(raw_data, "utf-8"))
+        store = graphStore.GraphStore(data.externalEdges)
+        return data.dataLock
+
+    with dataMutex:
+        last_lock = data.dataLock
+        lock = dataLog.refresh(last_lock, load, apply_changes)
+        if lock == last_lock:
+            return
+        data.dataLock = lock
+    logger.info("refreshData(): refreshed to {}".format(lock))
+
+
+async def refresh_periodically():
+    """Keeps data up to date in the background; Does not return."""
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        try:
+            async with mutationLock:
+                await run_in_threadpool(refresh_data)
+        except Exception as e:
+            logger.warning("refreshData() failed: {}".format(e))
+
+
+def reload_data():
+    """Loads data from the storage again, dropping changes which were not saved."""
+    global dataLog
+    with dataMutex:
+        dataLog = changeLog.ChangeLog(dataFile, lockFile)
+        # No lock of the new log, so the snapshot is loaded.
+        data.dataLock = ""
+        refresh_data()
+
+
+@asynccontextmanager
+async def writing():
+    """
+    Serializes mutations of main data, from validation to saving. If anything
+    fails after validation, data in memory may no longer match storage, so
+    it is loaded again.
+    """
+    async with mutationLock:
+        try:
+            yield
+        except HTTPException:
+            raise
+        except Exception as error:
+            logger.warning("Changing data failed, reloading: {}".format(error))
+            try:
+                await run_in_threadpool(reload_data)
+            except Exception as e:
+                # refresh_periodically() loads it, as the lock is reset.
+                logger.warning("Reloading data failed: {}".format(e))
+            if isinstance(error, changeLog.ConflictError):
+                raise HTTPException(409, "Data was changed by another writer")
+            raise
+
+
+def save_data(new_changes: list[dict]):
+    """Save changes of main data into the storage."""
+
+    def dump(lock):
+        data.dataLock = lock
+        return snapshot.dump_main_data(data)
+
+    with dataMutex:
+        data.dataLock = dataLog.save(data.dataLock, new_changes, dump)
+
+
+def apply_changes(recorded: list[dict]):
+    """
+    Applies changes of main data, which are also stored in the change log:
+    * addEdge - new external edge
+    * mapEdge - new edge inside datacenter dc
+    * deleteEdge - removal of an edge of either kind
+    """
+    for change in recorded:
+        edge_id = change["id"]
+        if change["op"] == "addEdge":
+            store.add_edge(change["v1"], change["v2"], edge_id, change["distance"])
+            for key in store.endpoints(edge_id):
+                data.noExternalConnections[key] += 1
+            data.edgesToDC[edge_id] = -1
+        elif change["op"] == "mapEdge":
+            data.edgesToDC[edge_id] = change["dc"]
+        elif data.edgesToDC.pop(edge_id, None) == -1:
+            for key in store.endpoints(edge_id):
+                data.noExternalConnections[key] -= 1
+            store.remove_edge(edge_id)
+
+
+async def pass_to_workers(dc_id, endpoint, json=None, read=False, raw=False):
+    """
+    Call given worker with given endpoint, POSTing json if given.
+    Reads may be answered by any replica, other requests go to the writer.
+    Returns bytes of the response instead of its JSON if raw.
+    """
+    try:
+        received_data = await workers.request(dc_id, endpoint, json, read, raw)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 503:
+            # The worker is still loading its datacenter after a lease change.
+            raise HTTPException(503, "Datacenter {} is not ready".format(dc_id))
+        raise
+    if raw:
+        return received_data
     if received_data["status"] != "Ok":
         raise HTTPException(500, "Internal communication error")
     return received_data
@@ -71,23 +199,39 @@ def ensure_existing_node(node):
         raise HTTPException(400, "Invalid node ID")
 
 
-def ensure_fresh_worker_data():
-    """Ensure main has fresh passthrough data from each worker."""
-    global data
-    for dc in data.dataCenters:
-        # gets current data from worker (datacenter)
-        data2 = pass_to_workers(dc, "getPassthroughData/XD/")["data"]
-        logger.info(data2)
-        # updates the global data structure
-        for i in range(len(data2["nodes"])):
-            a = data2["nodes"][i]
-            data.internalPassthrough[dc][a] = []
-            for j in range(len(data2["nodes"])):
-                b = data2["nodes"][j]
-                lent = data2["matrix"][a][j]
-                data.internalPassthrough[dc][a].append(
-                    graph.Edge(a, b, uuid.uuid4(), lent)
-                )
+async def ensure_fresh_worker_data():
+    """
+    Ensure main has fresh passthrough data from each worker. Workers are asked
+    concurrently and only send what changed in their passthrough matrix since
+    the lock main already has, in binary form.
+    """
+    dcs = list(data.dataCenters)
+    responses = await asyncio.gather(
+        *(
+            pass_to_workers(
+                dc,
+                f"getPassthroughData/{overlay.lock(dc) or '-'}",
+                read=True,
+                raw=True,
+            )
+            for dc in dcs
+        )
+    )
+    for dc, received in zip(dcs, responses):
+        delta = snapshot.load_passthrough(received)
+        if delta.lock != overlay.lock(dc):
+            overlay.apply(dc, delta)
+    overlay.update_external(data.dataLock, data.externalEdges)
+
+
+async def refresh_workers_periodically():
+    """Keeps passthrough data of workers up to date; Does not return."""
+    while True:
+        await asyncio.sleep(WORKER_REFRESH_INTERVAL)
+        try:
+            await ensure_fresh_worker_data()
+        except Exception as e:
+            logger.warning("Refreshing worker data failed: {}".format(e))
 
 
 @app.on_event("startup")
@@ -96,52 +240,135 @@ async def startup():
     workers.connect(os.environ["REDIS_SERVICE_HOST"], os.environ["REDIS_SERVICE_PORT"])
     logger.info("main connected")
     refresh_data()
+    asyncio.create_task(refresh_periodically())
+    asyncio.create_task(refresh_workers_periodically())
     logger.info("main startup finished")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    await workers.close()
+    pool.close()
+
+
 @app.get("/logs")
 def get_logs():
     """Debugging endpoint - returns dump of current data."""
     return jsonpickle.dumps(data, include_properties=True)
 
 
+async def get_endpoint_data(start, end):
+    """
+    Asks concurrently for distances from start and end to the gateways
+    of their datacenters, and for the internal connection if they share one.
+    Returns (starting points, ending points, internal connection or None).
+    """
+    requests = [
+        pass_to_workers(
+            data.serverToDcMapping[start], f"/getDistancesMatrix/{start}", read=True
+        ),
+        pass_to_workers(
+            data.serverToDcMapping[end], f"/getDistancesMatrix/{end}", read=True
+        ),
+    ]
+    if data.serverToDcMapping[start] == data.serverToDcMapping[end]:
+        requests.append(
+            pass_to_workers(
+                data.serverToDcMapping[start],
+                f"/getInternalConnection/{start}/{end}",
+                read=True,
+            )
+        )
+    responses = await asyncio.gather(*requests)
+    internal = responses[2] if len(responses) > 2 else None
+    return responses[0]["data"], responses[1]["data"], internal
+
+
+def result_key(kind, start, end):
+    """
+    Returns the result cache key of a query. It contains versions of main's
+    data and of the overlay, which changes with the lock of any worker.
+    Workers' locks are those last fetched, so looking up a result needs no
+    requests; a miss fetches them again, see cached_result.
+    """
+    return kind, start, end, data.dataLock, overlay.version
+
+
+async def route(start, end, starting_points, ending_points):
+    """Runs Overlay.route in the compute pool."""
+    return await pool.run(
+        "overlay",
+        overlay.version,
+        overlay.prepared,
+        compute.route,
+        start,
+        end,
+        starting_points,
+        ending_points,
+    )
+
+
+async def cached_result(kind, start, end):
+    """
+    Returns the result cache key of the query and its cached result, or None.
+    On a miss, passthrough data of workers is brought up to date first, so
+    results are computed from fresh data and stored under its key.
+    """
+    key = result_key(kind, start, end)
+    cached = results.get(key)
+    if cached is None:
+        await ensure_fresh_worker_data()
+        key = result_key(kind, start, end)
+    return key, cached
+
+
 @app.get("/getRoute/{start}/{end}")
-def get_route(start: str, end: str):
+async def get_route(start: str, end: str):
     """Get the shortest path between two nodes."""
     # 1. Check correctness of the input.
     for i in [start, end]:
         ensure_existing_node(i)
+    key, cached = await cached_result("route", start, end)
+    if cached is not None:
+        return cached
+    res = await compute_route(start, end)
+    results.put(key, res)
+    return res
+
+
+async def compute_route(start, end):
+    """Computes the shortest path between two existing nodes."""
     # 2. Ask getDistancesMatrix for start and end nodes.
-    starting_points = pass_to_workers(
-        data.serverToDcMapping[start], f"/getDistancesMatrix/{start}"
-    )["data"]
-    ending_points = pass_to_workers(
-        data.serverToDcMapping[end], f"/getDistancesMatrix/{end}"
-    )["data"]
+    starting_points, ending_points, internal = await get_endpoint_data(start, end)
     # 3. Find the data centers through the fastest path goes through.
-    ensure_fresh_worker_data()
-    edges = prepare_all_edges(starting_points, ending_points, start, end)
-    res = graph.PathResult(start, end)
-    graph.dijkstra(start, edges, res.callback)
-    distance = res.dist
-    path = res.compute()
-    # 4. If it's internal connection, ask also for getInternalConnection between start and end.
-    if data.serverToDcMapping[start] == data.serverToDcMapping[end]:
-        internal = pass_to_workers(
-            data.serverToDcMapping[start], f"/getInternalConnection/{start}/{end}/"
-        )
-        if internal["distance"] < distance:
+    distance, path = await route(start, end, starting_points, ending_points)
+    # 4. If it's internal connection, compare with getInternalConnection between start and end.
+    if internal is not None and internal["distance"] is not None:
+        if distance is None or internal["distance"] < distance:
             return internal
-    # 5. Ask getInternalConnection for each segment.
+    if path is None:
+        return {"status": "Ok", "distance": None, "path": "No path was found"}
+    # 5. Ask each datacenter to expand its segments, all at once.
+    segments: dict[str, list[tuple[str, str]]] = {}
+    for a, b in zip(path, path[1:]):
+        if data.serverToDcMapping[a] == data.serverToDcMapping[b]:
+            segments.setdefault(data.serverToDcMapping[a], []).append((a, b))
+    responses = await asyncio.gather(
+        *(
+            pass_to_workers(
+                dc, "/expandSegments", json={"segments": dc_segments}, read=True
+            )
+            for dc, dc_segments in segments.items()
+        )
+    )
+    expanded = {}
+    for dc_segments, received in zip(segments.values(), responses):
+        expanded.update(zip(dc_segments, received["paths"]))
     full_path = []
     for i in range(1, len(path)):
-        if data.serverToDcMapping[path[i - 1]] == data.serverToDcMapping[path[i]]:
-            part: list = pass_to_workers(
-                data.serverToDcMapping[path[i]],
-                f"/getInternalConnection/{path[i - 1]}/{path[i]}/",
-            )["path"]
-            for element in part:
-                full_path.append(element)
+        part = expanded.get((path[i - 1], path[i]))
+        if part is not None:
+            full_path.extend(part)
             full_path.pop()
         else:
             full_path.append(path[i - 1])
@@ -151,147 +378,312 @@ def get_route(start: str, end: str):
     return {"status": "Ok", "distance": distance, "path": full_path}
 
 
-def prepare_all_edges(
-    edge_connection1: dict[str, int], edge_connection2: dict[str, int], point1, point2
-):
-    """Prepares a dictionary of edges in a form required by our Dijkstra implementation."""
-    logger.info("prepareAllEdges()")
-    all_edges: dict[str, list[graph.Edge]] = {}
-    for dc in data.internalPassthrough:
-        for server in data.internalPassthrough[dc]:
-            if server not in all_edges:
-                all_edges[server] = []
-            all_edges[server].extend(data.internalPassthrough[dc][server])
-    for key in data.externalEdges:
-        if key not in all_edges:
-            all_edges[key] = []
-        logger.warning(f"Extending by: {data.externalEdges[key]}")
-        all_edges[key].extend(data.externalEdges[key])
-    if point1 not in all_edges:
-        all_edges[point1] = []
-    for edge in edge_connection1:
-        all_edges[point1].append(
-            graph.Edge(point1, edge, uuid.uuid4(), edge_connection1[edge])
-        )
-    for edge in edge_connection2:
-        all_edges[edge].append(
-            graph.Edge(edge, point2, uuid.uuid4(), edge_connection2[edge])
-        )
-
-    return all_edges
-
-
 @app.get("/getDistance/{start}/{end}")
-def get_distance(start: str, end: str):
+async def get_distance(start: str, end: str):
     """Get the shortest distance between two nodes."""
     logger.info("getDistance from {} to {}".format(start, end))
-    refresh_data()
     # 1. Check correctness of the input.
     for i in [start, end]:
         ensure_existing_node(i)
+    # The graph is undirected, so (end, start) shares the entry.
+    key, cached = await cached_result("distance", *sorted([start, end]))
+    if cached is not None:
+        logger.info(
+            "getDistance from {} to {} -> {} (cached)".format(start, end, *cached)
+        )
+        return {"status": "Ok", "distance": cached[0]}
     # 2. Ask getDistancesMatrix for start and end nodes.
-    starting_points = pass_to_workers(
-        data.serverToDcMapping[start], f"/getDistancesMatrix/{start}/"
-    )["data"]
-    ending_points = pass_to_workers(
-        data.serverToDcMapping[end], f"/getDistancesMatrix/{end}/"
-    )["data"]
+    starting_points, ending_points, internal = await get_endpoint_data(start, end)
     # 3. Find the data centers through the fastest path goes through.
-    ensure_fresh_worker_data()
-    edges = prepare_all_edges(starting_points, ending_points, start, end)
-    res = graph.ResultSet1()
-    graph.dijkstra(start, edges, res.callback)
-    distance = res.res[end]
-    # 4. If it's internal connection, ask also for getInternalConnection between start and end.
-    if data.serverToDcMapping[start] == data.serverToDcMapping[end]:
-        internal = pass_to_workers(
-            data.serverToDcMapping[start], f"/getInternalConnection/{start}/{end}/"
-        )
-        distance = min(distance, internal["distance"])
+    distance, _ = await route(start, end, starting_points, ending_points)
+    # 4. If it's internal connection, compare with getInternalConnection between start and end.
+    if internal is not None and internal["distance"] is not None:
+        if distance is None or internal["distance"] < distance:
+            distance = internal["distance"]
+    results.put(key, (distance,))  # Wrapped, as None means no path.
     logger.info("getDistance from {} to {} -> {}".format(start, end, distance))
     return {"status": "Ok", "distance": distance}
 
 
-@app.get("/addEdge/{v1}/{v2}/{distance}")
-def add_edge(v1: str, v2: str, distance: int):
+@app.post("/getDistances")
+async def get_distances(query: DistanceQuery):
     """
-    Adds an edge between v1 and v2 internal nodes with the given distance.
-    Returns the internal id of the created path.
+    Get the shortest distances from every source to every target, streamed
+    as rows of newline-delimited JSON {"source": ..., "distances": [...]},
+    with distances in the order of targets, as soon as each row is computed.
+    Each datacenter is asked once for all its nodes' distances to gateways
+    and between them, then one overlay search runs per source.
     """
-    refresh_data()
-    logger.info("addEdge/{}/{}/{}".format(v1, v2, distance))
-    res = {"status": "Ok"}
-    for i in [v1, v2]:
+    for i in query.sources + query.targets:
         ensure_existing_node(i)
+    await ensure_fresh_worker_data()
+
+    queries: dict[str, DistanceQuery] = {}
+    for nodes, field in [(query.sources, "sources"), (query.targets, "targets")]:
+        for node in dict.fromkeys(nodes):
+            dc = data.serverToDcMapping[node]
+            dc_query = queries.setdefault(dc, DistanceQuery(sources=[], targets=[]))
+            getattr(dc_query, field).append(node)
+    responses = await asyncio.gather(
+        *(
+            pass_to_workers(dc, "/getDistances", json=q.model_dump(), read=True)
+            for dc, q in queries.items()
+        )
+    )
+    gateways: dict[str, dict[str, int]] = {}
+    internal: dict[tuple[str, str], int | None] = {}
+    for q, received in zip(queries.values(), responses):
+        gateways.update(received["gateways"])
+        for source, row in zip(q.sources, received["distances"]):
+            internal.update(((source, target), d) for target, d in zip(q.targets, row))
+    ending_points = [gateways[target] for target in query.targets]
+
+    async def row(source):
+        distances = await pool.run(
+            "overlay",
+            overlay.version,
+            overlay.prepared,
+            compute.distances,
+            gateways[source],
+            ending_points,
+        )
+        for k, target in enumerate(query.targets):
+            d = internal.get((source, target))
+            if d is not None and (distances[k] is None or d < distances[k]):
+                distances[k] = d
+        return {"source": source, "distances": distances}
 
-    if data.serverToDcMapping[v1] != data.serverToDcMapping[v2]:
-        # Adding edge between two different datacenters.
-        if isAuthoritative is False:
-            # If it's not authorised to modify data, returns error.
-            # Potential alternative: call authoritative worker.
-            logger.error("addEdge: this node cannot edit data")
-            raise HTTPException(403, "This node cannot edit data")
+    async def rows():
+        tasks = [asyncio.ensure_future(row(source)) for source in query.sources]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
 
-        edge_uuid = uuid.uuid4()  # Creates id for new edge.
-        for i in [v1, v2]:
-            if i not in data.externalEdges:
-                data.externalEdges[i] = []
-            if data.noExternalConnections[i] == 0:
-                pass_to_workers(
-                    data.serverToDcMapping[i], f"/setNodeStatus/{i}/external/"
-                )
-            data.noExternalConnections[i] += 1
-
-        data.externalEdges[v1].append(graph.Edge(v1, v2, edge_uuid, distance))
-        data.externalEdges[v2].append(graph.Edge(v2, v1, edge_uuid, distance))
-        data.edgesToDC[edge_uuid] = -1
-        res["id"] = edge_uuid
-    else:
-        # Adding edge inside one datacenter is done by the worker responsible for it.
-        worker_res = pass_to_workers(
-            data.serverToDcMapping[v1], f"addEdge/{v1}/{v2}/{distance}/"
-        )
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+@app.get("/cacheStats")
+def get_cache_stats():
+    """Returns hit and miss counters of the route and distance result cache."""
+    return {"status": "Ok", **results.stats()}
 
-        if "id" not in worker_res:
-            raise HTTPException(500, "Internal processing error: lacking id")
 
-        res["id"] = worker_res[
-            "id"
-        ]  # id of new edge is created by worker in its processing.
-        data.edgesToDC[worker_res["id"]] = data.serverToDcMapping[v1]
-    save_data()
+@app.get("/addEdge/{v1}/{v2}/{distance}")
+async def add_edge(v1: str, v2: str, distance: int):
+    """
+    Adds an edge between v1 and v2 internal nodes with the given distance.
+    Returns the internal id of the created path.
+    """
+    async with writing():
+        await run_in_threadpool(refresh_data)
+        logger.info("addEdge/{}/{}/{}".format(v1, v2, distance))
+        res = {"status": "Ok"}
+        for i in [v1, v2]:
+            ensure_existing_node(i)
+
+        if data.serverToDcMapping[v1] != data.serverToDcMapping[v2]:
+            # Adding edge between two different datacenters.
+            if isAuthoritative is False:
+                # If it's not authorised to modify data, returns error.
+                # Potential alternative: call authoritative worker.
+                logger.error("addEdge: this node cannot edit data")
+                raise HTTPException(403, "This node cannot edit data")
+
+            edge_uuid = str(uuid.uuid4())  # Creates id for new edge.
+            for i in [v1, v2]:
+                if data.noExternalConnections[i] == 0:
+                    await pass_to_workers(
+                        data.serverToDcMapping[i], f"/setNodeStatus/{i}/external/"
+                    )
+
+            change = {"op": "addEdge", "v1": v1, "v2": v2, "distance": distance}
+            change["id"] = edge_uuid
+            res["id"] = edge_uuid
+        else:
+            # Adding edge inside one datacenter is done by the worker responsible
+            # for it.
+            worker_res = await pass_to_workers(
+                data.serverToDcMapping[v1], f"addEdge/{v1}/{v2}/{distance}"
+            )
+
+            if "id" not in worker_res:
+                raise HTTPException(500, "Internal processing error: lacking id")
+
+            res["id"] = worker_res[
+                "id"
+            ]  # id of new edge is created by worker in its processing.
+            dc = data.serverToDcMapping[v1]
+            change = {"op": "mapEdge", "id": res["id"], "dc": dc}
+        apply_changes([change])
+        await run_in_threadpool(save_data, [change])
     logger.info("addEdge/{}/{}/{} -> {}".format(v1, v2, distance, res))
     return res
 
 
-@app.get("/deleteEdge/{id}/")
-def delete_edge(edge_id: str):
+@app.get("/deleteEdge/{edge_id}/")
+async def delete_edge(edge_id: str):
     """Deletes edge with the given id."""
     logger.info("deleteEdge/{}".format(edge_id))
-    refresh_data()
-    if edge_id not in data.edgesToDC:
-        raise HTTPException(400, "Invalid edge ID")
-
-    if data.edgesToDC[edge_id] == -1:
-        # It's an external edge - needs to process in both datacenters and in main.
-        if isAuthoritative is False:
-            # If it's not authorised to modify data, returns error.
-            # Potential alternative: call authoritative worker.
-            logger.error("deleteEdge: this node cannot edit data")
-            raise HTTPException(403, "This node cannot edit data")
-
-        for key in data.externalEdges:
-            for element in data.externalEdges[key]:
-                if element.id == edge_id:
-                    data.noExternalConnections[key] -= 1
-                    if data.noExternalConnections[key] == 0:
-                        pass_to_workers(
-                            data.edgesToDC[key], f"/setNodeStatus/{key}/internal/"
-                        )
-                    data.externalEdges[key].remove(element)
-        save_data()
-        logger.info("deleteEdge: deleted")
-    else:
-        # It's an internal edge - should be processed only by worker.
-        logger.info("deleteEdge: pass to workers")
-        pass_to_workers(data.edgesToDC[edge_id], f"deleteEdge/{edge_id}/")
+    async with writing():
+        await run_in_threadpool(refresh_data)
+        if edge_id not in data.edgesToDC:
+            raise HTTPException(400, "Invalid edge ID")
+
+        if data.edgesToDC[edge_id] == -1:
+            # It's an external edge - needs to process in both datacenters and in main.
+            if isAuthoritative is False:
+                # If it's not authorised to modify data, returns error.
+                # Potential alternative: call authoritative worker.
+                logger.error("deleteEdge: this node cannot edit data")
+                raise HTTPException(403, "This node cannot edit data")
+
+            for key in store.endpoints(edge_id):
+                if data.noExternalConnections[key] == 1:
+                    await pass_to_workers(
+                        data.serverToDcMapping[key],
+                        f"/setNodeStatus/{key}/internal/",
+                    )
+            logger.info("deleteEdge: deleted")
+        else:
+            # It's an internal edge - should be processed only by worker.
+            logger.info("deleteEdge: pass to workers")
+            await pass_to_workers(data.edgesToDC[edge_id], f"deleteEdge/{edge_id}/")
+        change = {"op": "deleteEdge", "id": edge_id}
+        apply_changes([change])
+        await run_in_threadpool(save_data, [change])
+    return {"status": "Ok"}
+
+
+@app.post("/batch")
+async def batch(changes: Batch):
+    """
+    Applies a list of edge additions and deletions with a single save.
+    Changes inside datacenters, together with the node status changes caused
+    by external edges, are sent to each worker as one batch. Main's own data
+    is modified only after all workers accepted their parts.
+    If any worker fails, parts accepted by the others are undone, see
+    undo_batches, so changes are atomic except for internal edge deletions.
+    Returns ids of the created edges, in order of the changes.
+    """
+    async with writing():
+        await run_in_threadpool(refresh_data)
+        connections = dict(data.noExternalConnections)
+        sub_batches: dict[str, list] = {}
+        # (datacenter, position in its batch, position in changes) of internal edges.
+        internal_added = []
+        recorded = []
+        deleted = set()
+        ids = [None] * len(changes.changes)
+
+        def update_connections(node, delta):
+            connections[node] += delta
+            if connections[node] == (1 if delta > 0 else 0):
+                status = "external" if delta > 0 else "internal"
+                sub_batches.setdefault(data.serverToDcMapping[node], []).append(
+                    SetNodeStatus(node=node, status=status)
+                )
+
+        for i, change in enumerate(changes.changes):
+            if isinstance(change, SetNodeStatus):
+                raise HTTPException(400, "Node status is managed by main")
+
+            if isinstance(change, AddEdge):
+                ensure_existing_node(change.v1)
+                ensure_existing_node(change.v2)
+                dc = data.serverToDcMapping[change.v1]
+                if dc == data.serverToDcMapping[change.v2]:
+                    sub_batches.setdefault(dc, []).append(change)
+                    internal_added.append((dc, len(sub_batches[dc]) - 1, i))
+                    continue
+                if isAuthoritative is False:
+                    logger.error("batch: this node cannot edit data")
+                    raise HTTPException(403, "This node cannot edit data")
+                ids[i] = str(uuid.uuid4())
+                recorded.append({"op": "addEdge", "id": ids[i], **change.model_dump()})
+                update_connections(change.v1, 1)
+                update_connections(change.v2, 1)
+                continue
+
+            dc = data.edgesToDC.get(change.id)
+            if dc is None or change.id in deleted:
+                raise HTTPException(400, "Invalid edge ID")
+            deleted.add(change.id)
+            recorded.append({"op": "deleteEdge", "id": change.id})
+            if dc != -1:
+                sub_batches.setdefault(dc, []).append(change)
+                continue
+            if isAuthoritative is False:
+                logger.error("batch: this node cannot edit data")
+                raise HTTPException(403, "This node cannot edit data")
+            for key in store.endpoints(change.id):
+                update_connections(key, -1)
+
+        dcs = list(sub_batches)
+        responses = await asyncio.gather(
+            *(
+                pass_to_workers(
+                    dc, "batch", Batch(changes=sub_batches[dc]).model_dump()
+                )
+                for dc in dcs
+            ),
+            return_exceptions=True,
+        )
+        worker_ids = {
+            dc: response["ids"]
+            for dc, response in zip(dcs, responses)
+            if not isinstance(response, BaseException)
+        }
+        if len(worker_ids) < len(dcs):
+            accepted = {dc: (sub_batches[dc], worker_ids[dc]) for dc in worker_ids}
+            committed = await undo_batches(accepted)
+            if committed:
+                apply_changes(committed)
+                await run_in_threadpool(save_data, committed)
+            raise next(r for r in responses if isinstance(r, BaseException))
+
+        for dc, position, i in internal_added:
+            ids[i] = worker_ids[dc][position]
+            recorded.append({"op": "mapEdge", "id": ids[i], "dc": dc})
+
+        apply_changes(recorded)
+        await run_in_threadpool(save_data, recorded)
+    return {"status": "Ok", "ids": ids}
+
+
+async def undo_batches(accepted: dict[str, tuple[list, list]]) -> list[dict]:
+    """
+    Undoes sub-batches which workers accepted, given with the ids they
+    returned, after another worker failed: added edges are deleted and node
+    statuses set back. Deleted edges cannot be added back with their ids, so
+    their deletions stay. Returns main's changes recording what stays.
+    """
+    committed = []
+
+    async def undo(dc, changes, worker_ids):
+        undone = []
+        for change, edge_id in zip(changes, worker_ids):
+            if isinstance(change, AddEdge):
+                undone.append(DeleteEdge(id=edge_id))
+            elif isinstance(change, SetNodeStatus):
+                status = "internal" if change.status == "external" else "external"
+                undone.append(SetNodeStatus(node=change.node, status=status))
+            else:
+                committed.append({"op": "deleteEdge", "id": change.id})
+        if not undone:
+            return
+        try:
+            await pass_to_workers(dc, "batch", Batch(changes=undone).model_dump())
+        except Exception as e:
+            logger.error("batch: undoing changes in {} failed: {}".format(dc, e))
+            # The edges stay, so main must know them to be able to delete them.
+            committed.extend(
+                {"op": "mapEdge", "id": edge_id, "dc": dc}
+                for change, edge_id in zip(changes, worker_ids)
+                if isinstance(change, AddEdge)
+            )
+
+    await asyncio.gather(*(undo(dc, *parts) for dc, parts in accepted.items()))
+    return committed
@@ -0,0 +1,123 @@
+from threading import Lock
+from common import compute, contraction, graph, passthrough
+import logging
+
+log = logging.getLogger("uvicorn")
+
+
+class Overlay:
+    """Graph of gateway nodes kept between queries
+
+    The graph consists of:
+    * one slice per datacenter with passthrough edges between its gateways,
+      kept as lengths by both gateways and keyed by the lock of the worker
+      data it was built from, so changes of the matrix apply in place
+    * external edges between datacenters, keyed by the lock of main's data
+
+    Only slices whose lock changed are rebuilt; the compact graph used by
+    searches is assembled again only after any of them changed.
+
+    With the "ch" engine, searches use a customizable contraction hierarchy
+    of the graph instead. It is only customized with the new lengths when
+    the graph changes, unless edges appear between nodes it doesn't cover.
+    """
+
+    ENGINES = ["dijkstra", "ch"]
+
+    def __init__(self, engine="dijkstra"):
+        if engine not in self.ENGINES:
+            raise ValueError("Unknown overlay engine: {}".format(engine))
+        self.engine = engine
+        self.__hierarchy = None
+        self.__mutex = Lock()
+        self.__slices: dict[str, dict[str, dict[str, int]]] = {}
+        self.__locks: dict[str, str] = {}
+        self.__external: dict[str, list[graph.Edge]] = {}
+        self.__external_lock = None
+        self.__network = None
+        # Incremented on every change, so results can be cached by it.
+        self.version = 0
+
+    def lock(self, dc):
+        """Returns lock of the worker data the datacenter's slice was built from."""
+        return self.__locks.get(dc)
+
+    def update_slice(self, dc, lock, nodes: list[str], matrix: dict[str, list]):
+        """Replaces the datacenter's slice with the given passthrough matrix."""
+        self.apply(dc, passthrough.full(lock, {a: matrix[a] for a in nodes}))
+
+    def apply(self, dc, delta: passthrough.Delta) -> bool:
+        """
+        Applies changes of the datacenter's passthrough matrix. Returns False
+        if they are not based on the slice's lock, which may happen when
+        another sync got ahead, and are ignored.
+        """
+        with self.__mutex:
+            if delta.base is not None and delta.base != self.__locks.get(dc):
+                return False
+            passthrough.apply(self.__slices.setdefault(dc, {}), delta)
+            self.__locks[dc] = delta.lock
+            self.__network = None
+            self.version += 1
+        return True
+
+    def update_external(self, lock, external_edges: dict[str, list[graph.Edge]]):
+        """Replaces external edges if main's data lock changed."""
+        if lock == self.__external_lock:
+            return
+
+        with self.__mutex:
+            self.__external = {key: list(edges) for key, edges in external_edges.items()}
+            self.__external_lock = lock
+            self.__network = None
+            self.version += 1
+
+    def network(self) -> graph.Graph:
+        """Returns the compact overlay graph, assembling it if needed."""
+        return self.__prepare()[0]
+
+    def __prepare(
+        self,
+    ) -> tuple[graph.Graph, contraction.ContractionHierarchy | None]:
+        """Returns the overlay graph and its hierarchy if the engine uses one."""
+        with self.__mutex:
+            if self.__network is None:
+                log.info("Rebuilding overlay graph")
+                edges: dict[str, list[graph.Edge]] = {}
+                for dc_slice in self.__slices.values():
+                    for a, lengths in dc_slice.items():
+                        edges.setdefault(a, []).extend(
+                            graph.Edge(a, b, None, length)
+                            for b, length in lengths.items()
+                        )
+                for node, node_edges in self.__external.items():
+                    edges.setdefault(node, []).extend(node_edges)
+                self.__network = graph.Graph.from_edges(edges)
+                if self.engine == "ch":
+                    self.__update_hierarchy()
+            return self.__network, self.__hierarchy
+
+    def __update_hierarchy(self):
+        if self.__hierarchy is not None and self.__hierarchy.customize(self.__network):
+            log.info("Customized overlay hierarchy")
+            return
+        log.info("Rebuilding overlay hierarchy")
+        self.__hierarchy = contraction.ContractionHierarchy(self.__network)
+
+    def prepared(self) -> tuple[graph.Graph, contraction.ContractionHierarchy | None]:
+        """Returns the overlay graph and its hierarchy if the engine uses one."""
+        return self.__prepare()
+
+    def route(
+        self, start, end, starting_points: dict[str, int], ending_points: dict[str, int]
+    ):
+        """
+        Finds the shortest path from start to end leaving start's datacenter
+        through starting_points and entering end's through ending_points,
+        both mapping gateways to their distance from start (end).
+        Returns the distance and the path as [start, gateways..., end],
+        or (None, None) if there is no such path.
+        """
+        return compute.route(
+            self.__prepare(), start, end, starting_points, ending_points
+        )
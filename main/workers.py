@@ -1,35 +1,158 @@
-from redis import Redis
-from urllib.parse import urljoin
+from redis.asyncio import Redis
+from itertools import count
+from time import monotonic, perf_counter, time
+import asyncio
 import logging
 import httpx
+from common import metrics
+
+# How long the shard -> worker URL mapping read from Redis is trusted.
+URL_TTL = 5
+TIMEOUT = 10
+# Sorted set of the shard's reader URLs scored by expiry, see manager.service.
+READERS_KEY = "readers:{}"
 
 log = logging.getLogger("uvicorn")
 
+WORKER_SECONDS = metrics.Histogram(
+    "routing_worker_request_seconds",
+    "Latency of requests from main to workers, per shard.",
+    ("shard",),
+)
+
 
 class Workers:
+    """Sends requests to workers, looked up by the shard they hold a lease for
+
+    Worker URLs are cached for URL_TTL seconds and each worker gets its own
+    pooled HTTP client, so requests reuse connections. Clients of workers
+    which no longer hold any lease are closed once URLs are looked up again.
+
+    Reads may go to any worker holding a lease for the shard, the writer or
+    a reader, in turns. Mutations go to the writer only. A worker may serve
+    several shards, so paths are prefixed with the shard's name.
+    """
+
     def __init__(self):
         self.__redis = None
+        self.__urls: dict[str, tuple[str, float]] = {}
+        self.__replicas: dict[str, tuple[list[str], float]] = {}
+        self.__turns: dict[str, count] = {}
+        self.__clients: dict[str, httpx.AsyncClient] = {}
 
     def connect(self, host, port):
         self.__redis = Redis(host=host, port=port, decode_responses=True)
 
-    def get(self, w_id):
+    async def close(self):
+        """Closes all pooled clients."""
+        clients, self.__clients = self.__clients, {}
+        await asyncio.gather(*(client.aclose() for client in clients.values()))
+
+    async def get(self, w_id):
+        cached = self.__urls.get(w_id)
+        if cached is not None and cached[1] > monotonic():
+            return cached[0]
+
         if self.__redis is None:
             log.warning("Redis not ready")
             return None
 
-        return self.__redis.get(w_id)
+        url = await self.__redis.get(w_id)
+        if url is not None:
+            self.__urls[w_id] = (url, monotonic() + URL_TTL)
+        else:
+            self.__urls.pop(w_id, None)
+        self.__prune()
+        return url
+
+    async def replicas(self, w_id) -> list[str]:
+        """Returns URLs of the shard's writer and readers."""
+        cached = self.__replicas.get(w_id)
+        if cached is not None and cached[1] > monotonic():
+            return cached[0]
+
+        writer = await self.get(w_id)
+        if self.__redis is None:
+            return []
+        readers = await self.__redis.zrangebyscore(
+            READERS_KEY.format(w_id), time(), "+inf"
+        )
+        urls = ([writer] if writer is not None else []) + readers
+        self.__replicas[w_id] = (urls, monotonic() + URL_TTL)
+        self.__prune()
+        return urls
+
+    def __prune(self):
+        """Closes clients of workers which no shard maps to anymore."""
+        live = {url for url, _ in self.__urls.values()}
+        for urls, _ in self.__replicas.values():
+            live.update(urls)
+        for url in [url for url in self.__clients if url not in live]:
+            log.info("Closing client of {}".format(url))
+            asyncio.create_task(self.__close_later(self.__clients.pop(url)))
+
+    async def __close_later(self, client: httpx.AsyncClient):
+        # Requests already sent through the client end within TIMEOUT.
+        await asyncio.sleep(TIMEOUT)
+        await client.aclose()
+
+    def __client(self, url) -> httpx.AsyncClient:
+        """Returns the pooled client for the worker at url."""
+        client = self.__clients.get(url)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=url, follow_redirects=True, timeout=TIMEOUT
+            )
+            self.__clients[url] = client
+        return client
 
-    def request(self, w_id, path):
-        """Sends request to worker of a given id on a given endpoint (path)."""
-        worker = self.get(w_id)
+    async def request(self, w_id, path, json=None, read=False, raw=False):
+        """
+        Sends request to worker of a given id on a given endpoint (path).
+        If json is given, it is POSTed as the request body.
+        Read requests are spread over all replicas of the shard, and go to
+        the next replica if one is unreachable or not ready (503), e.g. a
+        reader which is still loading the shard after leasing it.
+        Returns the parsed JSON response, or its bytes if raw.
+        """
+        if read:
+            urls = await self.replicas(w_id)
+            turn = next(self.__turns.setdefault(w_id, count()))
+            candidates = [urls[(turn + i) % len(urls)] for i in range(len(urls))]
+        else:
+            worker = await self.get(w_id)
+            candidates = [] if worker is None else [worker]
 
-        if worker is None:
+        if not candidates:
             log.warning("Redis not ready")
             raise LookupError()
 
-        log.info("Request {}".format(urljoin(worker, path)))
-        response = httpx.get(urljoin(worker, path), follow_redirects=True)
-        response.raise_for_status()
+        path = "/{}/{}".format(w_id, path.lstrip("/"))
+        for attempt, worker in enumerate(candidates, 1):
+            last = attempt == len(candidates)
+            log.info("Request {} {}".format(worker, path))
+            client = self.__client(worker)
+            start = perf_counter()
+            try:
+                if json is None:
+                    response = await client.get(path)
+                else:
+                    response = await client.post(path, json=json)
+            except httpx.TransportError:
+                # The lease may have moved to another worker.
+                self.__urls.pop(w_id, None)
+                self.__replicas.pop(w_id, None)
+                if last:
+                    raise
+                continue
+            finally:
+                WORKER_SECONDS.observe(perf_counter() - start, w_id)
+            if response.status_code == 503:
+                # The worker may no longer (or not yet) serve the shard.
+                self.__urls.pop(w_id, None)
+                self.__replicas.pop(w_id, None)
+                if not last:
+                    continue
+            response.raise_for_status()
 
-        return response.json()
+            return response.content if raw else response.json()
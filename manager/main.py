@@ -1,18 +1,35 @@
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import logging
 import os
+from common import metrics
 from manager.service import Service
 from models import Registration
 
 app = FastAPI()
+metrics.instrument(app)
 log = logging.getLogger("uvicorn")
 
 service = Service()
+# Seconds between looking for added or removed shards in the storage.
+DISCOVERY_INTERVAL = float(os.environ.get("DISCOVERY_INTERVAL", "60"))
 
 
 @app.on_event("startup")
 async def startup():
     service.connect(os.environ["REDIS_SERVICE_HOST"], os.environ["REDIS_SERVICE_PORT"])
+    asyncio.create_task(discover_periodically())
+
+
+async def discover_periodically():
+    """Keeps the set of shards up to date; Does not return."""
+    while True:
+        await asyncio.sleep(DISCOVERY_INTERVAL)
+        try:
+            await run_in_threadpool(service.discover)
+        except Exception as e:
+            log.warning("Shard discovery failed: {}".format(e))
 
 
 @app.post("/lease")
@@ -21,5 +38,6 @@ async def lease(registration: Registration):
 
     * **url**: Base URL of the requestee
     * **renew**: If set, name of the shard to renew
+    * **role**: Role of the lease to renew, writer or reader
     """
     return service.lease(registration)
@@ -1,13 +1,149 @@
 from redis import Redis
 import logging
+import os
+from common import fileOperations, metrics
 from models import Lease
-from google.cloud import storage
 
-BUCKET_NAME = "irio-bucket-2025"
 LEASE_DURATION = 60
+# Number of reader leases granted per shard, next to the writer lease.
+READER_LEASES = int(os.environ.get("READER_LEASES", "2"))
+# Sorted set of all known shards, scored by the time their lease expires.
+EXPIRY_KEY = "shards:expiry"
+# Sorted set of all known shards, scored by their number of readers.
+READER_COUNT_KEY = "readers:count"
+# Sorted set of "<shard>\n<url>" of all readers, scored by their lease's expiry.
+READER_EXPIRY_KEY = "readers:expiry"
+# Sorted set of URLs of the shard's readers, scored by their lease's expiry.
+READERS_KEY = "readers:{}"
+# Hash of weights of all known shards, the sizes of their data files in bytes.
+WEIGHT_KEY = "shards:weight"
 
 log = logging.getLogger("uvicorn")
 
+LEASES = metrics.Counter(
+    "routing_manager_leases_total",
+    "Lease requests by their outcome and the role granted.",
+    ("result", "role"),
+)
+
+# Renews the lease of ARGV[2] in role ARGV[3] for ARGV[1] if possible. A reader
+# whose shard has no writer becomes its writer. Otherwise leases the heaviest
+# free shard which weighs at most ARGV[6] (unless it is negative), or reading
+# the shard with the fewest readers, if there are less than ARGV[5], which fits
+# too. Never gives a lessee two leases of one shard.
+# Returns {shard, role, weight} or nil.
+# Besides KEYS, the script accesses the lease key and READERS_KEY of every
+# shard it looks at, which are known only once it runs, so it needs a single
+# Redis node; Redis Cluster would reject keys of other slots.
+LEASE_SCRIPT = """
+local now = tonumber(redis.call("TIME")[1])
+local lessee, renew, role = ARGV[1], ARGV[2], ARGV[3]
+local duration, reader_leases = tonumber(ARGV[4]), tonumber(ARGV[5])
+local budget = tonumber(ARGV[6])
+local expiry, reader_count, reader_expiry = KEYS[1], KEYS[2], KEYS[3]
+local weights = KEYS[4]
+
+local function weight(shard)
+    return tonumber(redis.call("HGET", weights, shard) or "0")
+end
+
+-- Weights of all the shards by name, fetched with one call per 1000 shards
+-- (unpack's limit on the number of arguments).
+local function weights_of(shards)
+    local found = {}
+    for first = 1, #shards, 1000 do
+        local batch = {unpack(shards, first, math.min(first + 999, #shards))}
+        local values = redis.call("HMGET", weights, unpack(batch))
+        for i, shard in ipairs(batch) do
+            found[shard] = tonumber(values[i] or "0")
+        end
+    end
+    return found
+end
+
+local function fits(shard_weight)
+    return budget < 0 or shard_weight <= budget
+end
+
+local function reads(shard)
+    return redis.call("ZSCORE", reader_expiry, shard .. "\\n" .. lessee)
+end
+
+local function drop_reader(shard, url)
+    redis.call("ZREM", reader_expiry, shard .. "\\n" .. url)
+    redis.call("ZREM", "readers:" .. shard, url)
+    if redis.call("ZSCORE", reader_count, shard) then
+        redis.call("ZINCRBY", reader_count, -1, shard)
+    end
+end
+
+local function grant_writer(shard)
+    redis.call("SET", shard, lessee, "EX", duration)
+    redis.call("ZADD", expiry, now + duration, shard)
+    return {shard, "writer", weight(shard)}
+end
+
+local function grant_reader(shard)
+    local member = shard .. "\\n" .. lessee
+    if not redis.call("ZSCORE", reader_expiry, member) then
+        redis.call("ZINCRBY", reader_count, 1, shard)
+    end
+    redis.call("ZADD", reader_expiry, now + duration, member)
+    redis.call("ZADD", "readers:" .. shard, now + duration, lessee)
+    return {shard, "reader", weight(shard)}
+end
+
+-- Forget some of the readers whose lease expired.
+local expired = redis.call("ZRANGEBYSCORE", reader_expiry, "-inf", now, "LIMIT", 0, 16)
+for _, member in ipairs(expired) do
+    local shard, url = string.match(member, "^(.-)\\n(.*)$")
+    drop_reader(shard, url)
+end
+
+if renew ~= "" and redis.call("ZSCORE", expiry, renew) then
+    local holder = redis.call("GET", renew)
+    if role == "writer" and (holder == lessee or not holder) then
+        return grant_writer(renew)
+    end
+    if role == "reader" and reads(renew) then
+        if not holder then
+            drop_reader(renew, lessee)
+            return grant_writer(renew)
+        end
+        return grant_reader(renew)
+    end
+end
+
+local candidates = redis.call("ZRANGEBYSCORE", expiry, "-inf", now)
+local candidate_weights = weights_of(candidates)
+local free = {}
+for _, shard in ipairs(candidates) do
+    if fits(candidate_weights[shard]) then
+        table.insert(free, shard)
+    end
+end
+table.sort(free, function(a, b) return candidate_weights[a] > candidate_weights[b] end)
+for _, shard in ipairs(free) do
+    if redis.call("SET", shard, lessee, "NX", "EX", duration) then
+        if reads(shard) then
+            drop_reader(shard, lessee)
+        end
+        redis.call("ZADD", expiry, now + duration, shard)
+        return {shard, "writer", candidate_weights[shard]}
+    end
+end
+
+local fewest = redis.call("ZRANGEBYSCORE", reader_count, "-inf", "(" .. reader_leases)
+local fewest_weights = weights_of(fewest)
+for _, shard in ipairs(fewest) do
+    if fits(fewest_weights[shard])
+        and redis.call("GET", shard) ~= lessee and not reads(shard) then
+        return grant_reader(shard)
+    end
+end
+return nil
+"""
+
 
 class Service:
     """Manages shard leases using Redis as shared storage between instances
@@ -17,36 +153,68 @@ class Service:
     * value is the base URL of the worker holding the lease
     * entry is set to expire after LEASE_DURATION seconds
 
-    The entry's expiry timeout should be extended to renew an existing lease
+    The entry's expiry timeout should be extended to renew an existing lease.
+
+    All shards are also kept in a sorted set scored by their lease's expiry,
+    so a free shard is found without checking shards one by one. Leasing and
+    renewing is a single script call, one round trip to Redis.
+
+    Workers left without a shard get reader leases, up to READER_LEASES per
+    shard. Readers of a shard are kept in a sorted set scored by expiry,
+    which main reads to spread queries over them.
+
+    A worker may hold several leases. Shards weigh as much as their data
+    files, and a worker asking for another lease gets the heaviest free
+    shard which fits its remaining budget, so small shards fill the space
+    left by large ones.
+
+    Every free shard is considered, so a lease request takes time linear in
+    the number of shards. Shards' keys are not declared to the script, so
+    Redis must be a single node, not a cluster.
     """
 
     def __init__(self):
         self.__redis = None
-        self.__shards = []
+        self.__lease = None
 
     def connect(self, host, port):
-        """Connect to GCS and Redis and initialize."""
-        self.__gcs = storage.Client.from_service_account_json("keys.json")
-        groups = self.__gcs.list_blobs(BUCKET_NAME)
-
-        for group in groups:
-            if group.name.startswith("data_"):
-                self.__shards.append(group.name[5:-5])
-
-        self.__redis = Redis(host=host, port=port, decode_responses=True)
-
-    def __new_lease(self, shard):
+        """Connect to Redis and discover shards."""
+        self.use(Redis(host=host, port=port, decode_responses=True))
+
+    def use(self, redis: Redis):
+        """Use the given Redis client and discover shards."""
+        self.__redis = redis
+        self.__lease = redis.register_script(LEASE_SCRIPT)
+        self.discover()
+
+    def discover(self):
+        """Updates the set of shards and their weights from data files."""
+        weights = {
+            name[5:-5]: size
+            for name, size in fileOperations.file_sizes("data_").items()
+            if name.endswith(".json")
+        }
+        shards = set(weights)
+        known = set(self.__redis.zrange(EXPIRY_KEY, 0, -1))
+        pipeline = self.__redis.pipeline()
+        if weights:
+            pipeline.hset(WEIGHT_KEY, mapping=weights)
+        if shards - known:
+            # Expiry 0 makes new shards free; existing scores are kept.
+            added = {shard: 0 for shard in shards - known}
+            pipeline.zadd(EXPIRY_KEY, added, nx=True)
+            pipeline.zadd(READER_COUNT_KEY, added, nx=True)
+        if known - shards:
+            pipeline.zrem(EXPIRY_KEY, *(known - shards))
+            pipeline.zrem(READER_COUNT_KEY, *(known - shards))
+            pipeline.hdel(WEIGHT_KEY, *(known - shards))
+        pipeline.execute()
+        if shards != known:
+            log.info("Discovered {} shards".format(len(shards)))
+
+    def __new_lease(self, shard, role, weight):
         """Construct and return a new lease object."""
-        return Lease(name=shard, duration=LEASE_DURATION)
-
-    def __try_lease(self, shard, lessee):
-        """Atomically try to acquire a new lease and return if successful."""
-        return self.__redis.set(shard, lessee, nx=True, ex=LEASE_DURATION)
-
-    def __try_renew(self, shard, lessee):
-        """Atomically try to extend the current lease and return if successful."""
-        r = self.__redis.getex(shard, ex=LEASE_DURATION)
-        return r == lessee
+        return Lease(name=shard, role=role, duration=LEASE_DURATION, weight=weight)
 
     def lease(self, registration):
         """Handle a new lease request and return it if acquired."""
@@ -54,16 +222,29 @@ class Service:
             log.warning("Redis not ready")
             return None
 
-        if registration.renew is not None:
-            shard = registration.renew
-            if self.__try_renew(registration.renew, registration.url):
-                log.info("Renewed {} for {}".format(shard, registration.url))
-                return self.__new_lease(shard)
-
-        for shard in self.__shards:
-            if self.__try_lease(shard, registration.url):
-                log.info("Lease {} to {}".format(shard, registration.url))
-                return self.__new_lease(shard)
+        renew = registration.renew or ""
+        budget = -1 if registration.budget is None else registration.budget
+        granted = self.__lease(
+            keys=[EXPIRY_KEY, READER_COUNT_KEY, READER_EXPIRY_KEY, WEIGHT_KEY],
+            args=[
+                registration.url,
+                renew,
+                registration.role,
+                LEASE_DURATION,
+                READER_LEASES,
+                budget,
+            ],
+        )
+        if granted is None:
+            log.warning("No lease to {}".format(registration.url))
+            LEASES.inc("none", "")
+            return None
 
-        log.warning("No lease to {}".format(registration.url))
-        return None
+        shard, role, weight = granted
+        if shard == renew and role == registration.role:
+            log.info("Renewed {} {} for {}".format(role, shard, registration.url))
+            LEASES.inc("renewed", role)
+        else:
+            log.info("Lease {} {} to {}".format(role, shard, registration.url))
+            LEASES.inc("granted", role)
+        return self.__new_lease(shard, role, weight)
@@ -1,11 +1,51 @@
-from pydantic import BaseModel
+from typing import Annotated, Literal
+from pydantic import BaseModel, Field
 
 
 class Registration(BaseModel):
     url: str
     renew: str | None = None
+    role: Literal["writer", "reader"] = "writer"
+    # Total weight of shards the worker can still take, None if unlimited.
+    budget: int | None = None
 
 
 class Lease(BaseModel):
     name: str
+    role: Literal["writer", "reader"] = "writer"
     duration: int
+    # Size of the shard's data file in bytes.
+    weight: int = 0
+
+
+class AddEdge(BaseModel):
+    op: Literal["addEdge"] = "addEdge"
+    v1: str
+    v2: str
+    distance: int
+
+
+class DeleteEdge(BaseModel):
+    op: Literal["deleteEdge"] = "deleteEdge"
+    id: str
+
+
+class SetNodeStatus(BaseModel):
+    op: Literal["setNodeStatus"] = "setNodeStatus"
+    node: str
+    status: Literal["internal", "external"]
+
+
+class DistanceQuery(BaseModel):
+    sources: list[str]
+    targets: list[str]
+
+
+class Segments(BaseModel):
+    segments: list[tuple[str, str]]
+
+
+class Batch(BaseModel):
+    changes: list[
+        Annotated[AddEdge | DeleteEdge | SetNodeStatus, Field(discriminator="op")]
+    ]
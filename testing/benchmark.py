@@ -0,0 +1,243 @@
+"""
+Times the routing engine and worker recompute on networks generated by
+testing/graph.py, over a sweep of network sizes and gateway ratios, and
+prints the results as JSON so runs on different commits can be compared.
+
+    python -m testing.benchmark --sizes 100,400 --ratios 0.05,0.2 > out.json
+
+Files are written to a temporary directory through the local storage
+backend, so neither GCS nor Redis is needed.
+"""
+
+from argparse import ArgumentParser
+from random import Random, randint, seed
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import uuid
+
+# Gives workers and main their configuration, before they are imported.
+from testing import environment
+import jsonpickle
+from common import fileOperations, graph, snapshot
+from main.main import MainData
+from main.overlay import Overlay
+from testing.graph import generate_extra_edges, generate_network
+from worker.main import LocalData, ShardState
+
+
+def node_name(node) -> str:
+    """Node ids of generate_network repeat between groups, names must not."""
+    return node.group.id + node.id
+
+
+def convert(network, gateway_ratio, rng) -> tuple[dict[str, LocalData], MainData]:
+    """
+    Turns generate_network output into the data of every datacenter and of
+    main. Ends of external edges are gateways, and besides them every node
+    is one with probability gateway_ratio.
+    """
+    groups, nodes, edges, external = network
+    main_data = MainData()
+    main_data.dataLock = ""
+    main_data.dataCenters = [group.id for group in groups]
+    main_data.serverToDcMapping = {}
+    main_data.noExternalConnections = {}
+    main_data.edgesToDC = {}
+    main_data.externalEdges = {}
+    for a, b in external:
+        a, b = node_name(a), node_name(b)
+        edge_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        length = rng.randint(1, 100)
+        main_data.edgesToDC[edge_id] = -1
+        for v1, v2 in [(a, b), (b, a)]:
+            main_data.externalEdges.setdefault(v1, []).append(
+                graph.Edge(v1, v2, edge_id, length)
+            )
+
+    local = {}
+    for group in groups:
+        data = LocalData()
+        data.dataLock = ""
+        data.passthroughMatrix = {}
+        data.internalNodes = []
+        data.externalNodes = []
+        data.edges = {}
+        for node in nodes[group]:
+            name = node_name(node)
+            main_data.serverToDcMapping[name] = group.id
+            connections = len(main_data.externalEdges.get(name, []))
+            main_data.noExternalConnections[name] = connections
+            if connections or rng.random() < gateway_ratio:
+                data.externalNodes.append(name)
+            else:
+                data.internalNodes.append(name)
+            data.edges[name] = []
+        for a, b in edges[group]:
+            a, b = node_name(a), node_name(b)
+            edge_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            length = rng.randint(1, 100)
+            data.edges[a].append(graph.Edge(a, b, edge_id, length))
+            data.edges[b].append(graph.Edge(b, a, edge_id, length))
+            main_data.edgesToDC[edge_id] = group.id
+        local[group.id] = data
+    return local, main_data
+
+
+def measure(action, repeat) -> dict:
+    """Runs action repeat times and returns the fastest and mean time."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        action()
+        times.append(time.perf_counter() - start)
+    return {"min_seconds": min(times), "mean_seconds": sum(times) / len(times)}
+
+
+def bench_dijkstra(local, main_data, rng):
+    data = max(local.values(), key=lambda d: len(d.edges))
+    source = rng.choice(sorted(data.edges))
+    return lambda: graph.dijkstra(source, data.edges, lambda *_: None)
+
+
+def bench_search(local, main_data, rng):
+    data = max(local.values(), key=lambda d: len(d.edges))
+    network = graph.Graph.from_edges(data.edges)
+    source = network.index[rng.choice(sorted(data.edges))]
+    return lambda: network.search([(source, 0)])
+
+
+def bench_recompute(local, main_data, rng):
+    states = []
+    for name, data in local.items():
+        state = ShardState(name)
+        state.use(data)
+        states.append(state)
+
+    def run():
+        for state in states:
+            state.process_passthrough_data([], *state.rebuild_index())
+
+    return run
+
+
+def overlay_bench(engine):
+    def bench(local, main_data, rng):
+        matrices = {}
+        for name, data in local.items():
+            state = ShardState(name)
+            state.use(data)
+            _, index, _ = state.rebuild_index()
+            matrices[name] = (state.store.nodes("external"), index.matrix())
+
+        def run():
+            overlay = Overlay(engine)
+            for name, (nodes, matrix) in matrices.items():
+                overlay.update_slice(name, "", nodes, matrix)
+            overlay.update_external("", main_data.externalEdges)
+            overlay.network()
+            # The first route assembles the hierarchy, if the engine has one.
+            overlay.route(None, None, {}, {})
+
+        return run
+
+    return bench
+
+
+def bench_jsonpickle(local, main_data, rng):
+    def run():
+        for data in [*local.values(), main_data]:
+            jsonpickle.loads(jsonpickle.dumps(data))
+
+    return run
+
+
+def bench_snapshot(local, main_data, rng):
+    def run():
+        for data in local.values():
+            snapshot.load_local_data(snapshot.dump_local_data(data), LocalData())
+        snapshot.load_main_data(snapshot.dump_main_data(main_data), MainData())
+
+    return run
+
+
+BENCHMARKS = {
+    "dijkstra": bench_dijkstra,
+    "search": bench_search,
+    "recompute": bench_recompute,
+    "overlay": overlay_bench("dijkstra"),
+    "overlay_ch": overlay_bench("ch"),
+    "jsonpickle": bench_jsonpickle,
+    "snapshot": bench_snapshot,
+}
+
+
+def commit() -> str | None:
+    """Returns the commit of the working tree, if it is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="100,400", help="nodes per datacenter")
+    parser.add_argument("--ratios", default="0.05,0.2", help="gateway ratios")
+    parser.add_argument("--groups", type=int, default=4, help="datacenters")
+    parser.add_argument("--extra", type=float, default=0.5, help="extra edges/node")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--only", default=",".join(BENCHMARKS), help="benchmarks to run"
+    )
+    parser.add_argument("--output", help="file to write instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for ratio in [float(r) for r in args.ratios.split(",")]:
+            # Saved data of the previous network must not conflict.
+            fileOperations.backend = fileOperations.LocalStorage(tempfile.mkdtemp())
+            # generate_network draws from the global generator.
+            seed(args.seed)
+            rng = Random(args.seed)
+            network = generate_network(args.groups, size, size, 1, 0, args.groups)
+            for group in network[0]:
+                nodes = network[1][group]
+                extra = int(len(nodes) * args.extra)
+                generate_extra_edges(nodes, network[2][group], randint(0, extra))
+            local, main_data = convert(network, ratio, rng)
+            gateways = sum(len(data.externalNodes) for data in local.values())
+            for name in args.only.split(","):
+                action = BENCHMARKS[name](local, main_data, rng)
+                result = {
+                    "benchmark": name,
+                    "nodes": size * args.groups,
+                    "groups": args.groups,
+                    "gateway_ratio": ratio,
+                    "gateways": gateways,
+                    "repeat": args.repeat,
+                }
+                result.update(measure(action, args.repeat))
+                results.append(result)
+
+    report = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "arguments": vars(args),
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import patch
+from main.cache import ResultCache
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = ResultCache(10, 60)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", (None,))
+        self.assertEqual((None,), cache.get("a"))
+        self.assertEqual(
+            {"hits": 1, "misses": 1, "size": 1, "capacity": 10, "ttl": 60},
+            cache.stats(),
+        )
+
+    def test_expiry(self):
+        now = [100.0]
+        with patch("main.cache.monotonic", lambda: now[0]):
+            cache = ResultCache(10, 5)
+            cache.put("a", 1)
+            now[0] += 4
+            self.assertEqual(1, cache.get("a"))
+            now[0] += 2
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.stats()["size"])
+        self.assertEqual(1, cache.misses)
+
+    def test_eviction(self):
+        cache = ResultCache(2, 60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # Reading a makes b the least recently used entry.
+        self.assertEqual(1, cache.get("a"))
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual(2, cache.stats()["size"])
+
+    def test_disabled(self):
+        cache = ResultCache(0, 60)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.stats()["size"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+"""
+Set-up shared by tests and benchmarks which run workers and main in-process.
+
+Workers and main read their configuration from the environment on import,
+so this module, which gives it defaults, has to be imported before them.
+"""
+
+import os
+import tempfile
+import unittest
+from common import fileOperations
+
+for key, value in [
+    ("POD_HOST", "localhost"),
+    ("POD_PORT", "0"),
+    ("MANAGER_SERVICE_HOST", "localhost"),
+    ("MANAGER_SERVICE_PORT", "0"),
+]:
+    os.environ.setdefault(key, value)
+
+
+def use_local_storage(test: unittest.TestCase) -> str:
+    """
+    Switches storage to the local backend in a new temporary directory until
+    the test ends and returns the directory.
+    """
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    test.addCleanup(setattr, fileOperations, "backend", fileOperations.backend)
+    fileOperations.backend = fileOperations.LocalStorage(directory.name)
+    return directory.name
@@ -0,0 +1,217 @@
+"""
+Generates data of a whole network and writes it to a directory in the
+format the services read, one datacenter at a time:
+
+    python -m testing.fixtures /tmp/network --datacenters 1000 --nodes 1000
+
+The directory can then be used with STORAGE_BACKEND=local and STORAGE_PATH
+set to it. Nodes are numbers while edges are generated, so duplicate
+checks are set lookups, and only one datacenter's edges are held at once.
+"""
+
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from pathlib import Path
+from random import Random
+from types import SimpleNamespace
+import uuid
+from common import changeLog, graph, snapshot
+
+DEGREES = ["uniform", "preferential"]
+WEIGHTS = ["uniform", "exponential"]
+
+
+def datacenter_name(i) -> str:
+    """Returns A, B, ..., Z, AA, AB, ... for i = 0, 1, ..."""
+    name = ""
+    i += 1
+    while i:
+        i, letter = divmod(i - 1, 26)
+        name = chr(65 + letter) + name
+    return name
+
+
+class Generator:
+    """Draws node pairs and lengths of edges from the chosen distributions."""
+
+    def __init__(self, rng: Random, degrees, weights, min_weight, max_weight):
+        if degrees not in DEGREES:
+            raise ValueError("Unknown degree distribution: {}".format(degrees))
+        if weights not in WEIGHTS:
+            raise ValueError("Unknown weight distribution: {}".format(weights))
+        self.rng = rng
+        self.degrees = degrees
+        self.weights = weights
+        self.minWeight = min_weight
+        self.maxWeight = max_weight
+
+    def length(self) -> int:
+        if self.weights == "uniform":
+            return self.rng.randint(self.minWeight, self.maxWeight)
+        mean = (self.maxWeight - self.minWeight) / 4 or 1
+        length = self.minWeight + int(self.rng.expovariate(1 / mean))
+        return min(length, self.maxWeight)
+
+    def edges(self, node_count, edge_count) -> Iterator[tuple[int, int, int]]:
+        """
+        Yields edges (a, b, length) of a connected graph of node_count nodes:
+        a random spanning tree and then distinct extra edges, edge_count in
+        total if possible. With preferential degrees, nodes are picked with
+        probability proportional to their degree (plus one), so a few nodes
+        get many edges.
+        """
+        rng = self.rng
+        seen = set()
+        # Every connected node once plus both ends of every edge, for
+        # preferential picks.
+        ends = [0]
+        for b in range(1, node_count):
+            a = rng.choice(ends) if self.degrees == "preferential" else rng.randrange(b)
+            seen.add((a, b))
+            ends += [a, b, b]
+            yield a, b, self.length()
+
+        extra = min(edge_count, node_count * (node_count - 1) // 2) - len(seen)
+        while extra > 0:
+            if self.degrees == "preferential":
+                a, b = rng.choice(ends), rng.choice(ends)
+            else:
+                a, b = rng.randrange(node_count), rng.randrange(node_count)
+            pair = (a, b) if a < b else (b, a)
+            if a == b or pair in seen:
+                continue
+            seen.add(pair)
+            ends += pair
+            extra -= 1
+            yield a, b, self.length()
+
+
+def write_network(
+    path,
+    datacenters,
+    nodes,
+    degree=3.0,
+    external=2.0,
+    degrees="uniform",
+    weights="uniform",
+    min_weight=1,
+    max_weight=100,
+    seed=1,
+) -> dict:
+    """
+    Writes snapshots and lock files of datacenters and main into path.
+    Every datacenter has between nodes / 2 and 3 * nodes / 2 nodes and on
+    average degree edges per node. Datacenters are connected by a spanning
+    tree and on average external extra edges each, ending at random nodes,
+    which become external nodes. Returns counts of what was written.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    rng = Random(seed)
+    generator = Generator(rng, degrees, weights, min_weight, max_weight)
+    # A new base, so change log records left in path by earlier runs are
+    # not taken for records of this one.
+    lock = changeLog.make_lock(uuid.uuid4(), 0)
+
+    names = [datacenter_name(i) for i in range(datacenters)]
+    sizes = [rng.randint(max(1, nodes // 2), max(1, nodes * 3 // 2)) for _ in names]
+
+    # External edges first, so datacenters know their external nodes.
+    external_edges: dict[str, list[graph.Edge]] = {}
+    edges_to_dc: dict[str, str | int] = {}
+    count = int(datacenters * external / 2) + datacenters - 1
+    for k, (a, b, length) in enumerate(generator.edges(datacenters, count)):
+        v1 = names[a] + str(rng.randrange(sizes[a]) + 1)
+        v2 = names[b] + str(rng.randrange(sizes[b]) + 1)
+        edge_id = "x{}".format(k)
+        edges_to_dc[edge_id] = -1
+        external_edges.setdefault(v1, []).append(graph.Edge(v1, v2, edge_id, length))
+        external_edges.setdefault(v2, []).append(graph.Edge(v2, v1, edge_id, length))
+
+    server_to_dc: dict[str, str] = {}
+    connections: dict[str, int] = {}
+    edge_count = 0
+    for name, size in zip(names, sizes):
+        node_names = [name + str(i + 1) for i in range(size)]
+        edges: dict[str, list[graph.Edge]] = {node: [] for node in node_names}
+        for k, (a, b, length) in enumerate(
+            generator.edges(size, int(size * degree / 2))
+        ):
+            v1, v2 = node_names[a], node_names[b]
+            edge_id = "{}.{}".format(name, k)
+            edges[v1].append(graph.Edge(v1, v2, edge_id, length))
+            edges[v2].append(graph.Edge(v2, v1, edge_id, length))
+            edges_to_dc[edge_id] = name
+            edge_count += 1
+
+        external_nodes = []
+        internal_nodes = []
+        for node in node_names:
+            server_to_dc[node] = name
+            connections[node] = len(external_edges.get(node, ()))
+            (external_nodes if connections[node] else internal_nodes).append(node)
+
+        # Workers compute the passthrough matrix when they load the data.
+        data = SimpleNamespace(
+            dataLock=lock,
+            internalNodes=internal_nodes,
+            externalNodes=external_nodes,
+            edges=edges,
+            passthroughMatrix={},
+        )
+        (path / "data_{}.json".format(name)).write_bytes(snapshot.dump_local_data(data))
+        (path / "lock_{}.lock".format(name)).write_text(lock)
+
+    main_data = SimpleNamespace(
+        dataLock=lock,
+        dataCenters=names,
+        serverToDcMapping=server_to_dc,
+        noExternalConnections=connections,
+        edgesToDC=edges_to_dc,
+        externalEdges=external_edges,
+    )
+    (path / "datam.json").write_bytes(snapshot.dump_main_data(main_data))
+    (path / "lockm.lock").write_text(lock)
+    return {
+        "datacenters": datacenters,
+        "nodes": sum(sizes),
+        "edges": edge_count,
+        "externalEdges": len(edges_to_dc) - edge_count,
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", help="directory to write the files to")
+    parser.add_argument("--datacenters", type=int, default=3)
+    parser.add_argument("--nodes", type=int, default=10, help="mean per datacenter")
+    parser.add_argument("--degree", type=float, default=3.0, help="mean per node")
+    parser.add_argument(
+        "--external", type=float, default=2.0, help="extra external edges per dc"
+    )
+    parser.add_argument("--degrees", choices=DEGREES, default="uniform")
+    parser.add_argument("--weights", choices=WEIGHTS, default="uniform")
+    parser.add_argument("--min-weight", type=int, default=1)
+    parser.add_argument("--max-weight", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    counts = write_network(
+        args.path,
+        args.datacenters,
+        args.nodes,
+        args.degree,
+        args.external,
+        args.degrees,
+        args.weights,
+        args.min_weight,
+        args.max_weight,
+        args.seed,
+    )
+    print(
+        "Wrote {datacenters} datacenters, {nodes} nodes, {edges} edges and "
+        "{externalEdges} external edges".format(**counts)
+    )
+
+
+if __name__ == "__main__":
+    main()
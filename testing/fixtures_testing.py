@@ -0,0 +1,52 @@
+import unittest
+from random import Random
+from testing import environment
+
+from testing import fixtures
+from worker import main as worker
+
+
+class FixturesTestCase(unittest.TestCase):
+    def test_datacenter_name(self):
+        self.assertEqual(
+            ["A", "Z", "AA", "AZ", "BA"],
+            [fixtures.datacenter_name(i) for i in [0, 25, 26, 51, 52]],
+        )
+
+    def test_edges(self):
+        for degrees in fixtures.DEGREES:
+            for weights in fixtures.WEIGHTS:
+                generator = fixtures.Generator(Random(1), degrees, weights, 2, 9)
+                edges = list(generator.edges(50, 120))
+                self.assertEqual(120, len(edges))
+                pairs = {(min(a, b), max(a, b)) for a, b, _ in edges}
+                self.assertEqual(120, len(pairs))
+                self.assertTrue(all(a != b for a, b, _ in edges))
+                self.assertTrue(all(2 <= length <= 9 for _, _, length in edges))
+
+                # The first node_count - 1 edges form a spanning tree.
+                self.assertEqual(
+                    set(range(1, 50)), {max(a, b) for a, b, _ in edges[:49]}
+                )
+                self.assertTrue(all(a < b for a, b, _ in edges[:49]))
+
+        # No more edges than pairs of nodes.
+        generator = fixtures.Generator(Random(1), "uniform", "uniform", 1, 1)
+        self.assertEqual(6, len(list(generator.edges(4, 100))))
+
+    def test_write_network_twice(self):
+        directory = environment.use_local_storage(self)
+        for _ in range(2):
+            counts = fixtures.write_network(directory, 3, 10)
+            self.assertEqual(3, counts["datacenters"])
+            state = worker.ShardState("A")
+            state.refresh_data()
+            # Records of the first run are not replayed.
+            self.assertFalse(state.store.has_edge("e"))
+            nodes = state.store.nodes("internal")
+            change = state.apply_add_edge(nodes[0], nodes[1], 1, "e")
+            state.save_data([change])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -39,12 +39,14 @@ def generate_spanning_tree(nodes):
 
 
 def generate_extra_edges(nodes, edges, count, multi_edges=False):
+    seen = {tuple(edge) for edge in edges}
     for _ in range(count):
         edge = sorted(sample(nodes, 2))
 
-        if not multi_edges and edge in edges:
+        if not multi_edges and tuple(edge) in seen:
             continue
 
+        seen.add(tuple(edge))
         edges.append(edge)
 
     return edges
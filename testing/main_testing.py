@@ -0,0 +1,232 @@
+import json
+import math
+import unittest
+from unittest.mock import patch
+from testing import environment
+
+from fastapi.testclient import TestClient
+import httpx
+from common import changeLog, fileOperations
+from main import main
+from main.cache import ResultCache
+from main.overlay import Overlay
+from main.workers import Workers
+from testing import fixtures
+from worker import main as worker
+
+WORKER_URL = "http://worker"
+
+
+def edge_ids(state):
+    return sorted({edge.id for edges in state.data.edges.values() for edge in edges})
+
+
+class ServicesTestCase(unittest.TestCase):
+    """Main with workers of datacenters A and B, called in-process"""
+
+    def setUp(self):
+        self.previous = main.workers
+        fixtures.write_network(environment.use_local_storage(self), 2, 8)
+        for name in "AB":
+            state = worker.ShardState(name)
+            state.refresh_data()
+            worker.states[name] = state
+        # Requests go through httpx to the workers' app without following
+        # redirects, so paths must match the workers' routes exactly.
+        main.workers = Workers()
+        main.workers._Workers__clients[WORKER_URL] = httpx.AsyncClient(
+            base_url=WORKER_URL,
+            transport=httpx.ASGITransport(app=worker.app),
+            follow_redirects=False,
+        )
+        for name in "AB":
+            main.workers._Workers__urls[name] = (WORKER_URL, math.inf)
+            main.workers._Workers__replicas[name] = ([WORKER_URL], math.inf)
+        main.dataLog = changeLog.ChangeLog(main.dataFile, main.lockFile)
+        main.data = main.MainData()
+        main.refresh_data()
+        main.overlay = Overlay()
+        main.results = ResultCache(10, 60)
+        self.client = TestClient(main.app)
+
+    def tearDown(self):
+        worker.states.clear()
+        main.workers = self.previous
+
+    def internal_pair(self, dc):
+        """Returns two nodes of the datacenter without external edges."""
+        nodes = worker.states[dc].store.nodes("internal")
+        return nodes[0], nodes[1]
+
+
+class BatchTestCase(ServicesTestCase):
+    def changes(self):
+        a1, a2 = self.internal_pair("A")
+        b1, b2 = self.internal_pair("B")
+        return [
+            {"op": "addEdge", "v1": a1, "v2": a2, "distance": 1},
+            {"op": "addEdge", "v1": b1, "v2": b2, "distance": 1},
+            {"op": "addEdge", "v1": a1, "v2": b1, "distance": 1},
+        ]
+
+    def test_batch(self):
+        changes = self.changes()
+        response = self.client.post("/batch", json={"changes": changes})
+        self.assertEqual(200, response.status_code)
+        in_a, in_b, external = response.json()["ids"]
+        self.assertEqual("A", main.data.edgesToDC[in_a])
+        self.assertEqual("B", main.data.edgesToDC[in_b])
+        self.assertEqual(-1, main.data.edgesToDC[external])
+        self.assertIn(in_a, edge_ids(worker.states["A"]))
+        a1, b1 = changes[2]["v1"], changes[2]["v2"]
+        self.assertEqual(1, main.data.noExternalConnections[a1])
+        self.assertEqual("external", worker.states["A"].store.kind(a1))
+        self.assertEqual("external", worker.states["B"].store.kind(b1))
+
+    def test_batch_undone_after_failure(self):
+        changes = self.changes()
+        before = edge_ids(worker.states["A"]), dict(main.data.edgesToDC)
+        lock = main.data.dataLock
+        # B's worker is not ready.
+        del worker.states["B"]
+
+        response = self.client.post("/batch", json={"changes": changes})
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(before, (edge_ids(worker.states["A"]), main.data.edgesToDC))
+        self.assertEqual(lock, main.data.dataLock)
+        self.assertEqual("internal", worker.states["A"].store.kind(changes[0]["v1"]))
+
+    def test_batch_rejects_unknown_edge(self):
+        response = self.client.post(
+            "/batch", json={"changes": [{"op": "deleteEdge", "id": "unknown"}]}
+        )
+        self.assertEqual(400, response.status_code)
+
+    def test_batch_rejects_node_status(self):
+        node = self.internal_pair("A")[0]
+        change = {"op": "setNodeStatus", "node": node, "status": "external"}
+        response = self.client.post("/batch", json={"changes": [change]})
+        self.assertEqual(400, response.status_code)
+
+
+class MutationTestCase(ServicesTestCase):
+    def external_pair(self):
+        return self.internal_pair("A")[0], self.internal_pair("B")[0]
+
+    def stored(self):
+        """Returns main's data as loaded from the storage."""
+        main.reload_data()
+        return dict(main.data.noExternalConnections), dict(main.data.edgesToDC)
+
+    def test_failed_lock_write(self):
+        a, b = self.external_pair()
+        save_file = fileOperations.save_file
+
+        def fail_on_lock(path, data):
+            if path == main.lockFile:
+                raise OSError("Lock file not written")
+            save_file(path, data)
+
+        client = TestClient(main.app, raise_server_exceptions=False)
+        with patch.object(fileOperations, "save_file", fail_on_lock):
+            response = client.get("/addEdge/{}/{}/5".format(a, b))
+        self.assertEqual(500, response.status_code)
+        # The change log record was written, so the edge stays.
+        self.assertEqual(1, main.data.noExternalConnections[a])
+
+        response = client.get("/addEdge/{}/{}/5".format(a, b))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, main.data.noExternalConnections[a])
+        memory = dict(main.data.noExternalConnections), dict(main.data.edgesToDC)
+        self.assertEqual(self.stored(), memory)
+
+    def test_conflict(self):
+        a, b = self.external_pair()
+        save_file_if = fileOperations.save_file_if
+
+        def taken(path, data, generation):
+            # Another main has written main's next record.
+            if path.startswith("log_{}/".format(main.dataFile)):
+                return False
+            return save_file_if(path, data, generation)
+
+        with patch.object(fileOperations, "save_file_if", taken):
+            response = self.client.get("/addEdge/{}/{}/5".format(a, b))
+        self.assertEqual(409, response.status_code)
+        # The change is dropped from memory.
+        self.assertEqual(0, main.data.noExternalConnections[a])
+        response = self.client.get("/addEdge/{}/{}/5".format(a, b))
+        self.assertEqual(200, response.status_code)
+
+
+class RouteTestCase(ServicesTestCase):
+    def length(self, path):
+        """Returns the length of the path, following its shortest edges."""
+        edges = [main.data.externalEdges]
+        edges += [state.data.edges for state in worker.states.values()]
+        total = 0
+        for a, b in zip(path, path[1:]):
+            total += min(
+                edge.length
+                for adjacent in edges
+                for edge in adjacent.get(a, ())
+                if edge.n2 == b
+            )
+        return total
+
+    def test_route(self):
+        for a, b in [self.internal_pair("A"), (self.internal_pair("A")[0], "B1")]:
+            response = self.client.get("/getRoute/{}/{}".format(a, b))
+            self.assertEqual(200, response.status_code)
+            route = response.json()
+            self.assertEqual([a, b], [route["path"][0], route["path"][-1]])
+            self.assertEqual(route["distance"], self.length(route["path"]))
+            distance = self.client.get("/getDistance/{}/{}".format(a, b)).json()
+            self.assertEqual(route["distance"], distance["distance"])
+
+    def test_distances(self):
+        sources = list(self.internal_pair("A")) + ["B1"]
+        targets = ["B1", self.internal_pair("A")[1]]
+        query = {"sources": sources, "targets": targets}
+        response = self.client.post("/getDistances", json=query)
+        self.assertEqual(200, response.status_code)
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(sorted(sources), sorted(row["source"] for row in rows))
+        for row in rows:
+            for target, distance in zip(targets, row["distances"]):
+                path = "/getDistance/{}/{}".format(row["source"], target)
+                expected = self.client.get(path).json()["distance"]
+                self.assertEqual(expected, distance)
+
+
+class ResultCacheTestCase(ServicesTestCase):
+    def test_distance_shares_entry(self):
+        a, b = self.internal_pair("A")[0], self.internal_pair("B")[0]
+        there = self.client.get("/getDistance/{}/{}".format(a, b)).json()
+        back = self.client.get("/getDistance/{}/{}".format(b, a)).json()
+        self.assertEqual(there["distance"], back["distance"])
+        stats = self.client.get("/cacheStats").json()
+        self.assertEqual((1, 1, 1), (stats["hits"], stats["misses"], stats["size"]))
+
+    def test_hit_sends_no_requests(self):
+        a, b = self.internal_pair("A")[0], self.internal_pair("B")[0]
+        route = self.client.get("/getRoute/{}/{}".format(a, b)).json()
+        distance = self.client.get("/getDistance/{}/{}".format(a, b)).json()
+        # Workers cannot be reached anymore.
+        main.workers = Workers()
+        self.assertEqual(route, self.client.get("/getRoute/{}/{}".format(a, b)).json())
+        response = self.client.get("/getDistance/{}/{}".format(b, a))
+        self.assertEqual(distance, response.json())
+
+    def test_changes_miss(self):
+        a1, a2 = self.internal_pair("A")
+        path = "/getDistance/{}/{}".format(a1, a2)
+        self.client.get(path)
+        self.client.get("/addEdge/{}/{}/1".format(a1, a2))
+        self.assertEqual(1, self.client.get(path).json()["distance"])
+        stats = self.client.get("/cacheStats").json()
+        self.assertEqual((0, 2), (stats["hits"], stats["misses"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
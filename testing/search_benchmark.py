@@ -0,0 +1,123 @@
+"""
+Compares the work of point-to-point searches in common.graph on a grid
+shaped shard, which resembles a road network. For every method prints
+the mean number of settled nodes and the mean time per query, separately
+for nearby pairs and for random pairs.
+
+    python -m testing.search_benchmark --size 150 --pairs 50
+"""
+
+from argparse import ArgumentParser
+from random import Random
+import time
+from common import graph
+
+
+def grid_edges(size, rng):
+    """Returns a size x size grid with random lengths as Edge lists."""
+    edges = {f"{x}_{y}": [] for x in range(size) for y in range(size)}
+    for x in range(size):
+        for y in range(size):
+            for nx, ny in [(x + 1, y), (x, y + 1)]:
+                if nx < size and ny < size:
+                    a, b = f"{x}_{y}", f"{nx}_{ny}"
+                    length = rng.randint(10, 20)
+                    edges[a].append(graph.Edge(a, b, f"{a}-{b}", length))
+                    edges[b].append(graph.Edge(b, a, f"{a}-{b}", length))
+    return edges
+
+
+def legacy(edges, network, landmarks, a, b):
+    """The callback based search used before, counting settled nodes."""
+    result = graph.PathResult(a, b)
+    settled = 0
+
+    def callback(node, dist, from_):
+        nonlocal settled
+        settled += 1
+        result.callback(node, dist, from_)
+
+    graph.dijkstra(a, edges, callback)
+    return result.dist, settled
+
+
+def point_to_point(edges, network, landmarks, a, b):
+    tree = network.point_to_point(a, b)
+    return tree.distance(b), tree.settled
+
+
+def bidirectional(edges, network, landmarks, a, b):
+    tree = network.bidirectional(a, b)
+    return tree.distance(b), tree.settled
+
+
+def alt(edges, network, landmarks, a, b):
+    tree = network.point_to_point(a, b, landmarks)
+    return tree.distance(b), tree.settled
+
+
+METHODS = [legacy, point_to_point, bidirectional, alt]
+
+
+def pairs(size, count, radius, rng):
+    """Returns count pairs of nodes at most radius steps apart on each axis."""
+    res = []
+    for _ in range(count):
+        x, y = rng.randrange(size), rng.randrange(size)
+        nx = min(size - 1, max(0, x + rng.randint(-radius, radius)))
+        ny = min(size - 1, max(0, y + rng.randint(-radius, radius)))
+        res.append((f"{x}_{y}", f"{nx}_{ny}"))
+    return res
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=150)
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--landmarks", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = Random(args.seed)
+    edges = grid_edges(args.size, rng)
+    network = graph.Graph.from_edges(edges)
+    start = time.perf_counter()
+    landmarks = graph.DistanceIndex.farthest_points(network, args.landmarks)
+    print(
+        "{} nodes, {} landmarks chosen in {:.1f} ms".format(
+            len(network), args.landmarks, (time.perf_counter() - start) * 1000
+        )
+    )
+
+    workloads = {
+        "nearby": pairs(args.size, args.pairs, 3, rng),
+        "random": pairs(args.size, args.pairs, args.size, rng),
+    }
+    print("{:8} {:16} {:>12} {:>12}".format("pairs", "method", "settled", "ms/query"))
+    for name, workload in workloads.items():
+        expected = None
+        for method in METHODS:
+            settled = 0
+            distances = []
+            start = time.perf_counter()
+            for a, b in workload:
+                distance, count = method(edges, network, landmarks, a, b)
+                distances.append(distance)
+                settled += count
+            elapsed = time.perf_counter() - start
+            if expected is None:
+                expected = distances
+            elif distances != expected:
+                raise AssertionError("{} returned wrong distances".format(method))
+            print(
+                "{:8} {:16} {:>12.1f} {:>12.3f}".format(
+                    name,
+                    method.__name__,
+                    settled / len(workload),
+                    elapsed * 1000 / len(workload),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
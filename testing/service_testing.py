@@ -0,0 +1,152 @@
+import unittest
+import fakeredis
+from common import fileOperations
+from manager import service
+from models import Registration
+from testing import environment
+
+
+class LeaseTestCase(unittest.TestCase):
+    def setUp(self):
+        environment.use_local_storage(self)
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.service = service.Service()
+
+    def add_shards(self, weights: dict[str, int]):
+        for shard, weight in weights.items():
+            fileOperations.save_bytes("data_{}.json".format(shard), b"0" * weight)
+        self.service.use(self.redis)
+
+    def expire(self, shard):
+        """Ends the shard's writer lease, as if it was not renewed in time."""
+        self.redis.delete(shard)
+        self.redis.zadd(service.EXPIRY_KEY, {shard: 0})
+
+    def lease(self, url, renew=None, role="writer", budget=None):
+        lease = self.service.lease(
+            Registration(url=url, renew=renew, role=role, budget=budget)
+        )
+        return None if lease is None else (lease.name, lease.role)
+
+    def test_heaviest_first(self):
+        self.add_shards({"A": 10, "B": 30, "C": 20})
+        self.assertEqual(("B", "writer"), self.lease("w1"))
+        self.assertEqual(("C", "writer"), self.lease("w2"))
+        self.assertEqual(("A", "writer"), self.lease("w3"))
+        self.assertEqual("w1", self.redis.get("B"))
+
+    def test_budget(self):
+        self.add_shards({"A": 10, "B": 30, "C": 20})
+        self.assertEqual(("C", "writer"), self.lease("w1", budget=25))
+        self.assertEqual(("A", "writer"), self.lease("w1", budget=5 + 10))
+        self.assertIsNone(self.lease("w2", budget=5))
+
+    def test_all_candidates(self):
+        # Free shards are ordered by name; the heaviest one comes last.
+        weights = {"S{:02}".format(i): 1 for i in range(40)}
+        weights["S39"] = 2
+        self.add_shards(weights)
+        self.assertEqual(("S39", "writer"), self.lease("w1"))
+
+    def test_many_candidates(self):
+        # Weights are fetched in batches of 1000 shards.
+        weights = {"S{:04}".format(i): 1 for i in range(1500)}
+        weights["S1499"] = 2
+        self.add_shards(weights)
+        self.assertEqual(("S1499", "writer"), self.lease("w1"))
+        self.assertEqual(("S0000", "writer"), self.lease("w2", budget=1))
+
+    def test_renew(self):
+        self.add_shards({"A": 10, "B": 20})
+        self.assertEqual(("B", "writer"), self.lease("w1"))
+        self.assertEqual(("B", "writer"), self.lease("w1", renew="B"))
+        # Another worker cannot renew the lease.
+        self.assertEqual(("A", "writer"), self.lease("w2", renew="B"))
+
+    def test_expired(self):
+        self.add_shards({"A": 10})
+        self.assertEqual(("A", "writer"), self.lease("w1"))
+        self.expire("A")
+        self.assertEqual(("A", "writer"), self.lease("w2"))
+        self.assertEqual("w2", self.redis.get("A"))
+
+    def test_removed_shard(self):
+        self.add_shards({"A": 10, "B": 20})
+        fileOperations.delete_file("data_B.json")
+        self.service.discover()
+        self.assertEqual(("A", "writer"), self.lease("w1"))
+
+    def readers(self, shard):
+        return self.redis.zrange(service.READERS_KEY.format(shard), 0, -1)
+
+    def test_readers(self):
+        self.add_shards({"A": 10, "B": 20})
+        self.assertEqual(("B", "writer"), self.lease("w1"))
+        self.assertEqual(("A", "writer"), self.lease("w2"))
+        # Readers go to the shard with the fewest readers, never its writer.
+        self.assertEqual(("A", "reader"), self.lease("w1"))
+        self.assertEqual(("B", "reader"), self.lease("w2"))
+        self.assertEqual(["w1"], self.readers("A"))
+        self.assertEqual(["w2"], self.readers("B"))
+        self.assertEqual(("A", "reader"), self.lease("w3"))
+        self.assertEqual(("B", "reader"), self.lease("w4"))
+        # Every shard has READER_LEASES readers.
+        self.assertIsNone(self.lease("w5"))
+        self.assertEqual(
+            {"A": 2.0, "B": 2.0},
+            dict(self.redis.zrange(service.READER_COUNT_KEY, 0, -1, withscores=True)),
+        )
+
+    def test_reader_budget(self):
+        self.add_shards({"A": 10, "B": 20})
+        self.lease("w1")
+        self.lease("w2")
+        self.assertEqual(("A", "reader"), self.lease("w3", budget=15))
+        self.assertEqual(("A", "reader"), self.lease("w4", budget=15))
+        self.assertIsNone(self.lease("w5", budget=15))
+
+    def test_renew_reader(self):
+        self.add_shards({"A": 10})
+        self.lease("w1")
+        self.assertEqual(("A", "reader"), self.lease("w2"))
+        self.assertEqual(("A", "reader"), self.lease("w2", renew="A", role="reader"))
+        self.assertEqual(["w2"], self.readers("A"))
+        self.assertEqual(1, self.redis.zscore(service.READER_COUNT_KEY, "A"))
+        # Workers not reading the shard get a new reader lease instead.
+        self.assertEqual(("A", "reader"), self.lease("w3", renew="A", role="reader"))
+        self.assertEqual(["w2", "w3"], self.readers("A"))
+
+    def test_promotion(self):
+        self.add_shards({"A": 10})
+        self.lease("w1")
+        self.lease("w2")
+        self.expire("A")
+        # The reader renewing its lease becomes the writer.
+        self.assertEqual(("A", "writer"), self.lease("w2", renew="A", role="reader"))
+        self.assertEqual("w2", self.redis.get("A"))
+        self.assertEqual([], self.readers("A"))
+        self.assertEqual(0, self.redis.zscore(service.READER_COUNT_KEY, "A"))
+        # The old writer cannot take the lease back.
+        self.assertEqual(("A", "reader"), self.lease("w1", renew="A"))
+
+    def test_free_shard_taken_by_reader(self):
+        self.add_shards({"A": 10})
+        self.lease("w1")
+        self.lease("w2")
+        self.expire("A")
+        # A reader asking for a new lease takes the free shard it reads.
+        self.assertEqual(("A", "writer"), self.lease("w2"))
+        self.assertEqual([], self.readers("A"))
+
+    def test_expired_readers(self):
+        self.add_shards({"A": 10})
+        self.lease("w1")
+        self.lease("w2")
+        self.redis.zadd(service.READER_EXPIRY_KEY, {"A\nw2": 0})
+        self.lease("w3")
+        self.assertEqual(["w3"], self.readers("A"))
+        self.assertEqual(1, self.redis.zscore(service.READER_COUNT_KEY, "A"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from testing import environment
+
+from fastapi.testclient import TestClient
+from testing import fixtures
+from worker import main
+
+
+def edge_ids(state):
+    return sorted({edge.id for edges in state.data.edges.values() for edge in edges})
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        fixtures.write_network(environment.use_local_storage(self), 2, 8)
+        self.state = main.ShardState("A")
+        self.state.refresh_data()
+        main.states["A"] = self.state
+        self.client = TestClient(main.app)
+
+    def tearDown(self):
+        main.states.clear()
+
+    def stored(self):
+        """Returns the state as loaded from storage."""
+        state = main.ShardState("A")
+        state.refresh_data()
+        return state
+
+    def test_batch(self):
+        nodes = self.state.store.nodes("internal")
+        removed = edge_ids(self.state)[0]
+        lock = self.state.data.dataLock
+        response = self.client.post(
+            "/A/batch",
+            json={
+                "changes": [
+                    {"op": "addEdge", "v1": nodes[0], "v2": nodes[1], "distance": 1},
+                    {"op": "deleteEdge", "id": removed},
+                ]
+            },
+        )
+        self.assertEqual(200, response.status_code)
+        added, none = response.json()["ids"]
+        self.assertIsNone(none)
+        self.assertIn(added, edge_ids(self.state))
+        self.assertNotIn(removed, edge_ids(self.state))
+        # Saved once, as one change log record.
+        base, seq = lock.split(":")
+        self.assertEqual("{}:{}".format(base, int(seq) + 1), self.state.data.dataLock)
+        self.assertEqual(edge_ids(self.state), edge_ids(self.stored()))
+        self.assertEqual(1, self.state.network.dijkstra(nodes[0]).distance(nodes[1]))
+
+    def test_batch_rejects_unknown_edge(self):
+        nodes = self.state.store.nodes("internal")
+        before, lock = edge_ids(self.state), self.state.data.dataLock
+        existing = before[0]
+        for deleted in [["unknown"], [existing, existing]]:
+            changes = [
+                {"op": "addEdge", "v1": nodes[0], "v2": nodes[1], "distance": 1}
+            ] + [{"op": "deleteEdge", "id": edge_id} for edge_id in deleted]
+            response = self.client.post("/A/batch", json={"changes": changes})
+            self.assertEqual(404, response.status_code)
+        self.assertEqual(before, edge_ids(self.state))
+        self.assertEqual(lock, self.state.data.dataLock)
+
+    def test_delete_unknown_edge(self):
+        lock = self.state.data.dataLock
+        self.assertEqual(404, self.client.get("/A/deleteEdge/unknown/").status_code)
+        self.assertEqual(lock, self.state.data.dataLock)
+
+    def test_readers_cannot_write(self):
+        self.state.role = "reader"
+        response = self.client.post("/A/batch", json={"changes": []})
+        self.assertEqual(403, response.status_code)
+
+    def test_unknown_shard(self):
+        self.assertEqual(503, self.client.get("/B/getStatus").status_code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import asyncio
+import unittest
+from time import monotonic
+from unittest.mock import patch
+import httpx
+from main.workers import Workers
+
+
+class WorkersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workers = Workers()
+        self.requests = []
+
+    def serve(self, url, status):
+        """Makes the worker at url answer every request with status."""
+
+        def handler(request):
+            self.requests.append((url, request.url.path))
+            return httpx.Response(status, json={"status": "Ok", "url": url})
+
+        self.workers._Workers__clients[url] = httpx.AsyncClient(
+            base_url=url, transport=httpx.MockTransport(handler)
+        )
+
+    def test_read_skips_loading_replica(self):
+        self.serve("http://writer", 200)
+        self.serve("http://reader", 503)
+        self.workers._Workers__replicas["A"] = (
+            ["http://reader", "http://writer"],
+            monotonic() + 60,
+        )
+
+        response = asyncio.run(self.workers.request("A", "getStatus", read=True))
+        self.assertEqual("http://writer", response["url"])
+        self.assertEqual(
+            [("http://reader", "/A/getStatus"), ("http://writer", "/A/getStatus")],
+            self.requests,
+        )
+
+    def test_write_is_not_retried(self):
+        self.serve("http://writer", 503)
+        self.workers._Workers__urls["A"] = ("http://writer", monotonic() + 60)
+        with self.assertRaises(httpx.HTTPStatusError):
+            asyncio.run(self.workers.request("A", "batch", json={"changes": []}))
+        self.assertEqual(1, len(self.requests))
+
+    def test_clients_of_gone_workers_are_closed(self):
+        class Redis:
+            async def get(self, key):
+                return urls.get(key)
+
+        async def run():
+            self.workers._Workers__redis = Redis()
+            self.serve("http://old", 200)
+            self.serve("http://new", 200)
+            old = self.workers._Workers__clients["http://old"]
+            await self.workers.get("A")
+            self.assertEqual({"http://new"}, set(self.workers._Workers__clients))
+            await asyncio.sleep(0)
+            return old
+
+        urls = {"A": "http://new"}
+        with patch("main.workers.TIMEOUT", 0):
+            old = asyncio.run(run())
+        self.assertTrue(old.is_closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
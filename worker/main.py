@@ -1,28 +1,54 @@
 import os
-from common import fileOperations, graph
-from fastapi import FastAPI, HTTPException
+from common import (
+    changeLog,
+    compute,
+    graph,
+    graphStore,
+    metrics,
+    passthrough,
+    snapshot,
+)
+from fastapi import FastAPI, HTTPException, Response
 import jsonpickle
 from worker.shard import Shard
+from models import AddEdge, Batch, DeleteEdge, DistanceQuery, Segments, SetNodeStatus
 import uuid
 import logging
 import asyncio
+import threading
+from contextlib import contextmanager
+from starlette.concurrency import run_in_threadpool
 
 shard = Shard(
     os.environ["POD_HOST"],
     os.environ["POD_PORT"],
     os.environ["MANAGER_SERVICE_HOST"],
     os.environ["MANAGER_SERVICE_PORT"],
+    # Number of datacenters this worker serves at once.
+    capacity=int(os.environ.get("SHARD_LEASES", "1")),
+    # Total size in bytes of data files of the datacenters, if limited.
+    budget=int(os.environ["SHARD_BUDGET"]) if "SHARD_BUDGET" in os.environ else None,
 )
 
 app = FastAPI()
+metrics.instrument(app)
 log = logging.getLogger("uvicorn")
 logger = logging.getLogger("uvicorn")
 
-# ID if of the datacenter this worker works on.
-datacenterId = 0
-# Does this worker have authority to update the graph data for the given datacenter?
-# There can be only one worker with authority over each datacenter.
-isAuthoritative = True
+# Seconds between checks for new data written by the writer, for readers.
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", "1"))
+# Searches run in this many processes, or in the request threadpool if 0.
+pool = compute.ComputePool(int(os.environ.get("COMPUTE_PROCESSES", "0")))
+
+RECOMPUTE_SECONDS = metrics.Histogram(
+    "routing_passthrough_recompute_seconds",
+    "Time spent recomputing the distance index and the passthrough matrix.",
+    ("stage",),
+)
+# Number of landmarks guiding getInternalConnection searches.
+LANDMARK_COUNT = int(os.environ.get("LANDMARK_COUNT", "8"))
+# Number of recent versions of the passthrough matrix main gets deltas from.
+PASSTHROUGH_HISTORY = int(os.environ.get("PASSTHROUGH_HISTORY", "16"))
 
 
 class LocalData:
@@ -30,190 +56,494 @@ class LocalData:
     dataLock = ""
     # Preprocessed data for passthrough.
     passthroughMatrix = {}
-    # List of internal nodes.
+    # Internal nodes. Ordered sets (dictionaries) of the store once loaded.
     internalNodes = []
-    # List of nodes with external connections.
+    # Nodes with external connections, in the order of the matrix.
     externalNodes = []
     # List of all edges.
     edges: dict[str, list[graph.Edge]] = {}
 
 
-data = LocalData()
-dataFile = None
-lockFile = None
+class ShardState:
+    """Data of a leased datacenter together with structures built from it
 
+    A new instance is loaded off the event loop whenever the worker leases
+    another datacenter and is added to the served ones in a single
+    assignment, so requests see either no data or the fully loaded data.
+    """
 
-def update_data(lease_name):
+    def __init__(self, lease_name, role="writer"):
+        self.name = lease_name
+        # Does this worker have authority to update the graph data of the
+        # datacenter? There can be only one worker with authority over each
+        # datacenter, the writer. Other workers leasing it are readers, which
+        # follow the writer's lock file.
+        self.role = role
+        self.dataFile = "data_" + lease_name + ".json"
+        self.lockFile = "lock_" + lease_name + ".lock"
+        # Change log of the datacenter, stored next to its data file.
+        self.dataLog = changeLog.ChangeLog(self.dataFile, self.lockFile)
+        self.use(LocalData())
+        network = graph.Graph.from_edges({})
+        empty = graph.DistanceIndex(network, [])
+        self.publish(network, empty, empty.copy())
+        # Changes of the passthrough matrix between recent versions.
+        self.history = passthrough.History(PASSTHROUGH_HISTORY)
+        # Held while data is changed and saved, or refreshed from storage.
+        self.mutex = threading.RLock()
+
+    def use(self, data: LocalData):
+        """Switches to the data, indexing its nodes and edges in a new store."""
+        self.store = graphStore.GraphStore(
+            data.edges, {"external": data.externalNodes, "internal": data.internalNodes}
+        )
+        data.externalNodes = self.store.kinds["external"]
+        data.internalNodes = self.store.kinds["internal"]
+        self.data = data
+
+    def publish(self, network, index, landmarks):
+        """
+        Makes the structures built from data current for searches, all in one
+        assignment together with the data lock, so no search pairs a graph
+        with trees (or bounds) of another one. They are never changed after.
+        """
+        self.indexes = (self.data.dataLock, network, index, landmarks)
+
+    @property
+    def network(self) -> graph.Graph:
+        """Compact form of data.edges used by all searches."""
+        return self.indexes[1]
+
+    @property
+    def index(self) -> graph.DistanceIndex:
+        """Shortest path trees from every external node."""
+        return self.indexes[2]
+
+    @property
+    def landmarks(self) -> graph.DistanceIndex:
+        """Shortest path trees from nodes spread over the graph, for ALT bounds."""
+        return self.indexes[3]
+
+    def refresh_data(self):
+        """
+        For non-authoritative or just created, check if there is new data stored
+        about the region. If there is update, refresh in memory data.
+        Only the change log records after the current lock are fetched if possible.
+        """
+        with self.mutex:
+            self.__refresh_data()
+
+    def __refresh_data(self):
+
+        def load(raw_data):
+            if snapshot.is_snapshot(raw_data):
+                self.use(snapshot.load_local_data(raw_data, LocalData()))
+            else:
+                # Data saved before snapshots were introduced.
+                self.use(jsonpickle.loads(str(raw_data, "utf-8")))
+            return self.data.dataLock
+
+        last_lock = self.data.dataLock
+        lock = self.dataLog.refresh(last_lock, load, self.apply_changes)
+        if lock == last_lock:
+            return
+        self.data.dataLock = lock
+        network, index, landmarks = self.rebuild_index()
+        # The change log does not record the matrix itself.
+        self.data.passthroughMatrix = index.matrix()
+        self.publish(network, index, landmarks)
+        self.history.update(lock, self.data.passthroughMatrix)
+
+    def reload(self):
+        """Loads data from storage again, dropping changes which weren't saved."""
+        with self.mutex:
+            self.dataLog = changeLog.ChangeLog(self.dataFile, self.lockFile)
+            self.use(LocalData())
+            self.__refresh_data()
+
+    def save_data(self, new_changes: list[dict]):
+        """Save changes to the drive, as a change log record or a new snapshot."""
+        data = self.data
+
+        def dump(lock):
+            data.dataLock = lock
+            return snapshot.dump_local_data(data)
+
+        data.dataLock = self.dataLog.save(data.dataLock, new_changes, dump)
+
+    def ensure_existing_node(self, node: str):
+        if node not in self.store:
+            raise HTTPException(400, "Invalid node ID")
+
+    def ensure_existing_edge(self, edge_id: str):
+        if not self.store.has_edge(edge_id):
+            raise HTTPException(404, "Edge not found")
+
+    def rebuild_index(self) -> tuple:
+        """
+        Rebuilds the compact graph from the current edge lists and runs Dijkstra's
+        algorithm from every external node and every landmark. Read endpoints
+        answer from the result, so all the work is done once per data change.
+        Returns the graph, the index and the landmarks, to be published.
+        """
+        store = self.store
+        with RECOMPUTE_SECONDS.time("index"):
+            network = graph.Graph.from_edges(
+                store.edges, store.nodes("external") + store.nodes("internal")
+            )
+            index = graph.DistanceIndex(network, store.nodes("external"))
+            landmarks = graph.DistanceIndex.farthest_points(network, LANDMARK_COUNT)
+        return network, index, landmarks
+
+    def process_passthrough_data(
+        self, new_changes: list[dict], network, index, landmarks
+    ):
+        """
+        Updates info about internal connections from the distance index, which
+        endpoints keep up to date incrementally on copies of the current one,
+        saves the changes and then publishes the updated structures.
+        Unreachable pairs of external nodes get None in the matrix.
+        """
+        with RECOMPUTE_SECONDS.time("matrix"):
+            self.data.passthroughMatrix = index.matrix()
+        self.save_data(new_changes)
+        self.publish(network, index, landmarks)
+        self.history.update(self.data.dataLock, self.data.passthroughMatrix)
+
+    def apply_add_edge(self, v1: str, v2: str, distance: int, edge_uuid: str) -> dict:
+        """Adds an edge to the edge lists (not to the index) and returns the change."""
+        self.store.add_edge(v1, v2, edge_uuid, distance)
+        return {"op": "addEdge", "v1": v1, "v2": v2, "distance": distance, "id": edge_uuid}
+
+    def apply_delete_edge(self, edge_id: str) -> dict:
+        """Removes an edge from the edge lists (not from the index)."""
+        self.store.remove_edge(edge_id)
+        return {"op": "deleteEdge", "id": edge_id}
+
+    def apply_set_node_status(self, node_id: str, external: bool) -> dict | None:
+        """Moves the node to the given list and returns the change, if any."""
+        status = "external" if external else "internal"
+        if not self.store.set_kind(node_id, status):
+            return None
+        return {"op": "setNodeStatus", "node": node_id, "status": status}
+
+    def apply_changes(self, recorded: list[dict]):
+        """Applies changes read from the change log (not to the index)."""
+        for change in recorded:
+            if change["op"] == "addEdge":
+                self.apply_add_edge(
+                    change["v1"], change["v2"], change["distance"], change["id"]
+                )
+            elif change["op"] == "deleteEdge":
+                self.apply_delete_edge(change["id"])
+            else:
+                self.apply_set_node_status(
+                    change["node"], change["status"] == "external"
+                )
+
+
+# Loaded states of leased datacenters by name.
+states: dict[str, ShardState] = {}
+# Tasks loading states of newly leased datacenters by name.
+loading: dict[str, asyncio.Task] = {}
+
+
+async def update_data(lease_name, role):
     """
     After getting a lease for a given datacenter, worker should use
-    its data and lock file - this function updates the names of these files
-    and puts data from them in the worker's memory
+    its data and lock file - this function starts loading data from these
+    files in the background. Until it is loaded, requests are answered with 503.
+    A reader promoted to the writer of its datacenter keeps its data, and
+    data of a datacenter whose lease is lost (role None) is dropped.
     """
-    if lease_name is not None:
-        global dataFile, lockFile
-        dataFile = "data_" + lease_name + ".json"
-        lockFile = "lock_" + lease_name + ".lock"
-        refresh_data()
-
-
-@app.on_event("startup")
-async def lease():
-    """Retrieves information about which datacenter this worker is responsible for."""
-    asyncio.create_task(shard.lease(update_data))
+    if role is None:
+        states.pop(lease_name, None)
+        task = loading.pop(lease_name, None)
+        if task is not None:
+            task.cancel()
+        return
+    current = states.get(lease_name)
+    if current is not None:
+        current.role = role
+        await run_in_threadpool(current.refresh_data)
+        return
+    if lease_name not in loading:
+        loading[lease_name] = asyncio.create_task(load_state(lease_name))
 
 
-def refresh_data():
+async def load_state(lease_name):
     """
-    For non-authoritative or just created, check if there is new data stored
-    about the region. If there is update, refresh in memory data.
+    Loads the datacenter into a new state in a separate thread, so the event
+    loop keeps serving requests and renewing leases, then starts serving it.
     """
-    global data
-    if fileOperations.check_lock(lockFile, data.dataLock):
-        return
-    text_data = fileOperations.read_file(dataFile)
-    data = jsonpickle.loads(text_data)
+    try:
+        while lease_name in shard.leases():
+            staged = ShardState(lease_name)
+            try:
+                await asyncio.to_thread(staged.refresh_data)
+            except Exception as e:
+                log.warning("Loading {} failed: {}".format(lease_name, e))
+                await asyncio.sleep(REFRESH_INTERVAL)
+                continue
+            role = shard.leases().get(lease_name)
+            if role is not None:
+                staged.role = role
+                states[lease_name] = staged
+                log.info("Loaded {} at {}".format(lease_name, staged.data.dataLock))
+            return
+    finally:
+        if loading.get(lease_name) is asyncio.current_task():
+            del loading[lease_name]
+
+
+def current_state(lease_name) -> ShardState:
+    """Returns the state of the datacenter, or answers 503 if it isn't served."""
+    current = states.get(lease_name)
+    if current is None:
+        raise HTTPException(503, "Not ready: datacenter data is not loaded here")
+    return current
+
+
+def ensure_writer(current: ShardState):
+    if current.role != "writer":
+        raise HTTPException(403, "This node cannot edit data")
 
 
-def save_data():
-    """Save the current state of data to the drive."""
-    data.dataLock = str(uuid.uuid4())
-    logger.info(data)
-    text_data = jsonpickle.dumps(data)
-    logger.info(text_data)
-    fileOperations.save_file(dataFile, text_data)
-    fileOperations.save_file(lockFile, data.dataLock)
+@contextmanager
+def writing(current: ShardState):
+    """
+    Serializes changes of the shard, from validation to saving. If anything
+    fails after validation, data in memory may no longer match storage, so
+    it is loaded again; until then, requests are answered with 503.
+    """
+    with current.mutex:
+        try:
+            yield
+        except HTTPException:
+            raise
+        except Exception as error:
+            log.warning("Changing {} failed, reloading: {}".format(current.name, error))
+            try:
+                current.reload()
+            except Exception as e:
+                # follow_writer() loads it again.
+                log.warning("Reloading {} failed: {}".format(current.name, e))
+                if states.get(current.name) is current:
+                    del states[current.name]
+            if isinstance(error, changeLog.ConflictError):
+                raise HTTPException(409, "Data was changed by another writer")
+            raise
 
 
-def ensure_existing_node(node: str):
-    if (node not in data.externalNodes) and (node not in data.internalNodes):
-        raise HTTPException(400, "Invalid node ID")
+@app.on_event("startup")
+async def lease():
+    """Retrieves information about which datacenter this worker is responsible for."""
+    asyncio.create_task(shard.lease(update_data))
+    asyncio.create_task(follow_writer())
 
 
-def process_passthrough_data():
-    """Updates info about internal connections using Dijkstra's algorithm."""
-    data.passthroughMatrix = {}
-    for node in data.externalNodes:
-        result_set = graph.ResultSet1()
-        graph.dijkstra(node, data.edges, result_set.callback)
-        data.passthroughMatrix[node] = []
-        for node2 in data.externalNodes:
-            data.passthroughMatrix[node].append(result_set.res[node2])
-    save_data()
+@app.on_event("shutdown")
+async def shutdown():
+    await shard.close()
+    pool.close()
 
 
-@app.get("/test")
-def test():
+async def follow_writer():
+    """
+    Keeps data of readers up to date, and loads again data of leased shards
+    which failed to reload; Does not return.
+    """
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        for name in shard.leases():
+            if name not in states and name not in loading:
+                loading[name] = asyncio.create_task(load_state(name))
+        for current in list(states.values()):
+            if current.role == "writer":
+                continue
+            try:
+                await run_in_threadpool(current.refresh_data)
+            except Exception as e:
+                log.warning("refresh_data() of {} failed: {}".format(current.name, e))
+
+
+@app.get("/{shard_name}/test")
+def test(shard_name: str):
     """Debugging endpoint - returns dump of current data."""
-    return jsonpickle.encode(data)
+    return jsonpickle.encode(current_state(shard_name).data)
 
 
-@app.get("/test2")
-def test():
+@app.get("/{shard_name}/test2")
+def test(shard_name: str):
     """Debugging endpoint - returns name of file with data."""
-    return dataFile
+    return current_state(shard_name).dataFile
 
 
-@app.get("/getStatus")
-def get_status():
+@app.get("/{shard_name}/getStatus")
+def get_status(shard_name: str):
     """
     Get some kind of id of the current state of the network
     We don't want to send the internal data, if it hasn't changed
     """
-    return {"status": "Ok", "data": data.dataLock}
+    return {"status": "Ok", "data": current_state(shard_name).data.dataLock}
 
 
-@app.get("/getPassthroughData/{last_id}")
-def get_passthrough_data(last_id: str):
+@app.get("/{shard_name}/getPassthroughData/{last_id}")
+def get_passthrough_data(shard_name: str, last_id: str):
     """
-    Get the data about passthrough through the datacenter in control
-    If the state didn't change since last request, based on the provided id,
-    it doesn't send the data, and returns appropriate message
-    This will be calculated once per data update
-    and will use preprocessed data to answer this query.
+    Get the data about passthrough through the datacenter in control, as
+    changes of the passthrough matrix since the version of the data given
+    by its lock (last_id), or the whole matrix if that version is not one
+    of the recent ones. Nothing changed if the returned lock is last_id.
+    The matrix is calculated once per data update; the answer is binary,
+    see snapshot.dump_passthrough.
     """
-    res = {"status": "Ok"}
-
-    if last_id == get_status():
-        res["hasData"] = False
-        return res
+    delta = current_state(shard_name).history.since(last_id)
+    return Response(
+        snapshot.dump_passthrough(delta), media_type="application/octet-stream"
+    )
 
-    res["hasData"] = True
-    res["lock"] = get_status()
-    res["data"] = {}
-    res["data"]["matrix"] = data.passthroughMatrix
-    # List of nodes in the same order as in the matrix
-    res["data"]["nodes"] = data.externalNodes
-    return res
 
-
-@app.get("/getInternalConnection/{internal_node1}/{internal_node2}")
-def get_internal_connection(internal_node1: str, internal_node2: str):
+@app.get("/{shard_name}/getInternalConnection/{internal_node1}/{internal_node2}")
+async def get_internal_connection(
+    shard_name: str, internal_node1: str, internal_node2: str
+):
     """Returns distance and exact path between two internal nodes."""
-    ensure_existing_node(internal_node1)
-    ensure_existing_node(internal_node2)
-
-    graph_path = graph.PathResult(internal_node1, internal_node2)
-    graph.dijkstra(internal_node1, data.edges, graph_path.callback)
-    return {"status": "Ok", "distance": graph_path.dist, "path": graph_path.compute()}
-
-
-@app.get("/getDistancesMatrix/{internal_node1}")
-def get_distances_matrix(internal_node1: str):
+    current = current_state(shard_name)
+    current.ensure_existing_node(internal_node1)
+    current.ensure_existing_node(internal_node2)
+
+    lock, network, _, landmarks = current.indexes
+    distance, path = await pool.run(
+        current.name,
+        lock,
+        lambda: (network, landmarks),
+        compute.connection,
+        internal_node1,
+        internal_node2,
+    )
+    if path is None:
+        path = "No path was found"  # nodes are not connected
+    return {"status": "Ok", "distance": distance, "path": path}
+
+
+@app.post("/{shard_name}/expandSegments")
+async def expand_segments(shard_name: str, query: Segments):
+    """
+    Returns the shortest path of each (a, b) segment, None if a and b are
+    not connected. Paths of segments starting or ending at an external node,
+    which are all segments of routes found by main, are read from the
+    distance index without a search.
+    """
+    current = current_state(shard_name)
+    for a, b in query.segments:
+        current.ensure_existing_node(a)
+        current.ensure_existing_node(b)
+
+    lock, network, index, landmarks = current.indexes
+    paths = []
+    for a, b in query.segments:
+        try:
+            paths.append(index.path(a, b))
+        except KeyError:
+            _, path = await pool.run(
+                current.name,
+                lock,
+                lambda: (network, landmarks),
+                compute.connection,
+                a,
+                b,
+            )
+            paths.append(path)
+    return {"status": "Ok", "paths": paths}
+
+
+@app.get("/{shard_name}/getDistancesMatrix/{internal_node1}")
+def get_distances_matrix(shard_name: str, internal_node1: str):
     """Returns distance from the internal node to all external connections."""
-    ensure_existing_node(internal_node1)
+    current = current_state(shard_name)
+    current.ensure_existing_node(internal_node1)
 
-    graph_res = graph.ResultSet1()
-    graph.dijkstra(internal_node1, data.edges, graph_res.callback)
+    return {"status": "Ok", "data": current.index.distances_to_sources(internal_node1)}
 
-    return {"status": "Ok", "data": graph_res.res}
 
-
-@app.get("/addEdge/{v1}/{v2}/{distance}")
-def add_edge(v1: str, v2: str, distance: int):
+@app.post("/{shard_name}/getDistances")
+async def get_distances(shard_name: str, query: DistanceQuery):
+    """
+    Returns distances from every source and target to external nodes, as
+    getDistancesMatrix does, and distances inside the datacenter from every
+    source to every target, None if they are not connected.
+    """
+    current = current_state(shard_name)
+    for node in query.sources + query.targets:
+        current.ensure_existing_node(node)
+
+    lock, network, index, landmarks = current.indexes
+    table = await pool.run(
+        current.name,
+        lock,
+        lambda: (network, landmarks),
+        compute.distance_table,
+        query.sources,
+        query.targets,
+    )
+    gateways = {
+        node: index.distances_to_sources(node)
+        for node in query.sources + query.targets
+    }
+    return {"status": "Ok", "gateways": gateways, "distances": table}
+
+
+@app.get("/{shard_name}/addEdge/{v1}/{v2}/{distance}")
+def add_edge(shard_name: str, v1: str, v2: str, distance: int):
     """
     Add an edge between v1 and v2 internal nodes with the given distance.
     Returns the internal id of the created path.
     """
-    if not isAuthoritative:
-        raise HTTPException(403, "This node cannot edit data")
-
-    # Data checks
-    for i in [v1, v2]:
-        ensure_existing_node(i)
-
-    edge_uuid = uuid.uuid4()
-    for i in [v1, v2]:
-        if data.edges[i] is None:
-            data.edges[i] = []
-
-    data.edges[v1].append(graph.Edge(v1, v2, edge_uuid, distance))
-    data.edges[v2].append(graph.Edge(v2, v1, edge_uuid, distance))
-
-    process_passthrough_data()
+    current = current_state(shard_name)
+    ensure_writer(current)
+
+    with writing(current):
+        # Data checks
+        for i in [v1, v2]:
+            current.ensure_existing_node(i)
+
+        edge_uuid = str(uuid.uuid4())
+        change = current.apply_add_edge(v1, v2, distance, edge_uuid)
+        network = current.network.with_edge(v1, v2, edge_uuid, distance)
+        index, landmarks = current.index.copy(), current.landmarks.copy()
+        index.add_edge(network, v1, v2, distance)
+        landmarks.add_edge(network, v1, v2, distance)
+
+        current.process_passthrough_data([change], network, index, landmarks)
     return {"status": "Ok", "id": edge_uuid}
 
 
-@app.get("/deleteEdge/{edge_id}/")
-def delete_edge(edge_id: str):
+@app.get("/{shard_name}/deleteEdge/{edge_id}/")
+def delete_edge(shard_name: str, edge_id: str):
     """Delete edge with the given id."""
-    if not isAuthoritative:
-        raise HTTPException(403, "This node cannot edit data")
+    current = current_state(shard_name)
+    ensure_writer(current)
 
-    for key in data.edges.keys():
-        for element in data.edges[key]:
-            if element.id == edge_id:
-                data.edges[key].remove(element)
+    with writing(current):
+        current.ensure_existing_edge(edge_id)
+        change = current.apply_delete_edge(edge_id)
+        slots = current.network.edge_slots(edge_id)
+        network = current.network.without_edge(edge_id)
+        index, landmarks = current.index.copy(), current.landmarks.copy()
+        index.remove_edge(network, slots)
+        landmarks.remove_edge(network, slots)
 
-    process_passthrough_data()
+        current.process_passthrough_data([change], network, index, landmarks)
 
     return {"status": "Ok"}
 
 
-@app.get("/setNodeStatus/{node_id}/{status}/")
-def set_node_status(node_id: str, status: str):
+@app.get("/{shard_name}/setNodeStatus/{node_id}/{status}/")
+def set_node_status(shard_name: str, node_id: str, status: str):
     """Mark the node as either internal or external."""
-    if not isAuthoritative:
-        raise HTTPException(403, "This node cannot edit data")
+    current = current_state(shard_name)
+    ensure_writer(current)
 
     if status == "internal":
         new_type = False
@@ -224,19 +554,69 @@ def set_node_status(node_id: str, status: str):
             400, "New status is invalid: expected one of [internal, external]"
         )
 
-    if (new_type is False and node_id in data.internalNodes) or (
-        new_type is True and node_id in data.externalNodes
-    ):
-        return {"status": "Ok", "message": "No data was changed"}
-
-    if new_type is False and node_id in data.externalNodes:
-        data.externalNodes.remove(node_id)
-        data.internalNodes.append(node_id)
-    elif new_type is True and node_id in data.internalNodes:
-        data.internalNodes.remove(node_id)
-        data.externalNodes.append(node_id)
-    else:
-        raise HTTPException(400, "Invalid node ID")
+    with writing(current):
+        current.ensure_existing_node(node_id)
+        change = current.apply_set_node_status(node_id, new_type)
+        if change is None:
+            return {"status": "Ok", "message": "No data was changed"}
 
-    process_passthrough_data()
+        index = current.index.copy()
+        if new_type:
+            index.add_source(node_id)
+        else:
+            index.remove_source(node_id)
+
+        current.process_passthrough_data(
+            [change], current.network, index, current.landmarks
+        )
     return {"status": "Ok"}
+
+
+@app.post("/{shard_name}/batch")
+def batch(shard_name: str, changes: Batch):
+    """
+    Apply a list of changes at once. All of them are validated before any is
+    applied, and the index is rebuilt and data saved only once at the end.
+    Returns ids of the created edges, None for other changes.
+    """
+    current = current_state(shard_name)
+    ensure_writer(current)
+
+    with writing(current):
+        deleted = set()
+        for change in changes.changes:
+            if isinstance(change, AddEdge):
+                current.ensure_existing_node(change.v1)
+                current.ensure_existing_node(change.v2)
+            elif isinstance(change, SetNodeStatus):
+                current.ensure_existing_node(change.node)
+            else:
+                # Edges added by the batch get their ids only when applied.
+                if change.id in deleted:
+                    raise HTTPException(404, "Edge not found")
+                current.ensure_existing_edge(change.id)
+                deleted.add(change.id)
+
+        ids = []
+        recorded = []
+        for change in changes.changes:
+            if isinstance(change, AddEdge):
+                ids.append(str(uuid.uuid4()))
+                recorded.append(
+                    current.apply_add_edge(
+                        change.v1, change.v2, change.distance, ids[-1]
+                    )
+                )
+                continue
+            ids.append(None)
+            if isinstance(change, DeleteEdge):
+                recorded.append(current.apply_delete_edge(change.id))
+            else:
+                status = current.apply_set_node_status(
+                    change.node, change.status == "external"
+                )
+                if status is not None:
+                    recorded.append(status)
+
+        current.process_passthrough_data(recorded, *current.rebuild_index())
+    return {"status": "Ok", "ids": ids}
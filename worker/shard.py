@@ -1,26 +1,45 @@
 from asyncio import sleep
+from time import monotonic
 from urllib.parse import urlunsplit, urljoin
 import httpx
 from httpx import HTTPError
 import logging
+from common import metrics
 from models import Registration, Lease
 from pydantic import ValidationError
 
 TIMEOUT = 2
+# Timeout of a single lease request to the manager.
+REQUEST_TIMEOUT = 10
 
 log = logging.getLogger("uvicorn")
 
+LEASE_CHANGES = metrics.Counter(
+    "routing_worker_lease_changes_total",
+    "Leases acquired and lost by this worker.",
+    ("role", "event"),
+)
+
 
 class Shard:
-    async def __try_lease(self):
-        """Attempt to acquire a lease and return it if successful."""
+    """Leases of shards held by this worker
+
+    Up to `capacity` leases are held at once, together weighing at most
+    `budget` (None for no limit), each renewed in its own role when half of
+    its duration has passed.
+    """
+
+    async def __try_lease(self, renew: Lease | None, budget):
+        """Attempt to acquire or renew a lease and return it if successful."""
         registration = Registration(
             url=self.__pod_url,
-            renew=None if self.__lease is None else self.__lease.name,
+            renew=None if renew is None else renew.name,
+            role="writer" if renew is None else renew.role,
+            budget=budget,
         )
 
         try:
-            response = httpx.post(
+            response = await self.__client.post(
                 urljoin(self.__url, "lease"), json=registration.model_dump()
             )
             response.raise_for_status()
@@ -31,34 +50,76 @@ class Shard:
         except ValidationError:
             return None
 
-    def __init__(self, pod_host, pod_port, manager_host, manager_port):
-        self.__lease = None
+    def __init__(
+        self, pod_host, pod_port, manager_host, manager_port, capacity=1, budget=None
+    ):
+        # Held leases by shard name, with the time to renew them.
+        self.__leases: dict[str, tuple[Lease, float]] = {}
+        self.capacity = capacity
+        self.budget = budget
         self.__url = urlunsplit(("http", manager_host + ":" + manager_port, "", "", ""))
         self.__pod_url = urlunsplit(("http", pod_host + ":" + pod_port, "", "", ""))
+        self.__client = httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
 
-    async def lease(self, callback):
-        """Manage shard leasing, calling callback on change; Does not return."""
-        while True:
-            while self.__lease is None:
-                self.__lease = await self.__try_lease()
-                if self.__lease is None:
-                    await sleep(TIMEOUT)
+    async def close(self):
+        """Closes the HTTP client."""
+        await self.__client.aclose()
 
-            current = self.__lease.name
+    def __budget(self, without=None):
+        """Returns the weight the worker can still take, not counting without."""
+        if self.budget is None:
+            return None
+        held = sum(
+            lease.weight
+            for name, (lease, _) in self.__leases.items()
+            if name != without
+        )
+        return max(0, self.budget - held)
 
-            log.info("Acquired lease for {}".format(self.__lease))
+    async def __hold(self, lease: Lease, callback):
+        """Starts holding the lease, or holding it in a new role."""
+        held = self.__leases.get(lease.name)
+        self.__leases[lease.name] = (lease, monotonic() + lease.duration / 2.0)
+        if held is not None and held[0].role == lease.role:
+            return
+        log.info("Acquired lease for {}".format(lease))
+        LEASE_CHANGES.inc(lease.role, "acquired")
+        await callback(lease.name, lease.role)
 
-            callback(self.__lease.name)
+    async def __drop(self, name, callback):
+        lease, _ = self.__leases.pop(name)
+        log.info("Lease lost for {}".format((name, lease.role)))
+        LEASE_CHANGES.inc(lease.role, "lost")
+        await callback(name, None)
 
-            while self.__lease is not None and self.__lease.name == current:
-                await sleep(self.__lease.duration / 2.0)
-                self.__lease = await self.__try_lease()
+    async def lease(self, callback):
+        """
+        Manage shard leasing, awaiting callback with a shard's name and role
+        whenever it changes, with None as the role when the lease is lost;
+        Does not return.
+        """
+        while True:
+            for name, (held, renew_at) in list(self.__leases.items()):
+                if renew_at > monotonic():
+                    continue
+                lease = await self.__try_lease(held, self.__budget(without=name))
+                if lease is None or lease.name != name:
+                    # A failed renewal may still lease another shard.
+                    await self.__drop(name, callback)
+                if lease is not None:
+                    await self.__hold(lease, callback)
 
-            log.info("Lease lost for {}".format(current))
+            while len(self.__leases) < self.capacity:
+                lease = await self.__try_lease(None, self.__budget())
+                if lease is None:
+                    break
+                await self.__hold(lease, callback)
 
-    def lease_name(self):
-        """Returns currently leased shard's name."""
-        if self.__lease is None:
-            return None
+            renewals = [renew_at for _, renew_at in self.__leases.values()]
+            if len(self.__leases) < self.capacity:
+                renewals.append(monotonic() + TIMEOUT)
+            await sleep(max(0.0, min(renewals) - monotonic()))
 
-        return self.__lease.name
+    def leases(self) -> dict[str, str]:
+        """Returns roles of currently leased shards by name."""
+        return {name: lease.role for name, (lease, _) in self.__leases.items()}